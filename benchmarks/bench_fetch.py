@@ -0,0 +1,69 @@
+"""
+Compare fetching many calendars sequentially, through the batch endpoint, in parallel and filtered by search.
+Usage: python benchmarks/bench_fetch.py [calendars] [latency in ms]
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from google.auth.credentials import AnonymousCredentials
+
+from fake_calendar import FakeCalendar, FakeCalendarServer
+from util import api, links, transport
+
+
+def main(calendars=30, latency=0.05, repeats=5):
+    with FakeCalendarServer(FakeCalendar(calendars=calendars), latency=latency) as server:
+        api.root_url = server.root_url
+        api.default_account.credentials = AnonymousCredentials()
+        api.default_account.service = api.build_service(api.default_account.credentials)
+        calendar_ids = [calendar["id"] for calendar in api.get_calendar_list()]
+
+        def queries():
+            # Built from the current time on every sync, as the app does
+            now = datetime.now().astimezone()
+            return dict.fromkeys(calendar_ids, api.time_span_query(now, now + timedelta(hours=12)))
+
+        def sequential():
+            now = datetime.now().astimezone()
+            for calendar_id in calendar_ids:
+                api.get_events_in_time_span(calendar_id, now, now + timedelta(hours=12),
+                                            allow_incomplete_overlaps=True)
+
+        def batch():
+            api.list_events_for_calendars(queries())
+
+        def parallel():
+            api.list_events_for_calendars(queries(), parallel=True)
+
+        def search():
+            api.search_events_for_calendars(queries(), links.SEARCH_TERMS["zoom"])
+
+        print(f"{calendars} calendars, {latency * 1000:.0f} ms latency per request")
+        received = {}
+        for name, fetch in (("sequential", sequential), ("batch", batch), ("parallel", parallel),
+                            ("search", search)):
+            requests = server.requests
+            bytes_received = transport.pool.bytes_received
+            # Every strategy starts without cached responses, repeats are answered with 304s
+            api.response_cache.clear()
+            hits = api.response_cache.hits
+            start = time.perf_counter()
+            for _ in range(repeats):
+                fetch()
+            elapsed = (time.perf_counter() - start) / repeats
+            print(f"{name:>12}: {elapsed * 1000:8.1f} ms/sync, "
+                  f"{(server.requests - requests) / repeats:.0f} HTTP requests/sync, "
+                  f"{(api.response_cache.hits - hits) / repeats:.0f} not modified/sync, "
+                  f"{(transport.pool.bytes_received - bytes_received) / repeats / 1024:.1f} KiB/sync")
+            received[name] = transport.pool.bytes_received - bytes_received
+        print(f"Searching saved {1 - received['search'] / received['batch']:.0%} of the payload of batch")
+
+
+if __name__ == "__main__":
+    arguments = sys.argv[1:]
+    main(calendars=int(arguments[0]) if arguments else 30,
+         latency=float(arguments[1]) / 1000 if len(arguments) > 1 else 0.05)
@@ -0,0 +1,54 @@
+"""
+Compare joining with the meeting client starting cold against joining after it was pre-warmed.
+Usage: python benchmarks/bench_launch.py [start up time in s] [repeats]
+Runs a stub client standing in for Zoom, see stub_client.py.
+"""
+import os
+import statistics
+import sys
+import time
+
+import psutil
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from util.launcher import Launcher
+
+STUB = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_client.py")
+
+
+class StubLauncher(Launcher):
+    # The stub runs under the Python interpreter, so it's found by its command line instead
+    def find_processes(self):
+        return [process for process in psutil.process_iter(["cmdline"])
+                if STUB in (process.info["cmdline"] or [])[1:2]]
+
+
+def stop(launcher):
+    for process in launcher.find_processes():
+        process.kill()
+        process.wait()
+
+
+def main(startup=0.5, repeats=5):
+    os.environ["STUB_STARTUP"] = str(startup)
+    launcher = StubLauncher(STUB)
+    stop(launcher)
+    latencies = {"cold": [], "pre-warmed": []}
+    try:
+        for _ in range(repeats):
+            latencies["cold"].append(launcher.launch("zoommtg://zoom.us/join?confno=1").latency)
+            stop(launcher)
+            launcher.prewarm()
+            time.sleep(startup * 2)
+            latencies["pre-warmed"].append(launcher.launch("zoommtg://zoom.us/join?confno=1").latency)
+            stop(launcher)
+    finally:
+        stop(launcher)
+    for name, values in latencies.items():
+        print(f"{name:>10}: {statistics.median(values) * 1000:7.1f} ms median, "
+              f"{max(values) * 1000:7.1f} ms max")
+
+
+if __name__ == "__main__":
+    main(*map(float, sys.argv[1:2]), *map(int, sys.argv[2:3]))
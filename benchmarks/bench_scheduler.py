@@ -0,0 +1,44 @@
+"""
+Micro-benchmark of scheduler queue operations.
+Usage: python benchmarks/bench_scheduler.py [tasks]
+"""
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from util.scheduler import Scheduler
+
+
+def main(tasks=10000):
+    now = datetime.now().astimezone()
+    times = [now + timedelta(seconds=random.randrange(24 * 60 * 60)) for _ in range(tasks)]
+    print(f"{tasks} tasks")
+
+    # The scheduler isn't started, so no timers are created
+    scheduler = Scheduler()
+    start = time.perf_counter()
+    handles = [scheduler.add_task(task_time, lambda: None) for task_time in times]
+    for handle in handles:
+        scheduler.cancel_task(handle)
+    elapsed = time.perf_counter() - start
+    print(f"{'add + cancel':>14}: {elapsed * 1000:8.1f} ms, {elapsed / tasks * 1e6:6.2f} us/cycle")
+
+    scheduler = Scheduler()
+    start = time.perf_counter()
+    scheduler.add_tasks((task_time, lambda: None) for task_time in times)
+    elapsed = time.perf_counter() - start
+    print(f"{'bulk add':>14}: {elapsed * 1000:8.1f} ms, {elapsed / tasks * 1e6:6.2f} us/task")
+
+    start = time.perf_counter()
+    while scheduler.head:
+        scheduler._pop_head(scheduler.head)
+    elapsed = time.perf_counter() - start
+    print(f"{'pop in order':>14}: {elapsed * 1000:8.1f} ms, {elapsed / tasks * 1e6:6.2f} us/task")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
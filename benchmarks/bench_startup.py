@@ -0,0 +1,76 @@
+"""
+Compare the imports made before the tray icon shows, eagerly as before and lazily as now, and the
+time to build the API services from googleapiclient's discovery documents, parsed once.
+Usage: python benchmarks/bench_startup.py [repeats]
+Every import is timed in a fresh interpreter. PIL, pystray and pywin32 are left out, the tray
+needs them either way.
+"""
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+# What stroll.py imported before the icon showed, and what it imports now
+EAGER = ["util.api", "util.push", "util.transport", "util.cadence", "util.links", "util.metrics",
+         "util.overlap", "numpy", "util.data", "util.launcher", "util.runtime", "util.scheduler",
+         "util.settings", "util.store"]
+LAZY = ["util.cadence", "util.lazy", "util.links", "util.metrics", "util.overlap", "util.data",
+        "util.launcher", "util.runtime", "util.scheduler", "util.settings", "util.store"]
+
+TIME_IMPORTS = """
+import importlib, sys, time
+sys.path.insert(0, {src!r})
+start = time.perf_counter()
+for name in {modules!r}:
+    importlib.import_module(name)
+print(time.perf_counter() - start)
+"""
+
+
+def time_imports(modules, repeats):
+    timings = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, "-c", TIME_IMPORTS.format(src=SRC, modules=modules)],
+                                check=True, capture_output=True, text=True).stdout
+        timings.append(float(output))
+    return statistics.median(timings)
+
+
+def time_builds(repeats):
+    sys.path.insert(0, SRC)
+    from googleapiclient.discovery import build
+    from google.auth.credentials import AnonymousCredentials
+    from util import api
+
+    credentials = AnonymousCredentials()
+    timings = {}
+    for name, function in (
+            ("build (googleapiclient's static copy)",
+             lambda: build("calendar", "v3", http=api.authorized_http(credentials))),
+            ("build_service (parsed once)", lambda: api.build_service(credentials)),
+            ("get_service (built once, reused)", api.get_service)):
+        api.default_account.service = api.build_service(credentials)
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            function()
+            samples.append(time.perf_counter() - start)
+        timings[name] = statistics.median(samples)
+    return timings
+
+
+def main(repeats=5):
+    eager = time_imports(EAGER, repeats)
+    lazy = time_imports(LAZY, repeats)
+    print(f"{'eager imports':>38}: {eager * 1000:7.1f} ms")
+    print(f"{'lazy imports':>38}: {lazy * 1000:7.1f} ms ({1 - lazy / eager:.0%} less before the icon shows)")
+    print(f"{'util.api on first use':>38}: {time_imports(['util.api'], repeats) * 1000:7.1f} ms")
+    for name, timing in time_builds(repeats * 10).items():
+        print(f"{name:>38}: {timing * 1000:7.2f} ms")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 5)
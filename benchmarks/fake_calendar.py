@@ -0,0 +1,261 @@
+"""
+A local stand-in for the Calendar v3 API to benchmark against without a Google account.
+"""
+import bisect
+import json
+import threading
+import time
+from datetime import datetime, timedelta
+from email.parser import BytesFeedParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.parse import parse_qs, unquote, urlsplit
+from urllib.request import Request, urlopen
+
+
+class FakeCalendar:
+    '''Generated calendars with events spread over the day around creation.
+    Args:
+        calendars: The number of calendars.
+        events: The number of events in each calendar, recurring events count once.
+        description_size: Characters of filler in each description, before the link.
+        page_size: The most events in a page, smaller maxResults are honoured.
+        recurring_every: Every this many events recurs daily, none recur if 0.
+        occurrences: The number of instances of each recurring event.
+    '''
+
+    def __init__(self, calendars=10, events=50, description_size=200, page_size=250,
+                 recurring_every=0, occurrences=5):
+        self.page_size = page_size
+        self.version = 0
+        self.channels = {}
+        now = datetime.now().astimezone().replace(second=0, microsecond=0)
+        self.calendars = {}
+        # calendarId -> (starts, ends, instances) with recurring events expanded, ordered by start
+        self.instances = {}
+        for calendar_index in range(calendars):
+            calendar_id = f"calendar{calendar_index}@group.calendar.google.com"
+            events_list = []
+            for event_index in range(events):
+                start = now - timedelta(hours=1) + timedelta(minutes=30 * event_index)
+                description = "x" * description_size
+                if event_index % 2 == 0:
+                    description += f" https://zoom.us/j/{8000000000 + event_index}?pwd=secret{event_index}"
+                event = {
+                    "id": f"event{calendar_index}x{event_index}",
+                    "etag": f"\"{event_index}\"",
+                    "status": "confirmed",
+                    "summary": f"Event {event_index}",
+                    "description": description,
+                    "start": {"dateTime": start.isoformat()},
+                    "end": {"dateTime": (start + timedelta(minutes=25)).isoformat()},
+                }
+                if recurring_every and event_index % recurring_every == 0:
+                    event["recurrence"] = [f"RRULE:FREQ=DAILY;COUNT={occurrences}"]
+                events_list.append(event)
+            self.calendars[calendar_id] = events_list
+            self.instances[calendar_id] = self.expand(events_list)
+
+    @staticmethod
+    def expand(events):
+        '''Expand recurring events into their instances, as singleEvents=true does.'''
+        instances = []
+        for event in events:
+            start = datetime.fromisoformat(event["start"]["dateTime"])
+            end = datetime.fromisoformat(event["end"]["dateTime"])
+            if "recurrence" not in event:
+                instances.append((start.timestamp(), end.timestamp(), event))
+                continue
+            count = int(event["recurrence"][0].rsplit("COUNT=", 1)[1])
+            for day in range(count):
+                offset = timedelta(days=day)
+                instance = {key: value for key, value in event.items() if key != "recurrence"}
+                instance.update({
+                    "id": f"{event['id']}_{(start + offset).strftime('%Y%m%dT%H%M%S')}",
+                    "recurringEventId": event["id"],
+                    "start": {"dateTime": (start + offset).isoformat()},
+                    "end": {"dateTime": (end + offset).isoformat()},
+                })
+                instances.append(((start + offset).timestamp(), (end + offset).timestamp(), instance))
+        instances.sort(key=lambda instance: instance[0])
+        return [instance[0] for instance in instances], [instance[1] for instance in instances], \
+            [instance[2] for instance in instances]
+
+    def handle(self, method, url, body=None):
+        '''Answer a request with a status and a JSON serializable body.'''
+        parts = urlsplit(url)
+        path = [unquote(part) for part in parts.path.strip("/").split("/")]
+        query = {key: values[0] for key, values in parse_qs(parts.query).items()}
+        if path[:2] != ["calendar", "v3"]:
+            return 404, {"error": {"code": 404, "message": "Not Found"}}
+        path = path[2:]
+        if method == "POST":
+            return self.handle_channels(path, body)
+        if path == ["users", "me", "calendarList"]:
+            return 200, {"etag": f"\"{self.version}\"", "items": [
+                {"id": calendar_id, "summary": calendar_id} for calendar_id in self.calendars
+            ]}
+        if len(path) == 2 and path[0] == "calendars" and path[1] in self.calendars:
+            return 200, {"etag": f"\"{self.version}\"", "id": path[1], "summary": path[1]}
+        if len(path) == 3 and path[0] == "calendars" and path[2] == "events" and path[1] in self.calendars:
+            return self.list_events(path[1], query)
+        return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+    def handle_channels(self, path, body):
+        if len(path) == 4 and path[0] == "calendars" and path[2:] == ["events", "watch"]:
+            channel = {
+                "kind": "api#channel", "id": body["id"], "resourceId": f"resource-{path[1]}",
+                "expiration": str(int((time.time() + int(body["params"]["ttl"])) * 1000))
+            }
+            self.channels[body["id"]] = dict(channel, calendarId=path[1], address=body["address"],
+                                             token=body.get("token"))
+            return 200, channel
+        if path == ["channels", "stop"]:
+            self.channels.pop(body["id"], None)
+            return 204, None
+        return 404, {"error": {"code": 404, "message": "Not Found"}}
+
+    def notify(self, calendar_id, state="exists"):
+        '''Post a notification to every channel watching a calendar, as Google would.
+
+        Returns:
+            The status each channel's receiver responded with.
+        '''
+        statuses = []
+        for channel in list(self.channels.values()):
+            if channel["calendarId"] != calendar_id:
+                continue
+            self.version += 1
+            request = Request(channel["address"], method="POST", data=b"", headers={
+                "X-Goog-Channel-ID": channel["id"], "X-Goog-Channel-Token": channel["token"],
+                "X-Goog-Resource-ID": channel["resourceId"], "X-Goog-Resource-State": state,
+                "X-Goog-Message-Number": str(self.version)
+            })
+            try:
+                with urlopen(request) as response:
+                    statuses.append(response.status)
+            except HTTPError as error:
+                statuses.append(error.code)
+        return statuses
+
+    def list_events(self, calendar_id, query):
+        if "syncToken" in query:
+            if query["syncToken"] != f"sync{self.version}":
+                return 410, {"error": {"code": 410, "message": "Sync token is no longer valid"}}
+            # Nothing changes between syncs
+            return 200, {"items": [], "nextSyncToken": f"sync{self.version}"}
+        if query.get("singleEvents") == "true":
+            starts, ends, events = self.instances[calendar_id]
+        else:
+            events = self.calendars[calendar_id]
+            starts = [datetime.fromisoformat(event["start"]["dateTime"]).timestamp() for event in events]
+            ends = [datetime.fromisoformat(event["end"]["dateTime"]).timestamp() for event in events]
+        # Instances are ordered by start, so timeMax cuts the list short
+        last = bisect.bisect_left(starts, datetime.fromisoformat(query["timeMax"]).timestamp()) \
+            if "timeMax" in query and query.get("singleEvents") == "true" else len(events)
+        time_min = datetime.fromisoformat(query["timeMin"]).timestamp() if "timeMin" in query else None
+        time_max = datetime.fromisoformat(query["timeMax"]).timestamp() if "timeMax" in query else None
+        events = [event for start, end, event in zip(starts[:last], ends[:last], events[:last])
+                  if (time_min is None or end > time_min) and (time_max is None or start < time_max)]
+        if "q" in query:
+            # Roughly the server's free text search, the term appears in any text field
+            term = query["q"].lower()
+            events = [event for event in events
+                      if any(term in event.get(field, "").lower() for field in ("summary", "description", "location"))]
+        page_size = min(int(query.get("maxResults", self.page_size)), self.page_size)
+        offset = int(query.get("pageToken", 0))
+        response = {"etag": f"\"{self.version}\"", "items": events[offset:offset + page_size]}
+        if offset + page_size < len(events):
+            response["nextPageToken"] = str(offset + page_size)
+        else:
+            response["nextSyncToken"] = f"sync{self.version}"
+        return 200, response
+
+
+class FakeCalendarServer(ThreadingHTTPServer):
+    '''Serves a FakeCalendar over HTTP, including the batch endpoint.
+    Args:
+        calendar: The FakeCalendar to serve.
+        latency: Seconds added to every HTTP request, batches are delayed once.
+    '''
+    daemon_threads = True
+
+    def __init__(self, calendar, latency=0.0):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.calendar = calendar
+        self.latency = latency
+        self.requests = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def root_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.shutdown()
+        self.server_close()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Avoid delayed ACK stalls on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _respond(self, status, body, content_type="application/json"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    @staticmethod
+    def _not_modified(status, body, if_none_match):
+        # Conditional GETs are answered with an empty 304 while the etag matches
+        return status == 200 and if_none_match and isinstance(body, dict) and body.get("etag") == if_none_match
+
+    def _delay(self):
+        self.server.requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+    def do_GET(self):
+        self._delay()
+        status, body = self.server.calendar.handle("GET", self.path)
+        if self._not_modified(status, body, self.headers.get("If-None-Match")):
+            self._respond(304, b"")
+            return
+        self._respond(status, json.dumps(body).encode())
+
+    def do_POST(self):
+        self._delay()
+        content = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if urlsplit(self.path).path != "/batch/calendar/v3":
+            status, body = self.server.calendar.handle("POST", self.path, json.loads(content or "null"))
+            self._respond(status, b"" if body is None else json.dumps(body).encode())
+            return
+        parser = BytesFeedParser()
+        parser.feed(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + content)
+        boundary = "batch_boundary"
+        parts = []
+        for part in parser.close().get_payload():
+            request_line, *header_lines = part.get_payload().lstrip().split("\r\n\r\n", 1)[0].splitlines()
+            method, url, _ = request_line.split(" ", 2)
+            headers = dict(line.split(": ", 1) for line in header_lines if ": " in line)
+            status, body = self.server.calendar.handle(method, url)
+            content = json.dumps(body)
+            if self._not_modified(status, body, headers.get("If-None-Match") or headers.get("if-none-match")):
+                status, content = 304, ""
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\n"
+                f"Content-ID: <response-{part['Content-ID'][1:]}\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                f"Content-Type: application/json\r\n\r\n{content}\r\n")
+        body = "".join(parts) + f"--{boundary}--\r\n"
+        self._respond(200, body.encode(), f"multipart/mixed; boundary={boundary}")
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+Stands in for the meeting client on Linux: starting takes a while, later launches hand their URL to
+the running instance and exit.
+Usage: stub_client.py [--url=<url>], the start up time in seconds is read from STUB_STARTUP.
+"""
+import fcntl
+import os
+import sys
+import tempfile
+import time
+
+lock_file = open(os.path.join(tempfile.gettempdir(), "stroll-stub-client.lock"), "w")
+try:
+    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+except BlockingIOError:
+    # Already running, hand over the URL
+    sys.exit(0)
+
+# Start up, keeping the CPU busy like a client loading
+deadline = time.perf_counter() + float(os.environ.get("STUB_STARTUP", "0.5"))
+while time.perf_counter() < deadline:
+    pass
+# Ready, wait for input
+while True:
+    time.sleep(60)
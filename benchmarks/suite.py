@@ -0,0 +1,248 @@
+"""
+Repeatable benchmarks of syncing, scheduling, settings access and link extraction against a local
+fake of the Calendar API, reporting throughput and p50/p99 latencies.
+Usage: python benchmarks/suite.py [--calendars N] [--events M] [--latency MS] ... [--save FILE] [--compare FILE]
+Run with --help for every option. Saved results can be compared against later runs to spot regressions.
+"""
+import argparse
+import copy
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from google.auth.credentials import AnonymousCredentials
+
+from fake_calendar import FakeCalendar, FakeCalendarServer
+from util import api, links, transport
+from util.data import TomlFile
+from util.path import from_root
+from util.scheduler import Scheduler
+from util.settings import Settings
+
+
+class Result:
+    '''The latencies of the runs of a benchmark, each run doing `operations` operations.'''
+
+    def __init__(self, name, latencies, operations=1):
+        self.name = name
+        self.latencies = sorted(latencies)
+        self.operations = operations
+
+    def percentile(self, q):
+        # Nearest rank, exact for the sample sizes used here
+        return self.latencies[min(int(q * len(self.latencies)), len(self.latencies) - 1)]
+
+    @property
+    def throughput(self):
+        return self.operations * len(self.latencies) / sum(self.latencies)
+
+    def to_json(self):
+        return {"p50": self.percentile(0.5), "p99": self.percentile(0.99), "throughput": self.throughput,
+                "runs": len(self.latencies), "operations": self.operations}
+
+
+def measure(name, function, runs, operations=1, setup=None, warmup=1):
+    '''Time runs of function, setup (untimed) runs before each and its result is passed to function.'''
+    latencies = []
+    for run in range(warmup + runs):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        function(argument) if setup else function()
+        elapsed = time.perf_counter() - start
+        if run >= warmup:
+            latencies.append(elapsed)
+    return Result(name, latencies, operations)
+
+
+# SYNC
+
+def bench_sync(options):
+    calendar = FakeCalendar(calendars=options.calendars, events=options.events,
+                            description_size=options.description_size, page_size=options.page_size,
+                            recurring_every=options.recurring_every, occurrences=options.occurrences)
+    with FakeCalendarServer(calendar, latency=options.latency) as server:
+        api.root_url = server.root_url
+        api.default_account.credentials = AnonymousCredentials()
+        api.default_account.service = api.build_service(api.default_account.credentials)
+        calendar_ids = [entry["id"] for entry in api.get_calendar_list()]
+        now = datetime.now().astimezone()
+        # Wide enough to page through every instance
+        time_from, time_to = now - timedelta(days=1), now + timedelta(minutes=30 * options.events + 24 * 60 * options.occurrences)
+        query = api.time_span_query(time_from, time_to)
+        events = sum(len(calendar.instances[calendar_id][2]) for calendar_id in calendar_ids)
+
+        def cold(function):
+            # Downloads in full instead of being answered with 304s
+            return lambda: (api.response_cache.clear(), function())
+
+        def time_span():
+            for calendar_id in calendar_ids:
+                api.get_events_in_time_span(calendar_id, time_from, time_to, allow_incomplete_overlaps=True)
+
+        def batch():
+            api.list_events_for_calendars(dict.fromkeys(calendar_ids, query))
+
+        def parallel():
+            api.list_events_for_calendars(dict.fromkeys(calendar_ids, query), parallel=True)
+
+        def full_sync():
+            api.default_account.mirror = api.EventMirror()
+            api.sync_many_events(calendar_ids)
+
+        def incremental_sync():
+            api.sync_many_events(calendar_ids)
+
+        results = [
+            measure("sync: get_events_in_time_span", cold(time_span), options.runs, events),
+            measure("sync: batch list", cold(batch), options.runs, events),
+            measure("sync: parallel list", cold(parallel), options.runs, events),
+            measure("sync: batch list, cached", batch, options.runs, events),
+            measure("sync: full sync", cold(full_sync), options.runs, events),
+        ]
+        # The last full sync left sync tokens behind
+        results.append(measure("sync: incremental sync", incremental_sync, options.runs, len(calendar_ids)))
+        requests = server.requests
+    api.default_account.mirror = api.EventMirror()
+    transport.pool.close()
+    print(f"{len(calendar_ids)} calendars, {events} events with instances, {requests} HTTP requests")
+    return results
+
+
+# SCHEDULING
+
+def bench_scheduling(options):
+    now = datetime.now().astimezone()
+    times = [now + timedelta(seconds=random.randrange(24 * 60 * 60)) for _ in range(options.tasks)]
+
+    def add_and_cancel():
+        # The scheduler isn't started, so no timers are created
+        scheduler = Scheduler()
+        handles = [scheduler.add_task(task_time, None) for task_time in times]
+        for handle in handles:
+            scheduler.cancel_task(handle)
+
+    def bulk_add():
+        Scheduler().add_tasks((task_time, None) for task_time in times)
+
+    return [
+        measure("schedule: add_task + cancel_task", add_and_cancel, options.runs, options.tasks),
+        measure("schedule: add_tasks", bulk_add, options.runs, options.tasks),
+    ]
+
+
+# SETTINGS
+
+def bench_settings(options):
+    directory = tempfile.mkdtemp()
+    settings = TomlFile(os.path.join(directory, "settings.user.toml"), from_root("settings.default.toml"),
+                        snapshot_type=Settings)
+    settings.load()
+    paths = ["Joining.auto-join", "Syncing.range-to-sync", "Syncing.calendars", "General.zoom-path"]
+    lookups = 1000
+
+    def get():
+        for _ in range(lookups // len(paths)):
+            for path in paths:
+                settings.get(path)
+
+    def snapshot():
+        for _ in range(lookups // len(paths)):
+            settings.snapshot.joining.auto_join
+            settings.snapshot.syncing.range_to_sync
+            settings.snapshot.syncing.calendars
+            settings.snapshot.general.zoom_path
+
+    return [
+        measure("settings: DataFileInterface.get", get, options.runs, lookups),
+        measure("settings: snapshot attribute", snapshot, options.runs, lookups),
+        measure("settings: reload_if_changed", settings.reload_if_changed, options.runs),
+    ]
+
+
+# LINK EXTRACTION
+
+def bench_links(options):
+    calendar = FakeCalendar(calendars=1, events=options.events, description_size=options.description_size)
+    events = next(iter(calendar.calendars.values()))
+
+    def fresh_events():
+        # Unseen versions are scanned instead of being served from the cache
+        copies = copy.deepcopy(events)
+        for event in copies:
+            event["etag"] = f"\"{random.random()}\""
+        return copies
+
+    def scan(copies):
+        for event in copies:
+            links.find_meeting(event)
+
+    def cached():
+        for event in events:
+            links.find_meeting(event)
+
+    return [
+        measure("links: find_meeting, unseen", scan, options.runs, len(events), setup=fresh_events),
+        measure("links: find_meeting, cached", cached, options.runs, len(events)),
+    ]
+
+
+BENCHMARKS = {"sync": bench_sync, "scheduling": bench_scheduling, "settings": bench_settings, "links": bench_links}
+
+
+def report(results, baseline=None):
+    print(f"{'benchmark':<36} {'ops/s':>12} {'p50':>10} {'p99':>10}")
+    for result in results:
+        line = (f"{result.name:<36} {result.throughput:12.0f} {result.percentile(0.5) * 1000:8.2f}ms "
+                f"{result.percentile(0.99) * 1000:8.2f}ms")
+        if baseline and result.name in baseline:
+            change = result.percentile(0.5) / baseline[result.name]["p50"] - 1
+            line += f"  {change:+.0%} p50"
+        print(line)
+
+
+def main(arguments=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("benchmarks", nargs="*", metavar="benchmark",
+                        help=f"The benchmarks to run, out of {', '.join(BENCHMARKS)}. All of them by default")
+    parser.add_argument("--calendars", type=int, default=10)
+    parser.add_argument("--events", type=int, default=100, help="Events per calendar")
+    parser.add_argument("--description-size", type=int, default=500, help="Characters in each description")
+    parser.add_argument("--recurring-every", type=int, default=5, help="Every this many events recurs, 0 for none")
+    parser.add_argument("--occurrences", type=int, default=5, help="Instances of each recurring event")
+    parser.add_argument("--page-size", type=int, default=250, help="The most events the server returns per page")
+    parser.add_argument("--latency", type=float, default=0, help="Milliseconds added to every HTTP request")
+    parser.add_argument("--tasks", type=int, default=10000, help="Tasks to schedule")
+    parser.add_argument("--runs", type=int, default=20, help="Timed runs of each benchmark")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="Write the results to a JSON file")
+    parser.add_argument("--compare", help="Compare p50 latencies against results saved with --save")
+    options = parser.parse_args(arguments)
+    unknown = set(options.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+    options.latency /= 1000
+    random.seed(options.seed)
+
+    results = []
+    for name in options.benchmarks or BENCHMARKS:
+        results.extend(BENCHMARKS[name](options))
+    baseline = None
+    if options.compare:
+        with open(options.compare) as file:
+            baseline = json.load(file)["results"]
+    report(results, baseline)
+    if options.save:
+        with open(options.save, "w") as file:
+            json.dump({"options": vars(options), "python": sys.version,
+                       "results": {result.name: result.to_json() for result in results}}, file, indent=2)
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,20 @@
 import os
-import re
 import sys
 import threading
 from datetime import datetime, time, timedelta
-import httplib2
 
-import win32com.client
 from PIL import Image
 from pystray import Icon, Menu, MenuItem as Item
 
-from util import api
+from util import cadence, joins, lazy, links, metrics, overlap
+from util.coalesce import WindowCache
 from util.data import TomlFile, JsonFile
+from util.launcher import Launcher
 from util.path import from_root
+from util.runtime import Runtime
 from util.scheduler import Scheduler
+from util.settings import Settings
+from util.store import EventStore
 
 ICON = Image.open(from_root("images\\stroll.ico"))
 SCOPES = [
@@ -22,120 +24,425 @@ SCOPES = [
     "https://www.googleapis.com/auth/userinfo.email",
     "openid"
 ]
-REGEXP = r'(\d+)\?pwd=(\w+)'
+# Seconds to wait for the user to authorize in the browser
+AUTH_TIMEOUT = 5 * 60
 
-scheduler = Scheduler()
+# The scheduler, sync loop and blocking API calls share one event loop thread and its executor
+runtime = Runtime()
+scheduler = Scheduler(runtime)
 settings = TomlFile(from_root("settings.user.toml"),
-                    from_root("settings.default.toml"))
+                    from_root("settings.default.toml"), snapshot_type=Settings)
 data = JsonFile(from_root("data\\data.user.json"),
                 from_root("data\\data.default.json"))
+# Synced calendars of every account are kept in the store, the API is only used to fetch changes
+store = EventStore(from_root("data\\events.db"))
+
+
+def on_api_load(module):
+    # Each account keeps its calendars in the store, accounts linked in earlier runs are loaded too
+    module.mirror_factory = store.for_account
+    module.default_account.mirror = store.for_account(module.DEFAULT_ACCOUNT)
+    module.load_accounts()
+
+
+# The Google client libraries take longer to import than the rest of Stroll, they're imported on first
+# use so that the tray icon shows without waiting for them
+api = lazy.LazyModule("util.api", on_load=on_api_load)
+transport = lazy.LazyModule("util.transport")
+push = lazy.LazyModule("util.push")
+# Starts Zoom, the path is filled in from the settings
+launcher = Launcher("")
+
+# METRICS
+join_count = metrics.registry.counter("stroll_joins_total", "Meetings joined")
+offline_notification_count = metrics.registry.counter(
+    "stroll_offline_notifications_total", "Times the user was told the device is offline")
+zoom_events_latency = metrics.registry.histogram(
+    "stroll_get_zoom_events_seconds", "Time taken to find the Zoom events in a time span")
+calendars_gauge = metrics.registry.gauge("stroll_calendars", "Calendars selected at the last sync", ["account"])
+events_gauge = metrics.registry.gauge("stroll_zoom_events", "Zoom events found by the last query")
+sync_latency = metrics.registry.histogram("stroll_sync_seconds", "Time taken by each sync", ["outcome"])
+scheduled_joins_gauge = metrics.registry.gauge("stroll_scheduled_joins", "Joins scheduled in the sync horizon")
+metrics_export = metrics.RollingExport(metrics.registry, from_root("data\\metrics.json"))
 
 # UTILITY FUNCTIONS
 
-def convert_time_to_timedelta(time):
-    if time is None:
-        return None
-    # associate time with a date to allow operations
-    start = datetime.min
-    end = datetime.combine(datetime.min, time)
-    td = end - start
-    return td
+def join_event(event):
+    global settings
+    meeting = event.get("meeting") or links.find_meeting(event)
+    url = f"zoommtg://{meeting.host}/join?action=join&confno={meeting.number}"
+    if meeting.password:
+        url += f"&pwd={meeting.password}"
+    join_count.inc()
+    launch = get_launcher().launch(url)
+    if launch.error is not None:
+        notify_launch_error(launch.error)
 
 
-def join_event(event):
-    global REGEXP, settings
-    description = event.get("description")
-    pattern = re.search(REGEXP, description)
-    url = f"zoommtg://zoom.us/join?action=join&confno={pattern.group(1)}&pwd={pattern.group(2)}"
-    zoom_path = settings.get("General.zoom-path")
-    # NOTE: This blocks the containing directory from deletion as a side effect
-    command = f"{zoom_path} --url=\"{url}\""
-    os.popen(command)
+def get_launcher():
+    # The path may be changed in the settings at any time
+    launcher.path = settings.snapshot.general.zoom_path
+    return launcher
+
+
+def prewarm_client():
+    # Zoom start-up and login shouldn't affect prejoin period
+    client = get_launcher()
+    if not client.prewarm() and client.start_error is not None:
+        notify_launch_error(client.start_error)
+
+
+def notify_launch_error(error):
+    tray_icon.notify(f"Couldn't start Zoom, check zoom-path in the settings: {str(error)[:200]}")
 
 
 def notify_on_error(function, *args, **kwargs):
+    # Returns what function returns, or None once the user has been told about the error it raised
     try:
-        function(*args, **kwargs)
+        return function(*args, **kwargs)
     except Exception as e:
-        tray_icon.notify(f"Whoa! An error occurred: {e[:200]}")
+        tray_icon.notify(f"Whoa! An error occurred: {str(e)[:200]}")
 
 
-def notify_on_ServerNotFound(function):
-    def patched(*args, **kwargs):
-        try:
-            return function(*args, **kwargs)
-        except httplib2.error.ServerNotFoundError:
-            tray_icon.notify("Device is offline, please try again when connected.")
-    return patched
-for func_name in ("get_creds", "get_user_info", "get_calendar_list", "get_events_in_time_span"):
-    setattr(api, func_name, notify_on_ServerNotFound(getattr(api, func_name)))
+# The outage the user was last told about, background syncs only tell the user once per outage
+notified_outage = None
+
+
+def notify_offline(always=False):
+    global notified_outage
+    if always or api.breaker.opened_at != notified_outage:
+        notified_outage = api.breaker.opened_at
+        offline_notification_count.inc()
+        tray_icon.notify("Device is offline, please try again when connected.")
+
+
+def run_join_action(action):
+    # Joins are asked for by the user, their API calls take priority over background syncs
+    def run():
+        with api.priority(api.CRITICAL):
+            try:
+                action()
+            except api.OfflineError:
+                notify_offline(always=True)
+    return runtime.run_blocking(run)
+
+# ACCOUNTS
+
+# Seconds each account is waited on, an account that's slower is left to catch up in the background
+ACCOUNT_TIMEOUT = 60
+
+
+def linked_accounts():
+    # The accounts with credentials, reading them from disk only the first time
+    linked = []
+    for account in list(api.accounts.values()):
+        account.credential_manager.load()
+        if account.credential_manager.has_credentials():
+            linked.append(account)
+    return linked
+
+
+def get_account_email(account):
+    # From memory, or as saved by an earlier run until the user info has been fetched
+    user_info = account.credential_manager.get_cached_user_info()
+    if user_info:
+        return user_info.get("email")
+    if account.name == api.DEFAULT_ACCOUNT:
+        return data.get("email")
+    return (data.get("emails") or {}).get(account.name)
+
+
+def set_account_email(account, email):
+    if account.name == api.DEFAULT_ACCOUNT:
+        data.set("email", email, dump=True)
+        return
+    emails = dict(data.get("emails") or {})
+    if email is None:
+        emails.pop(account.name, None)
+    else:
+        emails[account.name] = email
+    data.set("emails", emails, dump=True)
+
+
+def update_account_email(account):
+    # Fetches the user info if it's stale, the menu is only rebuilt if the email changed
+    saved_email = get_account_email(account)
+    user_info = account.credential_manager.get_user_info()
+    if user_info and user_info.get("email") != saved_email:
+        set_account_email(account, user_info.get("email"))
+        tray_icon.update_menu()
+
+
+# Accounts the user has been told are failing, each is only told about again once it has recovered
+notified_account_failures = set()
+
+
+def raise_if_all_failed(results):
+    # One account failing doesn't hold up the others, errors are only raised if every account failed
+    errors = {name: result for name, result in results.items() if isinstance(result, Exception)}
+    notified_account_failures.intersection_update(errors)
+    if results and len(errors) < len(results):
+        for name, error in errors.items():
+            # Being offline is told about by notify_offline
+            if name not in notified_account_failures and not isinstance(error, api.OfflineError):
+                notified_account_failures.add(name)
+                tray_icon.notify(f"Failed to reach account {name}: {str(error)[:200]}")
+    if results and len(errors) == len(results):
+        offline = [error for error in errors.values() if isinstance(error, api.OfflineError)]
+        raise (offline or list(errors.values()))[0]
+
+
+def remove_linked_account(account):
+    # The account's channels are stopped while its credentials are still around
+    if push_channels:
+        with api.use_account(account):
+            push_channels.watch((), renew_before=datetime.now().astimezone())
+    set_account_email(account, None)
+    empty_accounts_synced_at.pop(account.name, None)
+    api.remove_account(account.name)
+    zoom_events.invalidate()
+
+
+def unlink_account(account):
+    email = get_account_email(account)
+    remove_linked_account(account)
+    tray_icon.notify(f"Unlinked {email or 'the account'}")
+    tray_icon.update_menu()
+    # The account's joins are dropped by the new sync loop
+    auto_sync()
+
 
 # API INTERACTION
-def attempt_auth_BLOCKING(sysTrayIcon):  # Unsafe due to reasons below
+def attempt_auth_BLOCKING(sysTrayIcon):
+    # The first account is linked as the default account, later ones are added alongside it
+    api.default_account.credential_manager.load()
+    if api.default_account.credential_manager.has_credentials():
+        account = api.add_account()
+    else:
+        account = api.default_account
     try:
-        creds = api.get_creds(SCOPES, show_auth_prompt=False, reuse_creds=False)
-        user_info = api.get_user_info(creds)
+        account.credential_manager.link(auth_timeout=AUTH_TIMEOUT)
+        user_info = account.credential_manager.get_user_info()
         if user_info:
-            data.set("email", user_info.get("email"))
-            sysTrayIcon.notify(f"Successfully linked to {user_info.get('email')}")
+            email = user_info.get("email")
+            # Linking an account again replaces it instead of syncing it twice
+            for other in linked_accounts():
+                if other is not account and get_account_email(other) == email:
+                    remove_linked_account(other)
+            set_account_email(account, email)
+            sysTrayIcon.notify(f"Successfully linked to {email}")
             sysTrayIcon.update_menu()
         auto_sync()
     except Exception as e:
+        if account is not api.default_account and not account.credential_manager.has_credentials():
+            api.remove_account(account.name)
         sysTrayIcon.notify(f"Failed to link to account: {str(e)[:200]}")
 
-# This function is blocking (due to run_local_server). This wouldn't be an issue if it was a
-# guarantee that the function would always terminate by timeout, but since it's not, we need
-# to use a separate thread for this function. This thread is left to hang around until the 
-# program is terminated (to avoid side effects), where it's killed forcefully.
+# This function is blocking (due to run_local_server) until the user authorizes or AUTH_TIMEOUT
+# passes, so it's run on its own thread instead of holding up joins on the runtime's executor.
+# Only one account is linked at a time
+auth_lock = threading.Lock()
+
 
 def attempt_auth(sysTrayIcon):  # non-blocking
-    thread = threading.Thread(target=attempt_auth_BLOCKING, args=(sysTrayIcon,))
-    thread.daemon = True  # If the program terminates, this thread will be terminated
-    thread.start()
+    if not auth_lock.acquire(blocking=False):
+        sysTrayIcon.notify("Already waiting for an account to be linked, please finish in the browser")
+        return
 
-def get_zoom_events(time_from, time_to, filters=None):
-    events = []
+    def run():
+        try:
+            attempt_auth_BLOCKING(sysTrayIcon)
+        finally:
+            auth_lock.release()
+    threading.Thread(target=run, name="stroll-auth", daemon=True).start()
+
+
+def is_timed(event):
+    # All-day events span whole days, they aren't meetings to be joined
+    return "dateTime" in event["start"]
+
+
+def has_zoom_link(event):
+    # Attach the meeting so that joining doesn't have to look for it again
+    event["meeting"] = links.find_meeting(event)
+    return event["meeting"] is not None
+
+
+def get_selected_calendar_ids():
+    # The selected calendars of the account in use
+    global settings
     calendar_list = api.get_calendar_list()
-    calendars_filter = settings.get("Syncing.calendars")
+    calendars_filter = settings.snapshot.syncing.calendars
     if not calendar_list:  # In case of an error
-        return []
+        return None
+    calendar_ids = []
     for calendar in calendar_list:
         # Apply calendar filter from settings
         if (calendar not in calendars_filter) and ("*" not in calendars_filter):
             # calendar not specifically mentioned and the wildcard hasn't been applied
             # skip this calendar
             continue
+        calendar_ids.append(calendar.get("id"))
+    calendars_gauge.labels(api.get_account().name).set(len(calendar_ids))
+    return calendar_ids
+
+
+# When accounts without any selected calendars were last synced, their stores have no sync times
+empty_accounts_synced_at = {}
+
+
+def sync_account(account):
+    # Runs with the account in use, see api.for_each_account
+    global settings
+    calendar_ids = get_selected_calendar_ids()
+    if calendar_ids is None:
+        return
+    if calendar_ids:
+        empty_accounts_synced_at.pop(account.name, None)
+    else:
+        empty_accounts_synced_at[account.name] = datetime.now().astimezone()
+    fetch = settings.snapshot.syncing.fetch
+    if fetch == "sequential":
+        for calendar_id in calendar_ids:
+            api.sync_events(calendar_id)
+    else:
+        api.sync_many_events(calendar_ids, parallel=fetch == "parallel")
+    # Drop calendars that have been deselected since the last sync
+    for calendar_id in account.mirror.get_calendar_ids():
+        if calendar_id not in calendar_ids:
+            account.mirror.forget(calendar_id)
+
+
+def sync_calendars():
+    # Accounts are synced concurrently over the shared connection pool
+    results = api.for_each_account(sync_account, linked_accounts(), timeout=ACCOUNT_TIMEOUT)
+    zoom_events.invalidate()
+    raise_if_all_failed(results)
+
+
+def sync_if_stale():
+    # The store is kept fresh by the sync loop, it's only stale if the loop isn't running or is overdue.
+    # Syncs may be far apart while they back off or changes are pushed, the loop's next sync is trusted
+    last_synced = [account.mirror.get_last_synced() or empty_accounts_synced_at.get(account.name)
+                   for account in linked_accounts()]
+    if None in last_synced:
+        sync_calendars()
+        return
+    if not last_synced:
+        return
+    now = datetime.now().astimezone()
+    decision = sync_cadence and sync_cadence.last_decision
+    # A sync in progress is given as long as its accounts are waited on
+    if (settings.snapshot.joining.auto_join and scheduler.active and decision
+            and now < decision.time + timedelta(seconds=ACCOUNT_TIMEOUT)):
+        return
+    if now - min(last_synced) > settings.snapshot.syncing.period:
+        sync_calendars()
+
 
-        calendar_id = calendar.get("id")
-        range_to_sync = convert_time_to_timedelta(
-            settings.get("Syncing.range-to-sync"))
-        possible_events = api.get_events_in_time_span(
-            calendar_id, time_from, time_to, 
-            allow_incomplete_overlaps=True, filters=filters or ["+Inside", "+OverStart", "+OverEnd", "+Across"]
-        )
-        # Store only zoom link containing events
-        for event in possible_events:
-            if event.get("description") and bool(re.search(REGEXP, event.get("description"))):
-                events.append(event)
-    # NOTE: Timezone conversion isn't required here (constant offset)
-    events.sort(key=lambda event: datetime.fromisoformat(
-        event.get("start").get("dateTime")))
+def get_search_terms():
+    # Terms to filter events by on the server, none if server side filtering is off
+    server_filter = settings.snapshot.syncing.server_filter
+    if server_filter is True:
+        return [term for terms in links.SEARCH_TERMS.values() for term in terms]
+    return list(server_filter or ())
+
+
+ALL_OVERLAPS = ["+Inside", "+OverStart", "+OverEnd", "+Across"]
+
+
+def fetch_account_events(time_from, time_to):
+    # The events of the account in use overlapping the time span, fetched from the API
+    calendar_ids = get_selected_calendar_ids()
+    if calendar_ids is None:
+        return []
+    events = []
+    fetch = settings.snapshot.syncing.fetch
+    # Server side matches are only candidates, has_zoom_link still validates them
+    search_terms = get_search_terms()
+    if fetch == "sequential":
+        for calendar_id in calendar_ids:
+            events.extend(api.get_events_in_time_span(
+                calendar_id, time_from, time_to,
+                allow_incomplete_overlaps=True, filters=ALL_OVERLAPS, search_terms=search_terms
+            ))
+    else:
+        query = api.time_span_query(time_from, time_to)
+        if search_terms:
+            results = api.search_events_for_calendars(
+                dict.fromkeys(calendar_ids, query), search_terms, parallel=fetch == "parallel")
+        else:
+            results = api.list_events_for_calendars(
+                dict.fromkeys(calendar_ids, query), parallel=fetch == "parallel")
+            results = {calendar_id: result if isinstance(result, Exception) else result[0]
+                       for calendar_id, result in results.items()}
+        for result in results.values():
+            if not isinstance(result, Exception):
+                events.extend(result)
+    return events
+
+
+# The accounts that couldn't be reached by the last fetch, their scheduled joins are kept
+failed_accounts = set()
+
+
+def fetch_zoom_events(time_from, time_to):
+    # Every zoom event overlapping the time span, queries for parts of it are answered by zoom_events
+    global failed_accounts
+    time_from = time_from.astimezone()
+    time_to = time_to.astimezone()
+    accounts = linked_accounts()
+    if settings.snapshot.syncing.incremental:
+        # Answer from the event store instead of the API
+        sync_if_stale()
+        results = {account.name: account.mirror.get_events_in_time_span(
+            account.mirror.get_calendar_ids(), time_from, time_to) for account in accounts}
+    else:
+        results = api.for_each_account(
+            lambda account: fetch_account_events(time_from, time_to), accounts, timeout=ACCOUNT_TIMEOUT)
+        raise_if_all_failed(results)
+    failed_accounts = {name for name, result in results.items() if isinstance(result, Exception)}
+    event_lists = []
+    for name, result in results.items():
+        if isinstance(result, Exception):
+            continue
+        for event in result:
+            event["account"] = name
+        event_lists.append(result)
+    # Events on the calendars of many accounts, such as a meeting both are invited to, are listed once
+    possible_events = api.classify_overlaps(
+        api.merge_events(event_lists), time_from, time_to, allow_incomplete_overlaps=True, filters=ALL_OVERLAPS)
+    # Store only zoom link containing events that can be joined
+    return [event for event in possible_events if is_timed(event) and has_zoom_link(event)]
+
+
+# Startup, syncs and bursts of clicks ask for overlapping time spans at once, they share fetches
+zoom_events = WindowCache(fetch_zoom_events)
+
+
+@zoom_events_latency.time()
+def get_zoom_events(time_from, time_to, filters=None):
+    filters = filters or ALL_OVERLAPS
+    query_ttl = settings.snapshot.syncing.query_ttl
+    zoom_events.ttl = query_ttl.total_seconds() if query_ttl else 0
+    # Results depend on the settings as well, such as the selected calendars
+    events = zoom_events.query(time_from, time_to, filters, key=settings.snapshot)
+    events_gauge.set(len(events))
 
     # Since this and link_account are the only functions that interact with the API, this is the ideal
-    # place to update the email id from the crendetials
-    if data.get("email") is None:
-        # This will reuse the credits that should exist after the calls above
-        creds = api.get_creds(SCOPES)
-        user_info = api.get_user_info(creds)
-        if user_info:
-            data.set("email", user_info.get("email"))
-            tray_icon.update_menu()
+    # place to update the email ids from the crendetials
+    for account in linked_accounts():
+        if get_account_email(account) is None:
+            # The credentials are already in memory after the calls above
+            try:
+                update_account_email(account)
+            except api.OfflineError:
+                pass
 
     return events
 
 def get_next_event():
-    range_to_sync = convert_time_to_timedelta(
-            settings.get("Syncing.range-to-sync"))
+    range_to_sync = settings.snapshot.syncing.range_to_sync
     now = datetime.now().astimezone()
     events = get_zoom_events(now, now+range_to_sync, filters=["+Inside", "+OverEnd"])
     return len(events) > 0 and events.pop(0) or None
@@ -149,6 +456,18 @@ def join_next_event():
 
 def join_previous_event():
     now = datetime.now().astimezone()
+    if settings.snapshot.syncing.incremental:
+        sync_if_stale()
+        # The most recent event that has already ended, out of every account's
+        events = [account.mirror.get_latest_event_before(
+            account.mirror.get_calendar_ids(), now, since=now-timedelta(days=1),
+            predicate=lambda event: (is_timed(event) and has_zoom_link(event)
+                                     and overlap.get_epoch_bounds(event)[1] <= now.timestamp()))
+            for account in linked_accounts()]
+        event = max(filter(None, events), key=lambda event: overlap.get_epoch_bounds(event)[0], default=None)
+        if event:
+            join_event(event)
+        return
     events = get_zoom_events(now-timedelta(days=1), now, filters=["+OverStart", "+Inside"])
     if len(events) > 0:
         join_event(events.pop())  # Use the last event (most recent)
@@ -161,37 +480,105 @@ def join_current_event():
         join_event(events.pop(0))
 
 
-def schedule_next_event():
+# event id -> the join Task of the event, whose data is the event. Joins that have already fired are
+# kept until their event leaves the horizon, so that they aren't scheduled again
+scheduled_joins = {}
+
+
+def join_scheduled_event(event_id):
+    # The task's event is replaced by later versions of the event
+    task = scheduled_joins.get(event_id)
+    if task:
+        join_event(task.data)
+
+
+# Syncs and push notifications may schedule at the same time
+scheduling_lock = threading.Lock()
+
+prewarm_task = None
+
+
+def schedule_prewarm():
+    # Zoom is started ahead of the next join, instead of delaying the join while it starts
+    global prewarm_task
+    lead = settings.snapshot.joining.prewarm
+    pending = [task.time for task in scheduled_joins.values() if not task.cancelled]
+    prewarm_time = min(pending) - lead if pending and lead else None
+    if prewarm_task and prewarm_task.time == prewarm_time:
+        return
+    if prewarm_task:
+        scheduler.cancel_task(prewarm_task)
+    prewarm_task = prewarm_time and scheduler.add_task(prewarm_time, prewarm_client)
+
+
+def get_next_join_time():
+    with scheduling_lock:
+        pending = [task.time for task in scheduled_joins.values() if not task.cancelled]
+    return min(pending, default=None)
+
+
+# Joins are scheduled until shortly after the next sync, which may be further than range-to-sync ahead
+# while syncs back off or are replaced by push notifications
+scheduled_until = None
+
+
+def get_schedule_horizon():
+    # How far ahead joins are scheduled, at least range-to-sync
+    horizon = settings.snapshot.syncing.range_to_sync
+    if scheduled_until is not None:
+        horizon = max(horizon, scheduled_until - datetime.now().astimezone())
+    return horizon
+
+
+def extend_schedule(next_sync):
+    '''Schedule joins until the next sync, returns whether any join was added or removed.'''
+    global scheduled_until
+    scheduled_until = next_sync + cadence.HORIZON_MARGIN
+    if scheduled_until - datetime.now().astimezone() <= settings.snapshot.syncing.range_to_sync:
+        return False
+    return schedule_events()
+
+
+def schedule_events():
+    '''Bring the scheduled joins up to date, returns whether any join was added or removed.'''
     global settings, tray_icon, scheduler
     if not scheduler.active:
-        return
-    event = get_next_event()
-    if event:
-        if not scheduler.head or event.get("id") != scheduler.head.value.get("id"):
-            # This is a new event, remove the old event
-            scheduler.clear()
-            # Schedule the new event
-            startTime = datetime.fromisoformat(
-                event.get("start").get("dateTime"))
-            joinTime = startTime - \
-                convert_time_to_timedelta(settings.get("Joining.offset"))
-            scheduler.add_task(joinTime, lambda: join_event(event))
-            # Tell the user a new event has been scheduled
-            name = event.get("summary")
-            tray_icon.notify(
-                f"Event \"[{name}]\" has been scheduled for {joinTime.strftime('%r')}", "New Event Scheduled")
-    elif scheduler.head:
-        # The event must have been removed or completed
-        scheduler.clear()
+        return False
+    now = datetime.now().astimezone()
+    until = now + get_schedule_horizon()
+    events = {event["id"]: event for event in get_zoom_events(now, until, filters=["+Inside", "+OverEnd"])}
+    with scheduling_lock:
+        added, removed = joins.reconcile_joins(scheduled_joins, events, scheduler, join_scheduled_event,
+                                               settings.snapshot.joining.offset, until, failed_accounts)
+        schedule_prewarm()
+        scheduled_joins_gauge.set(len(scheduled_joins))
+
+    # Tell the user new events have been scheduled
+    if len(added) == 1:
+        name = added[0].data.get("summary")
+        tray_icon.notify(
+            f"Event \"[{name}]\" has been scheduled for {added[0].time.strftime('%r')}", "New Event Scheduled")
+    elif added:
+        first = min(added, key=lambda task: task.time)
+        tray_icon.notify(f"{len(added)} events have been scheduled, the first for {first.time.strftime('%r')}",
+                         "New Events Scheduled")
+    return bool(added or removed)
 
 
 # SYNCING
 
+# Seconds between syncs while offline, before the circuit breaker opens
+OFFLINE_RETRY_DELAY = 30
+# Syncs failing for any other reason are retried after OFFLINE_RETRY_DELAY, doubling up to this long
+MAX_RETRY_DELAY = 10 * 60
+# Syncs in a row that failed for another reason than being offline
+failed_syncs = 0
+
 current_sync_origin = datetime.now()
 def auto_sync(sync_origin=None):
-    global scheduler, current_sync_origin, settings
+    global scheduler, current_sync_origin, settings, failed_syncs
     # Terminate if auto-join is disabled
-    if not settings.get("Joining.auto-join"):
+    if not settings.snapshot.joining.auto_join:
         return
 
     now = datetime.now().astimezone()
@@ -206,20 +593,219 @@ def auto_sync(sync_origin=None):
     # All sync issues resolved, proceed to actual syncing
     # Don't interact with api if no credentials are present at all
     # Don't proceed if scheduler is terminated or paused
-    
-    if os.path.exists(from_root("data\\token.json")):
-        schedule_next_event()
-        next_call = now + \
-            convert_time_to_timedelta(settings.get("Syncing.period"))
+    accounts = linked_accounts()
+    if accounts:
+        next_sync = notify_on_error(sync_once, accounts)
+        if next_sync is None:
+            # Such as errors the server kept returning or revoked credentials, the loop keeps going
+            failed_syncs += 1
+            delay = min(OFFLINE_RETRY_DELAY * 2 ** min(failed_syncs - 1, 16), MAX_RETRY_DELAY)
+            next_sync = datetime.now().astimezone() + timedelta(seconds=delay)
+        else:
+            failed_syncs = 0
         if scheduler.active:
-            scheduler.add_task(next_call, lambda: auto_sync(sync_origin))
+            scheduler.add_task(next_sync, lambda: auto_sync(sync_origin))
+        tray_icon.update_menu()
+
+
+def sync_once(accounts):
+    # Syncs and schedules the joins of the accounts, returns when to sync next
+    requests = transport.pool.requests
+    started = datetime.now().astimezone()
+    try:
+        if settings.snapshot.syncing.incremental:
+            sync_calendars()
+        changed = schedule_events()
+    except api.OfflineError:
+        sync_latency.labels("offline").observe((datetime.now().astimezone() - started).total_seconds())
+        notify_offline()
+        # Polling pauses while offline, the next sync is made once the connection is probed again
+        delay = max(api.breaker.seconds_until_probe(), OFFLINE_RETRY_DELAY)
+        return datetime.now().astimezone() + timedelta(seconds=delay)
+    except Exception:
+        sync_latency.labels("error").observe((datetime.now().astimezone() - started).total_seconds())
+        raise
+    now = datetime.now().astimezone()
+    sync_latency.labels("changed" if changed else "unchanged").observe((now - started).total_seconds())
+    if push_channels:
+        # Channels are renewed a tick early so that a failed tick doesn't let them lapse
+        watch_calendars(accounts, renew_before=now + 2*settings.snapshot.push.fallback_period)
+    # Polling falls back to the regular cadence unless every calendar is watched
+    policy = get_sync_cadence()
+    policy.record_sync(now, transport.pool.requests - requests, changed)
+    decision = policy.next_sync(now, get_next_join_time())
+    if extend_schedule(decision.time):
+        # A join scheduled further ahead may call for an earlier sync, which is within the schedule
+        decision = policy.next_sync(now, get_next_join_time())
+    return decision.time
+
+
+sync_cadence = None
+sync_cadence_key = None
+
+
+def get_sync_cadence():
+    # The policy is rebuilt when its settings change, keeping the history of syncs
+    global sync_cadence, sync_cadence_key
+    syncing = settings.snapshot.syncing
+    key = (syncing, settings.snapshot.push, is_push_active())
+    if key != sync_cadence_key:
+        if is_push_active():
+            # Polling is only a safety net when changes are pushed
+            new_cadence = cadence.Cadence(settings.snapshot.push.fallback_period, syncing.requests_per_hour)
+        elif syncing.cadence == "fixed":
+            new_cadence = cadence.Cadence(syncing.period, syncing.requests_per_hour)
+        else:
+            # Joins are scheduled until the next sync however far it backs off, see extend_schedule
+            new_cadence = cadence.AdaptiveCadence(
+                syncing.period, syncing.min_period, syncing.max_period, syncing.requests_per_hour,
+                quiet_hours=syncing.quiet_hours or None)
+        if sync_cadence:
+            new_cadence.inherit(sync_cadence)
+        sync_cadence, sync_cadence_key = new_cadence, key
+    return sync_cadence
+
+
+# PUSH NOTIFICATIONS
+
+push_channels = None
+push_receiver = None
+# Whether every selected calendar had a channel open at the last sync
+push_covers_calendars = False
+
+
+def is_push_active():
+    # Whether changes to every calendar are pushed, so that polling is only a fallback
+    return push_channels is not None and push_covers_calendars
+
+
+def watch_calendars(accounts, renew_before):
+    # Opens and renews the channels of every account's selected calendars, synced incrementally or not
+    global push_covers_calendars
+    covered = True
+    for account in accounts:
+        try:
+            with api.use_account(account):
+                calendar_ids = get_selected_calendar_ids()
+                if calendar_ids is None:
+                    covered = False
+                    continue
+                if push_channels.watch(calendar_ids, renew_before=renew_before):
+                    # Calendars that can't be watched, such as holiday calendars, are polled for
+                    covered = False
+        except api.OfflineError:
+            covered = False
+    push_covers_calendars = covered
+
+
+def on_calendar_change(calendar_id):
+    # Called with the calendar's account in use
+    try:
+        if settings.snapshot.syncing.incremental:
+            api.sync_events(calendar_id)
+        # The calendar changed, earlier results are out of date
+        zoom_events.invalidate()
+        schedule_events()
+    except api.OfflineError:
+        # The sync loop catches up once back online
+        pass
+
+
+def start_push():
+    global push_channels, push_receiver
+    push_settings = settings.snapshot.push
+    if not push_settings.enabled or not push_settings.address:
+        return
+    push_channels = push.ChannelManager(push_settings.address, on_calendar_change)
+    push_receiver = push.NotificationReceiver(push_channels, push_settings.port)
+    push_receiver.start()
+
+
+def stop_push():
+    global push_channels, push_receiver, push_covers_calendars
+    if push_receiver:
+        push_receiver.stop()
+    if push_channels:
+        push_channels.unwatch_all()
+    push_channels = push_receiver = None
+    push_covers_calendars = False
 
 
 def stop_joining():
-    global current_sync_origin, scheduler
+    global current_sync_origin, scheduler, scheduled_joins, prewarm_task, scheduled_until
     # Terminate current sync loop
     current_sync_origin = datetime.now().astimezone()  # Fakes a new sync loop
-    scheduler.clear()  # Clear scheduled events
+    with scheduling_lock:
+        scheduler.clear()  # Clear scheduled events
+        scheduled_joins = {}
+        prewarm_task = None
+        scheduled_until = None
+
+
+# CREDENTIALS
+
+def refresh_account(account):
+    account.credential_manager.refresh()
+    if account.credential_manager.has_credentials():
+        update_account_email(account)
+
+
+# Accounts the user has been told to link again, each is only told about again once it has been linked
+notified_relinks = set()
+
+
+def refresh_credentials():
+    # Runs on the runtime's executor, keeps every account's credentials and user info in memory fresh so
+    # that neither the menu nor syncs have to wait on them. Failed refreshes are retried on the next one
+    accounts = list(api.accounts.values())
+    try:
+        api.for_each_account(refresh_account, accounts, timeout=ACCOUNT_TIMEOUT)
+        for account in accounts:
+            if not account.credential_manager.needs_relink():
+                notified_relinks.discard(account.name)
+            elif account.name not in notified_relinks:
+                notified_relinks.add(account.name)
+                email = get_account_email(account)
+                tray_icon.notify(f"{email or account.name} has been signed out, please link it again")
+    finally:
+        runtime.call_later(min(account.credential_manager.seconds_until_refresh() for account in accounts),
+                           runtime.run_blocking, refresh_credentials)
+
+
+# SETTINGS
+
+# Seconds between checks for changes to the settings file
+SETTINGS_POLL_INTERVAL = 2
+
+
+def watch_settings():
+    # Runs on the runtime's event loop, a reload only swaps in a new snapshot
+    if settings.reload_if_changed() and settings.snapshot_error:
+        tray_icon.notify(f"Invalid settings, the previous settings are still used: {settings.snapshot_error}")
+    runtime.call_later(SETTINGS_POLL_INTERVAL, watch_settings)
+
+
+# METRICS EXPORT
+
+# Whether the user has been told exports are failing, only told again once an export has succeeded
+notified_export_failure = False
+
+
+def export_metrics():
+    # Runs on the runtime's executor, the period is read again after each export
+    global notified_export_failure
+    metrics_settings = settings.snapshot.metrics
+    try:
+        if metrics_settings.enabled:
+            metrics_export.keep = metrics_settings.keep
+            metrics_export.export()
+        notified_export_failure = False
+    except OSError as e:
+        if not notified_export_failure:
+            notified_export_failure = True
+            tray_icon.notify(f"Failed to export metrics: {str(e)[:200]}")
+    finally:
+        runtime.call_later(metrics_settings.export_period.total_seconds(), runtime.run_blocking, export_metrics)
 
 
 # MENU LIFECYCLE
@@ -228,19 +814,14 @@ def get_menu_items():
     global settings, data
     menu_items = []
 
-    # First comes the current account if present
-    has_creds = os.path.exists(from_root("data\\token.json"))
-    if has_creds:
-        # First try get the current email from the credentials
-        creds = api.get_creds(SCOPES)
-        user_info = api.get_user_info(creds)
-        if user_info:
-            data.set("email", user_info.get("email"))
-        email = data.get("email")
-        if email:
-            menu_items.append(Item(
-                email, lambda tray_icon: tray_icon, enabled=False
-            ))
+    # First come the linked accounts if present
+    # The menu is rebuilt often, only what's already in memory is used here. Credentials are only
+    # loaded after the API module, which may still be importing while the icon first shows
+    if lazy.is_loaded(api):
+        for account in list(api.accounts.values()):
+            email = account.credential_manager.has_credentials() and get_account_email(account)
+            if email:
+                menu_items.append(Item(email, Menu(Item("Unlink", get_unlink_action(account)))))
 
     menu_items.append(Item("Link New Account", attempt_auth))
 
@@ -248,22 +829,27 @@ def get_menu_items():
     menu_items.append(Item(
         "Auto-Join",
         lambda tray_icon, item: settings.set(
-            "Joining.auto-join", not item.checked) or tray_icon.update_menu(),
-        checked=lambda item: settings.get("Joining.auto-join")
+            "Joining.auto-join", not item.checked, dump=True) or tray_icon.update_menu(),
+        checked=lambda item: settings.snapshot.joining.auto_join
     ))
-    menu_items.append(Item("Sync Next Event", lambda tray_icon: auto_sync(), enabled=settings.get("Joining.auto-join")))
+    menu_items.append(Item("Sync Next Event", lambda tray_icon: runtime.run_blocking(auto_sync), enabled=settings.snapshot.joining.auto_join))
+    decision = sync_cadence and sync_cadence.last_decision
+    if decision and settings.snapshot.joining.auto_join:
+        menu_items.append(Item(
+            f"Next sync at {decision.time.strftime('%X')} ({decision.reason})", lambda tray_icon: tray_icon, enabled=False
+        ))
 
     menu_items.append(Menu.SEPARATOR)
     menu_items.append(
-        Item("Join Previous Event", lambda tray_icon: join_previous_event()))
+        Item("Join Previous Event", lambda tray_icon: run_join_action(join_previous_event)))
     menu_items.append(
-        Item("Join Current Event", lambda tray_icon: join_current_event()))
+        Item("Join Current Event", lambda tray_icon: run_join_action(join_current_event)))
     menu_items.append(
-        Item("Join Next Event", lambda tray_icon: join_next_event()))
+        Item("Join Next Event", lambda tray_icon: run_join_action(join_next_event)))
 
     menu_items.append(Menu.SEPARATOR)
     menu_items.append(Item("Open Settings File", lambda tray_icon: os.popen(
-        f"notepad {from_root('settings.user.toml')}" if settings.get("Settings.open-in-notepad") else from_root('settings.user.toml'))
+        f"notepad {from_root('settings.user.toml')}" if settings.snapshot.settings.open_in_notepad else from_root('settings.user.toml'))
     ))
     menu_items.append(Item("Load Settings", lambda tray_icon: settings.load()))
 
@@ -273,6 +859,11 @@ def get_menu_items():
     return (*menu_items,)
 
 
+def get_unlink_action(account):
+    # Menu actions are only passed the icon and item
+    return lambda tray_icon: runtime.run_blocking(unlink_account, account)
+
+
 def init(tray_icon):
     global scheduler, data, settings, data
     # Indicate startup
@@ -285,12 +876,18 @@ def init(tray_icon):
 
     # Initialize first sync loop
     scheduler.start()
+    # Looking for a running client scans every process, it's done once the icon is up
+    runtime.run_blocking(prewarm_client)
+    runtime.call_soon(watch_settings)
+    runtime.run_blocking(export_metrics)
+    # Reads every account's token once, before the first sync needs it
+    runtime.run_blocking(refresh_credentials)
+    start_push()
     auto_sync()
 
     # Join on startup if enabled
-    has_creds = os.path.exists(from_root("data\\token.json"))
-    if has_creds:
-        join_type = settings.get("General.join-on-startup")
+    if linked_accounts():
+        join_type = settings.snapshot.general.join_on_startup
         if join_type == False:
             return
         join_type = join_type.lower()
@@ -304,10 +901,12 @@ def init(tray_icon):
             time_to = now + timedelta(seconds=1)
 
         if time_from and time_to:
-            events = get_zoom_events(time_from, time_to)
-            if len(events) > 0:
-                event = events.pop(0)
-                join_event(event)
+            def join_on_startup():
+                events = get_zoom_events(time_from, time_to)
+                if len(events) > 0:
+                    event = events.pop(0)
+                    join_event(event)
+            run_join_action(join_on_startup)
 
 
 tray_icon = None
@@ -315,8 +914,6 @@ tray_icon = None
 
 def start():
     global tray_icon
-    # Zoom start-up and login shouldn't affect prejoin period
-    os.popen(settings.get("General.zoom-path"))
     tray_menu = Menu(get_menu_items)
     tray_icon = Icon("Stroll", ICON, menu=tray_menu)
     tray_icon.run(init)
@@ -326,6 +923,7 @@ def stop(tray_icon):
     global scheduler, data, settings
     data.dump()
     settings.dump()
+    stop_push()
     if scheduler.active:
         scheduler.terminate()
     tray_icon.stop()
@@ -339,6 +937,8 @@ startup_folder = os.path.expandvars(
     "%appdata%\\Microsoft\\Windows\\Start Menu\\Programs\\Startup")
 shortcut_path = os.path.join(startup_folder, "Stroll.lnk")
 if not os.path.exists(shortcut_path):
+    # Only needed once, when the shortcut is missing
+    import win32com.client
     shell = win32com.client.Dispatch("WScript.Shell")
     shortcut = shell.CreateShortCut(shortcut_path)
     # The TargetPath is normally the executable itself but that causes a console to pop up when launched
@@ -354,7 +954,7 @@ if not os.path.exists(shortcut_path):
 
 # STARTUP
 is_device_startup = len(sys.argv) > 1 and sys.argv[1] == "--startup"
-autostart = settings.get("General.auto-startup")
+autostart = settings.snapshot.general.auto_startup
 # Device startup and normal launch are the same case
 if (is_device_startup and autostart) or not is_device_startup:
     # Either it was device startup and it was wanted, or it has been explicitly ran
@@ -362,5 +962,6 @@ if (is_device_startup and autostart) or not is_device_startup:
 # But if some time is specified, then actual startup has to be scheduled for the future
 elif is_device_startup and type(autostart) == time:
     time_to_start = datetime.combine(datetime.today(), autostart)
-    scheduler.start()
-    scheduler.add_task(time_to_start, start)
+    # Wait on this thread, the tray icon runs on it for the rest of the program
+    threading.Event().wait(max((time_to_start - datetime.now()).total_seconds(), 0))
+    start()
@@ -1,12 +1,34 @@
+import collections
+import contextvars
+import copy
+import json
 import os
-from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Sequence, Type, Union
+import random
+import re
+import socket
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from datetime import date, datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Callable, Dict, Hashable, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Type, Union
+from urllib.parse import urlsplit
+from wsgiref.simple_server import WSGIServer, make_server
 
+import httplib2
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import Resource, build
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import Resource, build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import BatchHttpRequest, HttpRequest
 
+from util import metrics, overlap, transport
+from util.data import write_atomically
 from util.path import from_root
 
 # API FUNCTIONS
@@ -20,13 +42,17 @@ scopes = [
 
 
 def get_creds(scopes: Sequence[str], data_folder: str = from_root("data"),
-              show_auth_prompt: bool = True, reuse_creds: bool = True) -> Type[Credentials]:
+              show_auth_prompt: bool = True, reuse_creds: bool = True,
+              auth_timeout: Optional[float] = None, token_name: str = "token.json") -> Type[Credentials]:
     """Get/create user credentials in given folder with specified scopes.
     Args:
         scopes: The scopes listed in the OAuth consent screen.
         data_folder: The folder containing client_secret.json and to store credentials in.
         show_auth_prompt: Whether or not to show the user the authourization link in the console.
         reuse_creds: Whether or not to use credentials from previous runs.
+        auth_timeout: Seconds to wait for the user to authorize before raising TimeoutError, waits
+            indefinitely if None.
+        token_name: The file in data_folder to store credentials in.
 
     Returns:
         The credentials stored or created.
@@ -35,46 +61,692 @@ def get_creds(scopes: Sequence[str], data_folder: str = from_root("data"),
     # The file token.json stores the user"s access and refresh tokens, and is
     # created automatically when the authorization flow completes for the first
     # time.
-    if reuse_creds and os.path.exists(data_folder+"\\token.json"):
-        creds = Credentials.from_authorized_user_file(
-            data_folder+"\\token.json", scopes)
+    token_path = data_folder + "\\" + token_name
+    if reuse_creds and os.path.exists(token_path):
+        creds = Credentials.from_authorized_user_file(token_path, scopes)
 
     # If there are no (valid) credentials available, let the user log in.
     if not creds or not creds.valid:
         if creds and creds.expired and creds.refresh_token:
             creds.refresh(Request())
         else:
+            # Only needed to link an account
+            from google_auth_oauthlib.flow import InstalledAppFlow
             flow = InstalledAppFlow.from_client_secrets_file(
                 data_folder+"\\client_secret.json", scopes)
-            if show_auth_prompt:
-                creds = flow.run_local_server(port=0)
-            else:
-                creds = flow.run_local_server(
-                    port=0, authorization_prompt_message="")
+            creds = _authorize(flow, auth_timeout, show_auth_prompt)
         # Save the credentials for the next run
-        with open(data_folder+"\\token.json", "w") as token:
+        with open(token_path, "w") as token:
             token.write(creds.to_json())
     return creds
 
 
-# service will be built only once per run
-service = None
+class _AuthServer(WSGIServer):
+    '''The local server receiving the redirect once the user has authorized.'''
+    # Fail fast if the port is occupied
+    allow_reuse_address = False
+
+
+def _authorize(flow, timeout: Optional[float], show_auth_prompt: bool) -> Credentials:
+    '''Let the user authorize in the browser, like InstalledAppFlow.run_local_server but giving up
+    after timeout seconds, which the pinned google-auth-oauthlib doesn't support.
+    Raises:
+        TimeoutError: The user didn't authorize within the timeout.
+    '''
+    import webbrowser
+    from google_auth_oauthlib.flow import _RedirectWSGIApp, _WSGIRequestHandler
+    wsgi_app = _RedirectWSGIApp("The authentication flow has completed. You may close this window.")
+    local_server = make_server("localhost", 0, wsgi_app, server_class=_AuthServer,
+                               handler_class=_WSGIRequestHandler)
+    try:
+        # Only this server waits at most timeout seconds for the redirect
+        local_server.timeout = timeout
+        flow.redirect_uri = f"http://localhost:{local_server.server_port}/"
+        auth_url, _ = flow.authorization_url()
+        webbrowser.open(auth_url, new=1, autoraise=True)
+        if show_auth_prompt:
+            print(f"Please visit this URL to authorize this application: {auth_url}")
+        local_server.handle_request()
+        if wsgi_app.last_request_uri is None:
+            raise TimeoutError("Authorization timed out")
+        # oauthlib insists on https even for the local redirect
+        flow.fetch_token(authorization_response=wsgi_app.last_request_uri.replace("http", "https"))
+    finally:
+        local_server.server_close()
+    return flow.credentials
+
+
+class CredentialManager:
+    '''Keeps the user's credentials and info in memory, so that they're only read from disk once and
+    refreshed ahead of expiry instead of when a request needs them.
+    Args:
+        scopes: The scopes listed in the OAuth consent screen.
+        data_folder: The folder containing client_secret.json and to store credentials in.
+        token_name: The file in data_folder to store credentials in.
+        on_link: Called after an account has been linked, replacing the credentials.
+    '''
+    # Credentials are refreshed this long before they expire
+    REFRESH_MARGIN = timedelta(minutes=5)
+    # Failed refreshes are retried after this long
+    RETRY_PERIOD = timedelta(minutes=1)
+    USER_INFO_TTL = timedelta(hours=1)
+
+    def __init__(self, scopes: Sequence[str], data_folder: str = from_root("data"), token_name: str = "token.json",
+                 on_link: Optional[Callable[[], None]] = None):
+        self.scopes = scopes
+        self.data_folder = data_folder
+        self.token_name = token_name
+        self.on_link = on_link
+        self.lock = threading.RLock()
+        self.credentials: Optional[Credentials] = None
+        self.loaded = False
+        # The credentials as last read from or written to token.json
+        self.saved_json = None
+        self.user_info: Optional[Dict] = None
+        self.user_info_time: Optional[datetime] = None
+        self.last_failure: Optional[datetime] = None
+
+    @property
+    def token_path(self) -> str:
+        return self.data_folder + "\\" + self.token_name
+
+    def has_credentials(self) -> bool:
+        '''Whether credentials have been loaded or linked, without any I/O.'''
+        return self.credentials is not None
+
+    def load(self):
+        '''Read the credentials from token.json, if they haven't been read yet.'''
+        with self.lock:
+            if self.loaded:
+                return
+            self.loaded = True
+            if os.path.exists(self.token_path):
+                with open(self.token_path, "r") as token:
+                    self.saved_json = token.read()
+                self.credentials = Credentials.from_authorized_user_info(
+                    json.loads(self.saved_json), self.scopes)
+
+    def get(self) -> Optional[Credentials]:
+        '''Get the credentials, refreshing them first if they've expired.
+        Returns:
+            The credentials, None if no account has been linked.
+        '''
+        with self.lock:
+            self.load()
+            if self.credentials and not self.credentials.valid:
+                self.refresh(force=True)
+            return self.credentials
+
+    def link(self, show_auth_prompt: bool = False, auth_timeout: Optional[float] = None) -> Credentials:
+        '''Ask the user to authorize an account, replacing the current credentials.'''
+        creds = get_creds(self.scopes, data_folder=self.data_folder, show_auth_prompt=show_auth_prompt,
+                          reuse_creds=False, auth_timeout=auth_timeout, token_name=self.token_name)
+        with self.lock:
+            self.loaded = True
+            self.credentials = creds
+            self.saved_json = creds.to_json()
+            self.user_info = self.user_info_time = None
+        if self.on_link:
+            self.on_link()
+        return creds
+
+    def unlink(self):
+        '''Forget the credentials and delete the file they're stored in.'''
+        with self.lock:
+            self.loaded = True
+            self.credentials = self.saved_json = None
+            self.user_info = self.user_info_time = None
+            if os.path.exists(self.token_path):
+                os.remove(self.token_path)
+
+    def needs_relink(self) -> bool:
+        '''Whether the credentials have expired and can't be refreshed, Google doesn't always return a
+        refresh token when an account is linked again.'''
+        creds = self.credentials
+        return creds is not None and not creds.refresh_token and not creds.valid
+
+    def seconds_until_refresh(self) -> float:
+        '''Seconds until the credentials should be refreshed.'''
+        now = datetime.utcnow()
+        if self.last_failure and now - self.last_failure < self.RETRY_PERIOD:
+            return (self.last_failure + self.RETRY_PERIOD - now).total_seconds()
+        creds = self.credentials
+        if creds is None or creds.expiry is None or not creds.refresh_token:
+            # Nothing to refresh, check again in case an account is linked
+            return self.REFRESH_MARGIN.total_seconds()
+        # Credentials' expiry is a naive UTC datetime
+        return max((creds.expiry - self.REFRESH_MARGIN - now).total_seconds(), 0)
+
+    def refresh(self, force: bool = False) -> bool:
+        '''Refresh the credentials if they expire within REFRESH_MARGIN, saving them if they change.
+        Args:
+            force: Whether to refresh the credentials regardless of their expiry.
+
+        Returns:
+            Whether the credentials were refreshed.
+        '''
+        with self.lock:
+            self.load()
+            creds = self.credentials
+            if creds is None or not creds.refresh_token:
+                return False
+            if not force and creds.expiry and creds.expiry - self.REFRESH_MARGIN > datetime.utcnow():
+                return False
+            try:
+                creds.refresh(Request())
+            except Exception:
+                self.last_failure = datetime.utcnow()
+                raise
+            self.last_failure = None
+            self.save()
+            return True
+
+    def save(self):
+        '''Write the credentials to token.json, only if they've changed since last read or written.'''
+        with self.lock:
+            if self.credentials is None:
+                return
+            creds_json = self.credentials.to_json()
+            if creds_json == self.saved_json:
+                return
+            write_atomically(self.token_path, lambda token: token.write(creds_json))
+            self.saved_json = creds_json
+
+    def get_cached_user_info(self) -> Optional[Dict]:
+        '''The user info fetched last, without any I/O. May be stale or None.'''
+        return self.user_info
+
+    def get_user_info(self, max_age: Optional[timedelta] = None) -> Optional[Dict]:
+        '''Get the user info, fetching it only if the cached info is older than max_age.
+        Args:
+            max_age: The oldest acceptable cached info, USER_INFO_TTL if None.
+        '''
+        max_age = self.USER_INFO_TTL if max_age is None else max_age
+        now = datetime.utcnow()
+        if self.user_info is not None and now - self.user_info_time <= max_age:
+            return self.user_info
+        creds = self.get()
+        if creds is None:
+            return None
+        user_info = get_user_info(creds)
+        if user_info:
+            self.user_info, self.user_info_time = user_info, now
+        return user_info
+
+
+# Can be pointed to another server, such as a local fake for benchmarks
+root_url = "https://www.googleapis.com/"
+
+
+# RESILIENCE
+
+# Calls a join depends on take priority over background syncs and refreshes
+CRITICAL = "critical"
+BACKGROUND = "background"
+_priority = contextvars.ContextVar("priority", default=BACKGROUND)
+
+
+@contextmanager
+def priority(level: str):
+    '''Run the API calls made inside the block at a priority, CRITICAL or BACKGROUND.'''
+    token = _priority.set(level)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+class OfflineError(ConnectionError):
+    '''The API can't be reached, raised without a request while the circuit breaker is open.'''
+
+
+class RetryPolicy(NamedTuple):
+    retries: int
+    base_delay: float  # Seconds before the first retry, doubled for each retry after it
+    max_delay: float  # The longest wait before a retry, longer Retry-After waits fail instead
+
+
+RETRY_POLICIES = {
+    # A join can't wait long, it fails quickly instead
+    CRITICAL: RetryPolicy(retries=2, base_delay=0.25, max_delay=2),
+    BACKGROUND: RetryPolicy(retries=5, base_delay=1, max_delay=60),
+}
+# Connection failures, raised as OfflineError once retries run out
+CONNECTION_ERRORS = (httplib2.error.ServerNotFoundError, OSError)
+
+
+class CircuitBreaker:
+    '''Stops requests after consecutive failures to reach the API, until a cheap connection probe
+    succeeds. Critical requests are always let through, and close the breaker if they succeed.
+    Args:
+        threshold: Consecutive failures that open the breaker.
+        cooldown: Seconds before the first probe, doubled after each failed probe.
+        max_cooldown: The longest time between probes.
+    '''
+
+    def __init__(self, threshold: int = 3, cooldown: float = 30, max_cooldown: float = 600):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.lock = threading.Lock()
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probe_at = 0.0  # time.monotonic() of the next probe while open
+        self.probes = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None
+
+    def seconds_until_probe(self) -> float:
+        return max(self.probe_at - time.monotonic(), 0) if self.is_open else 0
+
+    def before_request(self, level: str):
+        '''Raise OfflineError if the request shouldn't be made.'''
+        if not self.is_open or level == CRITICAL:
+            return
+        with self.lock:
+            if time.monotonic() < self.probe_at:
+                raise OfflineError("The Calendar API is unreachable, requests are paused")
+            if _probe():
+                # Reachable again, the request itself confirms it
+                return
+            self.probes += 1
+            self.probe_at = time.monotonic() + min(self.cooldown * 2 ** self.probes, self.max_cooldown)
+        raise OfflineError("The Calendar API is unreachable, requests are paused")
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probes = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.is_open:
+                # A request let through by a probe or its priority failed, probe later
+                self.probes += 1
+                self.probe_at = time.monotonic() + min(self.cooldown * 2 ** self.probes, self.max_cooldown)
+            elif self.failures >= self.threshold:
+                self.opened_at = time.monotonic()
+                self.probe_at = self.opened_at + self.cooldown
+
+
+def _probe() -> bool:
+    # Opening a connection costs no quota, and fails quickly while offline
+    parts = urlsplit(root_url)
+    port = parts.port or (443 if parts.scheme == "https" else 80)
+    try:
+        socket.create_connection((parts.hostname, port), timeout=5).close()
+        return True
+    except OSError:
+        return False
+
+
+class QuotaCounter:
+    '''Counts the requests made to each endpoint of the API per day, batched requests included.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.days = {}  # date -> Counter of endpoint -> requests
+
+    def count(self, endpoint: str, requests: int = 1):
+        with self.lock:
+            day = datetime.now().date()
+            if day not in self.days:
+                # Only today and yesterday are kept
+                self.days = {known: counts for known, counts in self.days.items() if day - known <= timedelta(days=1)}
+                self.days[day] = collections.Counter()
+            self.days[day][endpoint] += requests
+
+    def get_usage(self, day: Optional[date] = None) -> Dict[str, int]:
+        '''The requests made to each endpoint on a day, today if None.'''
+        with self.lock:
+            return dict(self.days.get(day or datetime.now().date(), {}))
+
+
+breaker = CircuitBreaker()
+quota = QuotaCounter()
+
+request_count = metrics.registry.counter(
+    "stroll_api_requests_total", "Requests made to the API, batched requests included", ["endpoint"])
+request_latency = metrics.registry.histogram(
+    "stroll_api_request_seconds", "Time taken by each HTTP request to the API", ["endpoint"])
+retry_count = metrics.registry.counter("stroll_api_retries_total", "Requests retried after failing", ["endpoint"])
+offline_count = metrics.registry.counter(
+    "stroll_api_offline_total", "Requests failed or not made because the API was unreachable")
+
+_ENDPOINTS = (
+    (re.compile(r"/calendar/v3/users/me/calendarList$"), "calendarList.list"),
+    (re.compile(r"/calendar/v3/calendars/[^/]+$"), "calendars.get"),
+    (re.compile(r"/calendar/v3/calendars/[^/]+/events$"), "events.list"),
+    (re.compile(r"/calendar/v3/calendars/[^/]+/events/watch$"), "events.watch"),
+    (re.compile(r"/calendar/v3/channels/stop$"), "channels.stop"),
+    (re.compile(r"/userinfo$"), "userinfo.get"),
+    (re.compile(r"/token$"), "oauth2.token"),
+)
+
+
+def _get_endpoint(uri: str) -> str:
+    path = urlsplit(uri).path
+    for pattern, endpoint in _ENDPOINTS:
+        if pattern.search(path):
+            return endpoint
+    return path
+
+
+def _get_retry_after(response) -> Optional[float]:
+    value = response.get("retry-after")
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(response, content) -> bool:
+    if response.status in (429, 500, 502, 503, 504):
+        return True
+    # Rate limits are also reported as 403s, other 403s are permanent
+    return response.status == 403 and b"ateLimitExceeded" in (
+        content if isinstance(content, bytes) else content.encode())
+
+
+class ResilientHttp:
+    '''Wraps an http object to count quota, retry failed requests with jittered exponential backoff
+    (or as long as Retry-After asks) and stop requests while the API is unreachable.
+    '''
+
+    def __init__(self, http):
+        self.http = http
+        self.timeout = getattr(http, "timeout", None)
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        level = _priority.get()
+        policy = RETRY_POLICIES[level]
+        endpoint = _get_endpoint(uri)
+        # Each request in a batch counts towards the quota
+        requests = max(str(body).count("application/http"), 1) if endpoint.startswith("/batch") else 1
+        for attempt in range(policy.retries + 1):
+            try:
+                breaker.before_request(level)
+            except OfflineError:
+                offline_count.inc()
+                raise
+            quota.count(endpoint, requests)
+            request_count.labels(endpoint).inc(requests)
+            if attempt:
+                retry_count.labels(endpoint).inc()
+            last_attempt = attempt == policy.retries
+            # Full jitter, retries of many clients don't line up
+            delay = random.uniform(0, min(policy.base_delay * 2 ** attempt, policy.max_delay))
+            try:
+                with request_latency.labels(endpoint).time():
+                    response, content = self.http.request(uri, method, body, headers, *args, **kwargs)
+            except CONNECTION_ERRORS as error:
+                breaker.record_failure()
+                if last_attempt or breaker.is_open and level != CRITICAL:
+                    offline_count.inc()
+                    raise OfflineError(f"The Calendar API is unreachable: {error}") from error
+                time.sleep(delay)
+                continue
+            # Any response means the API is reachable, server errors are retried but aren't the device being offline
+            breaker.record_success()
+            if not _is_retryable(response, content) or last_attempt:
+                return response, content
+            retry_after = _get_retry_after(response)
+            if retry_after is not None:
+                if retry_after > policy.max_delay:
+                    # Waiting that long is left to the caller
+                    return response, content
+                delay = retry_after
+            time.sleep(delay)
+
+    def close(self):
+        self.http.close()
+
+
+@lru_cache(maxsize=None)
+def get_discovery_document(name: str, version: str) -> Dict:
+    '''Get the parsed discovery document of an API, from the copy shipped with googleapiclient.
+    Documents are parsed once, googleapiclient's fix ups of them can be repeated.
+    '''
+    return json.loads(discovery_cache.get_static_doc(name, version))
+
+
+def build_service(credentials: Credentials) -> Resource:
+    '''Build a service for interacting with the Calendar v3 API at root_url.'''
+    client_options = None
+    if root_url != "https://www.googleapis.com/":
+        client_options = {"api_endpoint": root_url + "calendar/v3/"}
+    # Requests borrow connections from the shared pool, so the service can be used from any thread
+    return build_from_document(get_discovery_document("calendar", "v3"), http=authorized_http(credentials),
+                               client_options=client_options)
+
+
+def authorized_http(credentials: Optional[Credentials]):
+    '''Build a thread-safe, resilient http object authorized with the given credentials.'''
+    return transport.authorized_http(credentials, ResilientHttp(transport.PooledHttp(transport.pool)))
 
 
 def get_service(reuse_creds: bool = True) -> Resource:
-    '''Construct or return a service for interacting with the Calendar v3 API
+    '''Construct or return a service for interacting with the Calendar v3 API, for the current account
     Args:
         reuse_creds: Whether or not to use credentials from previous runs.
 
     Returns:
         A Resource object that can interact with the Calendar v3 API
     '''
-    global service, scopes
-    if service is None:
-        credentials: Credentials = get_creds(
-            scopes, data_folder=from_root("data"), show_auth_prompt=False, reuse_creds=reuse_creds)
-        service = build("calendar", "v3", credentials=credentials)
-    return service
+    return get_account().get_service(reuse_creds)
+
+
+# CONDITIONAL REQUESTS
+
+class ResponseCache:
+    '''The bodies of GET responses by account and URI, to make repeated requests conditional on their etag.
+    An unchanged resource is answered with an empty 304 and served from the cache.
+    Args:
+        max_entries: The number of responses kept, least recently used ones are dropped first.
+    '''
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # (account, uri) -> (etag, body)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def prepare(self, request: HttpRequest):
+        '''Make a request conditional if its response is cached.'''
+        if request.method != "GET":
+            return
+        with self.lock:
+            entry = self.entries.get(self._key(request))
+        if entry:
+            request.headers["If-None-Match"] = entry[0]
+
+    def complete(self, request: HttpRequest, response: Optional[Dict],
+                 exception: Optional[Exception]) -> Union[Dict, Exception]:
+        '''Resolve the response to a prepared request.
+        Returns:
+            The response, the cached response for a 304 or the exception otherwise.
+        '''
+        if request.method != "GET":
+            return exception or response
+        key = self._key(request)
+        with self.lock:
+            if isinstance(exception, HttpError) and exception.resp.status == 304 and key in self.entries:
+                self.hits += 1
+                cache_hits.inc()
+                self.entries.move_to_end(key)
+                # Callers are free to modify responses
+                return copy.deepcopy(self.entries[key][1])
+            if exception:
+                return exception
+            self.misses += 1
+            cache_misses.inc()
+            # Collections and resources of the Calendar API carry their etag in the body
+            if response.get("etag"):
+                self.entries[key] = (response["etag"], copy.deepcopy(response))
+                self.entries.move_to_end(key)
+                if len(self.entries) > self.max_entries:
+                    self.entries.popitem(last=False)
+        return response
+
+    def execute(self, request: HttpRequest, http=None) -> Dict:
+        '''Execute a request conditionally, like request.execute.'''
+        self.prepare(request)
+        try:
+            response, exception = request.execute(http=http), None
+        except HttpError as error:
+            response, exception = None, error
+        result = self.complete(request, response, exception)
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    @staticmethod
+    def _key(request):
+        # Accounts can see different versions of the same URI, such as calendars/primary
+        return get_account().name, request.uri
+
+
+response_cache = ResponseCache()
+cache_hits = metrics.registry.counter("stroll_api_cache_hits_total", "Responses served from the cache after a 304")
+cache_misses = metrics.registry.counter("stroll_api_cache_misses_total", "Responses downloaded in full")
+
+
+# BATCHED REQUESTS
+
+# The Calendar API rejects batches of more than 50 requests
+BATCH_LIMIT = 50
+
+
+def execute_batch(requests: Dict[str, HttpRequest]) -> Dict[str, Union[Dict, Exception]]:
+    '''Execute requests through the batch endpoint, BATCH_LIMIT requests per round trip.
+    Args:
+        requests: The requests to execute by an id for each request.
+
+    Returns:
+        The response or the raised exception by the id of each request.
+    '''
+    responses = {}
+
+    def callback(index, response, exception):
+        key = keys[int(index)]
+        responses[key] = response_cache.complete(requests[key], response, exception)
+    keys = list(requests)
+    for batch_start in range(0, len(keys), BATCH_LIMIT):
+        batch = BatchHttpRequest(callback=callback, batch_uri=root_url + "batch/calendar/v3")
+        for index in range(batch_start, min(batch_start + BATCH_LIMIT, len(keys))):
+            # Ids are sent as headers, indices avoid escaping calendarIds
+            response_cache.prepare(requests[keys[index]])
+            batch.add(requests[keys[index]], request_id=str(index))
+        batch.execute()
+    return responses
+
+
+def _execute_in_thread(request: HttpRequest) -> Union[Dict, Exception]:
+    try:
+        return response_cache.execute(request)
+    except Exception as error:
+        return error
+
+
+def execute_parallel(requests: Dict[str, HttpRequest], max_workers: Optional[int] = None) -> Dict[str, Union[Dict, Exception]]:
+    '''Execute requests concurrently on pooled connections, a fallback for execute_batch.
+    Args:
+        requests: The requests to execute by an id for each request.
+        max_workers: The maximum number of concurrent requests, the size of the connection pool if None.
+
+    Returns:
+        The response or the raised exception by the id of each request.
+    '''
+    with ThreadPoolExecutor(max_workers=max_workers or transport.pool.size) as executor:
+        # Each request keeps the priority of the caller
+        futures = {key: executor.submit(contextvars.copy_context().run, _execute_in_thread, request)
+                   for key, request in requests.items()}
+    return {key: future.result() for key, future in futures.items()}
+
+
+def list_events_for_calendars(queries: Dict[str, Dict], parallel: bool = False) -> Dict[str, Union[Tuple[List[Dict], Optional[str]], Exception]]:
+    '''List the events of many calendars, fetching a page of every calendar per round trip.
+    Args:
+        queries: The parameters of events.list by the calendarId of each calendar.
+        parallel: Whether to use concurrent requests instead of the batch endpoint.
+
+    Returns:
+        The events and the nextSyncToken, or the raised exception, by calendarId.
+    '''
+    return _list_events({calendar_id: dict(query, calendarId=calendar_id)
+                         for calendar_id, query in queries.items()}, parallel)
+
+
+def search_events_for_calendars(queries: Dict[str, Dict], terms: Sequence[str],
+                                parallel: bool = False) -> Dict[str, Union[List[Dict], Exception]]:
+    '''List only the events of many calendars that match any of the free text search terms.
+    Matching is done by the server on the whole event, results should be validated locally.
+    Args:
+        queries: The parameters of events.list by the calendarId of each calendar. Can't include syncToken.
+        terms: The search terms, each is sent as the q parameter of a separate query.
+        parallel: Whether to use concurrent requests instead of the batch endpoint.
+
+    Returns:
+        The events matching any term ordered by start time, or the first raised exception, by calendarId.
+    '''
+    results = _list_events({(calendar_id, term): dict(query, calendarId=calendar_id, q=term)
+                            for calendar_id, query in queries.items() for term in terms}, parallel)
+    merged = {}
+    for calendar_id in queries:
+        calendar_results = [results[calendar_id, term] for term in terms]
+        errors = [result for result in calendar_results if isinstance(result, Exception)]
+        if errors:
+            merged[calendar_id] = errors[0]
+            continue
+        merged[calendar_id] = merge_events(items for items, _ in calendar_results)
+    return merged
+
+
+def merge_events(event_lists: Iterable[Iterable[Dict]]) -> List[Dict]:
+    '''Merge lists of events into one ordered by start time, listing events found in several lists once.'''
+    events = {}
+    for event_list in event_lists:
+        for event in event_list:
+            events.setdefault(event["id"], event)
+    return sorted(events.values(), key=lambda event: overlap.get_epoch_bounds(event)[0])
+
+
+def _list_events(queries: Dict[Hashable, Dict], parallel: bool = False) -> Dict[Hashable, Union[Tuple[List[Dict], Optional[str]], Exception]]:
+    # Like list_events_for_calendars, but with any key for each query and the calendarId in the query
+    events = get_service().events()
+    execute = execute_parallel if parallel else execute_batch
+    results = {key: [] for key in queries}
+    page_tokens = dict.fromkeys(queries)
+    while page_tokens:
+        requests = {
+            key: events.list(pageToken=page_token, **event_query(), **queries[key])
+            for key, page_token in page_tokens.items()
+        }
+        for key, response in execute(requests).items():
+            if isinstance(response, Exception):
+                results[key] = response
+                del page_tokens[key]
+                continue
+            results[key].extend(response.get("items", []))
+            page_tokens[key] = response.get("nextPageToken")
+            if not page_tokens[key]:
+                # The sync token is only present on the last page
+                results[key] = (results[key], response.get("nextSyncToken"))
+                del page_tokens[key]
+    return results
 
 
 def get_calendar_list() -> Resource:
@@ -85,7 +757,7 @@ def get_calendar_list() -> Resource:
     '''
     service = get_service()
     # Default maxResults = 100 which is sufficient
-    calendar_list = service.calendarList().list().execute()
+    calendar_list = response_cache.execute(service.calendarList().list())
     return calendar_list["items"]
 
 
@@ -102,12 +774,404 @@ def get_calendar_from_name(calendar_name: str) -> Optional[Dict]:
     for calendar in calendars:
         if calendar["summary"] == calendar_name:
             calendar_id = calendar["id"]
-            calendar = service.calendars().get(calendarId=calendar_id).execute()
+            calendar = response_cache.execute(service.calendars().get(calendarId=calendar_id))
             return calendar
 
 
+# INCREMENTAL SYNC
+
+# Incremental syncs can't be restricted to a time span, the full sync that precedes them is
+# restricted to events ending after (now - sync_lookback) instead
+sync_lookback = timedelta(days=1)
+
+
+class EventMirror:
+    '''An in-memory copy of synced calendars, kept up to date with sync tokens.'''
+
+    def __init__(self):
+        # calendarId -> {"syncToken": str, "syncedFrom": datetime, "events": {eventId: Event}}
+        self.calendars = {}
+
+    def get_sync_token(self, calendar_id: str) -> Optional[str]:
+        calendar = self.calendars.get(calendar_id)
+        return calendar and calendar["syncToken"]
+
+    def get_synced_from(self, calendar_id: str) -> Optional[datetime]:
+        calendar = self.calendars.get(calendar_id)
+        return calendar and calendar["syncedFrom"]
+
+    def apply(self, calendar_id: str, events: List[Dict], sync_token: str,
+              synced_from: Optional[datetime] = None):
+        '''Apply the result of a sync to the copy of a calendar.
+        Args:
+            calendar_id: calendarId of the synced calendar.
+            events: The changed events, cancelled events are removed from the copy.
+            sync_token: The nextSyncToken returned by the sync.
+            synced_from: The start of a full sync, replaces the copy instead of updating it.
+        '''
+        if synced_from is not None or calendar_id not in self.calendars:
+            self.calendars[calendar_id] = {"syncedFrom": synced_from, "events": {}}
+        calendar = self.calendars[calendar_id]
+        calendar["syncToken"] = sync_token
+        for event in events:
+            if event.get("status") == "cancelled":
+                calendar["events"].pop(event["id"], None)
+            else:
+                calendar["events"][event["id"]] = event
+
+    def get_events_in_time_span(self, calendar_id: str, time_from: datetime, time_to: datetime) -> List[Dict]:
+        '''Get copies of the events overlapping a time span, ordered by start time.'''
+        calendar = self.calendars.get(calendar_id)
+        if not calendar:
+            return []
+        span_from, span_to = time_from.timestamp(), time_to.timestamp()
+        events = []
+        for event in calendar["events"].values():
+            event_start, event_end = overlap.get_epoch_bounds(event)
+            if event_start < span_to and event_end > span_from:
+                # Copied since callers annotate events
+                events.append(dict(event))
+        events.sort(key=lambda event: overlap.get_epoch_bounds(event)[0])
+        return events
+
+
+# ACCOUNTS
+
+DEFAULT_ACCOUNT = "default"
+# Makes the synced copy of each account's calendars, can return any object with the same interface
+# as EventMirror, such as util.store.EventStore.for_account
+mirror_factory = lambda name: EventMirror()
+
+account_errors = metrics.registry.counter(
+    "stroll_account_errors_total", "Work for an account that failed or timed out", ["account"])
+
+
+class Account:
+    '''A linked Google account, with its own credentials, service and synced calendars.
+    Services of every account share the connection pool in util.transport.
+    Args:
+        name: Identifies the account locally, the default account is stored in token.json and any
+            other in token.<name>.json.
+        data_folder: The folder containing client_secret.json and to store credentials in.
+    '''
+
+    def __init__(self, name: str, data_folder: str = from_root("data")):
+        self.name = name
+        token_name = "token.json" if name == DEFAULT_ACCOUNT else f"token.{name}.json"
+        self.credential_manager = CredentialManager(scopes, data_folder, token_name, on_link=self.reset_service)
+        self.mirror = mirror_factory(name)
+        self.lock = threading.Lock()
+        self.service = None
+        self.credentials = None
+        # When the account was last worked on successfully, and what failed since
+        self.last_success = None
+        self.last_error = None
+        # A call of for_each_account that timed out and is still running, the account is skipped until it ends
+        self.overdue: Optional[Future] = None
+
+    def get_service(self, reuse_creds: bool = True) -> Resource:
+        '''Construct or return a service for interacting with the Calendar v3 API, see get_service.'''
+        with self.lock:
+            if self.service is None:
+                if reuse_creds:
+                    self.credentials = self.credential_manager.get()
+                if self.credentials is None:
+                    self.credentials = self.credential_manager.link()
+                self.service = build_service(self.credentials)
+            return self.service
+
+    def reset_service(self):
+        # The service is rebuilt with the new credentials when next needed
+        self.service = self.credentials = None
+
+    def __repr__(self):
+        return f"<Account {self.name!r}>"
+
+
+accounts: Dict[str, Account] = {}
+accounts_lock = threading.Lock()
+default_account = accounts[DEFAULT_ACCOUNT] = Account(DEFAULT_ACCOUNT)
+credential_manager = default_account.credential_manager
+
+# The account API calls are made for, set with use_account
+_account = contextvars.ContextVar("account", default=None)
+
+
+def get_account() -> Account:
+    '''The account API calls are made for, the default account unless another is in use.'''
+    return _account.get() or default_account
+
+
+@contextmanager
+def use_account(account: Union[Account, str]):
+    '''Make API calls for an account inside the block, including calls made by execute_parallel.'''
+    if isinstance(account, str):
+        account = accounts[account]
+    token = _account.set(account)
+    try:
+        yield account
+    finally:
+        _account.reset(token)
+
+
+def load_accounts(data_folder: str = from_root("data")) -> List[Account]:
+    '''Add the accounts whose credentials are stored in data_folder but aren't loaded yet.
+    Returns:
+        Every account, the default account first.
+    '''
+    with accounts_lock:
+        for file_name in sorted(os.listdir(data_folder)) if os.path.isdir(data_folder) else ():
+            parts = file_name.split(".")
+            if len(parts) == 3 and parts[0] == "token" and parts[2] == "json" and parts[1] not in accounts:
+                accounts[parts[1]] = Account(parts[1], data_folder)
+        return list(accounts.values())
+
+
+def add_account(data_folder: str = from_root("data")) -> Account:
+    '''Add an account with no credentials yet, link it with account.credential_manager.link.'''
+    with accounts_lock:
+        number = 1
+        while f"account{number}" in accounts:
+            number += 1
+        account = accounts[f"account{number}"] = Account(f"account{number}", data_folder)
+        return account
+
+
+def remove_account(name: str):
+    '''Unlink an account and delete its credentials, the default account is kept but left unlinked.'''
+    with accounts_lock:
+        account = accounts[name] if name == DEFAULT_ACCOUNT else accounts.pop(name)
+    account.credential_manager.unlink()
+    account.reset_service()
+    forget = getattr(account.mirror, "forget_account", None)
+    if forget:
+        forget()
+    else:
+        account.mirror = mirror_factory(name)
+
+
+# The most calls of for_each_account running at once, shared by every caller
+ACCOUNT_WORKERS = 4
+_account_executor = ThreadPoolExecutor(max_workers=ACCOUNT_WORKERS, thread_name_prefix="account")
+
+
+def for_each_account(function: Callable[[Account], Any], selected: Optional[Iterable[Account]] = None,
+                     timeout: Optional[float] = None) -> Dict[str, Union[Any, Exception]]:
+    '''Call a function for many accounts concurrently, each call using its account for API calls.
+    A failing or slow account doesn't hold up the others, its exception is returned instead.
+    Args:
+        function: Called with each account.
+        selected: The accounts to call function for, every account if None.
+        timeout: Seconds to wait for the calls, accounts that haven't finished by then are given a
+            TimeoutError and are left to finish in the background. They're skipped with a TimeoutError
+            until then, instead of piling up more calls. Waits indefinitely if None.
+
+    Returns:
+        The result or the raised exception by the name of each account.
+    '''
+    if selected is None:
+        selected = list(accounts.values())
+
+    def call(account):
+        with use_account(account):
+            return function(account)
+    futures = {}
+    skipped = []
+    for account in selected:
+        if account.overdue is not None and not account.overdue.done():
+            skipped.append(account)
+            continue
+        account.overdue = None
+        # Each call keeps the priority of the caller
+        futures[account] = _account_executor.submit(contextvars.copy_context().run, call, account)
+    wait(futures.values(), timeout=timeout)
+    results = {}
+    for account in skipped:
+        results[account.name] = account.last_error = TimeoutError(
+            f"{account.name} is still busy with a call that didn't finish in time")
+        account_errors.labels(account.name).inc()
+    for account, future in futures.items():
+        if not future.done():
+            account.overdue = future
+            error = TimeoutError(f"{account.name} didn't finish within {timeout} seconds")
+        else:
+            error = future.exception()
+        if error is None:
+            results[account.name] = future.result()
+            account.last_success = datetime.now().astimezone()
+            account.last_error = None
+        else:
+            results[account.name] = account.last_error = error
+            account_errors.labels(account.name).inc()
+    return results
+
+
+# Events are fetched with only the fields that are used, the collection's etag makes requests conditional
+EVENT_FIELDS = "id,etag,status,updated,summary,start,end,description,location,conferenceData"
+LIST_FIELDS = f"etag,nextPageToken,nextSyncToken,items({EVENT_FIELDS})"
+# Events per page, up to 2500. Larger pages mean fewer round trips but a longer wait for the first event
+max_results = 250
+
+
+def event_query() -> Dict:
+    '''The parameters of events.list that project and size every page.'''
+    return {"fields": LIST_FIELDS, "maxResults": max_results}
+
+
+# Time spans of queries are widened to multiples of this, so that queries for about the same span
+# have the same URI and are answered with 304s by the response cache
+query_granularity = timedelta(hours=1)
+
+
+def anchor_time(moment: datetime, round_up: bool = False) -> datetime:
+    '''Round a time to a multiple of query_granularity since the epoch, down unless round_up.'''
+    granularity = query_granularity.total_seconds()
+    steps = moment.timestamp() / granularity
+    steps = -(-steps // 1) if round_up else steps // 1
+    return datetime.fromtimestamp(steps * granularity, moment.tzinfo)
+
+
+def time_span_query(time_from: datetime, time_to: datetime) -> Dict:
+    '''The parameters of events.list for the events overlapping at least a time span.
+    The span is widened with anchor_time, callers filter the events by the exact span.
+    '''
+    return {"timeMin": anchor_time(time_from.astimezone()).isoformat(),
+            "timeMax": anchor_time(time_to.astimezone(), round_up=True).isoformat(), "singleEvents": True}
+
+
+def _iter_event_pages(calendar_id: str, **kwargs) -> Iterator[Dict]:
+    # Pages are only fetched once the previous one has been consumed
+    events = get_service().events()
+    page_token = None
+    while True:
+        response = response_cache.execute(events.list(
+            calendarId=calendar_id, pageToken=page_token, **{"singleEvents": True, **event_query(), **kwargs}))
+        yield response
+        page_token = response.get("nextPageToken")
+        if not page_token:
+            return
+
+
+def iter_events(calendar_id: str, **kwargs) -> Iterator[Dict]:
+    '''Lazily list the events of a calendar, fetching the next page only when it's reached.
+    Args:
+        calendar_id: calendarId of the calendar to list.
+        **kwargs: Further parameters of events.list.
+
+    Returns:
+        The events, with only the fields in EVENT_FIELDS.
+    '''
+    for response in _iter_event_pages(calendar_id, **kwargs):
+        yield from response.get("items", [])
+
+
+def _list_all_events(calendar_id: str, **kwargs) -> Tuple[List[Dict], Optional[str]]:
+    items = []
+    for response in _iter_event_pages(calendar_id, **kwargs):
+        items.extend(response.get("items", []))
+    # The sync token is only present on the last page
+    return items, response.get("nextSyncToken")
+
+
+def sync_events(calendar_id: str) -> bool:
+    '''Bring the synced copy of a calendar up to date.
+    Only the events changed since the last sync are fetched, unless the calendar hasn't been
+    synced yet or the server has invalidated the sync token.
+    Args:
+        calendar_id: calendarId of the calendar to sync.
+
+    Returns:
+        Whether a full sync was done.
+    '''
+    mirror = get_account().mirror
+    sync_token = mirror.get_sync_token(calendar_id)
+    if sync_token:
+        try:
+            events, sync_token = _list_all_events(calendar_id, syncToken=sync_token)
+            mirror.apply(calendar_id, events, sync_token)
+            return False
+        except HttpError as error:
+            if error.resp.status != 410:
+                raise
+            # 410 GONE: The sync token has expired, a full sync is required
+
+    synced_from = anchor_time(datetime.now().astimezone() - sync_lookback)
+    events, sync_token = _list_all_events(
+        calendar_id, timeMin=synced_from.isoformat())
+    mirror.apply(calendar_id, events, sync_token, synced_from)
+    return True
+
+
+def sync_many_events(calendar_ids: Sequence[str], parallel: bool = False) -> Dict[str, Exception]:
+    '''Bring the synced copies of many calendars up to date, see sync_events.
+    The calendars are synced together with list_events_for_calendars.
+    Args:
+        calendar_ids: The calendarIds of the calendars to sync.
+        parallel: Whether to use concurrent requests instead of the batch endpoint.
+
+    Returns:
+        The exception raised while syncing by the calendarId of each calendar that failed to sync.
+    '''
+    mirror = get_account().mirror
+    errors = {}
+    queries = {}
+    full_syncs = {}
+    for calendar_id in calendar_ids:
+        sync_token = mirror.get_sync_token(calendar_id)
+        if sync_token:
+            queries[calendar_id] = {"singleEvents": True, "syncToken": sync_token}
+    # Full syncs are made for unsynced calendars and calendars whose sync token has expired
+    for calendar_id, result in list_events_for_calendars(queries, parallel).items():
+        if isinstance(result, HttpError) and result.resp.status == 410:
+            full_syncs[calendar_id] = None
+        elif isinstance(result, Exception):
+            errors[calendar_id] = result
+        else:
+            mirror.apply(calendar_id, *result)
+
+    synced_from = anchor_time(datetime.now().astimezone() - sync_lookback)
+    queries = {
+        calendar_id: {"singleEvents": True, "timeMin": synced_from.isoformat()}
+        for calendar_id in calendar_ids if calendar_id not in queries or calendar_id in full_syncs
+    }
+    for calendar_id, result in list_events_for_calendars(queries, parallel).items():
+        if isinstance(result, Exception):
+            errors[calendar_id] = result
+        else:
+            mirror.apply(calendar_id, *result, synced_from)
+    return errors
+
+
+# PUSH NOTIFICATIONS
+
+def watch_events(calendar_id: str, channel_id: str, address: str, token: str, ttl: timedelta) -> Dict:
+    '''Open a channel to be notified of changes to the events of a calendar.
+    Args:
+        calendar_id: calendarId of the calendar to watch.
+        channel_id: A unique id for the channel.
+        address: The HTTPS address notifications are posted to.
+        token: A secret sent with every notification, as X-Goog-Channel-Token.
+        ttl: How long the channel should live for, the server may shorten it.
+
+    Returns:
+        The opened Channel, its expiration is in milliseconds since the epoch.
+    '''
+    service = get_service()
+    return service.events().watch(calendarId=calendar_id, body={
+        "id": channel_id, "type": "web_hook", "address": address, "token": token,
+        "params": {"ttl": str(int(ttl.total_seconds()))}
+    }).execute()
+
+
+def stop_channel(channel_id: str, resource_id: str):
+    '''Stop notifications from a channel opened by watch_events.'''
+    service = get_service()
+    service.channels().stop(body={"id": channel_id, "resourceId": resource_id}).execute()
+
+
 def get_events_in_time_span(calendar_id: str, time_from: datetime, time_to: datetime,
-                            allow_incomplete_overlaps: bool = False, filters: List[str] = ["+Inside", "+OverStart", "+OverEnd", "+Across"]) -> List[Dict]:
+                            allow_incomplete_overlaps: bool = False, filters: List[str] = ["+Inside", "+OverStart", "+OverEnd", "+Across"],
+                            search_terms: Sequence[str] = ()) -> List[Dict]:
     '''Get events partially and/or completely inside a time span from the given calendar.
     Args:
         calendar_id: calendarId of the calendar to search.
@@ -121,6 +1185,7 @@ def get_events_in_time_span(calendar_id: str, time_from: datetime, time_to: date
             Examples:
                 ["+Inside", "+OverStart"] will filter in only Inside and Overstart type events.
                 ["+Inside", "-OverEnd"] will filter in only Inside type events. Note that the -OverEnd filter is redundant here.
+        search_terms: Free text search terms, only events matching any of them are fetched.
 
     Returns:
         A list of Events each with an added field "overlapType" of possible values:
@@ -129,68 +1194,28 @@ def get_events_in_time_span(calendar_id: str, time_from: datetime, time_to: date
             "OverEnd": The Event starts inside and ends after the time span 
             "Across": The Event starts before and ends after the time span.
     '''
-    service = get_service()
-    events = service.events()
-
     # Make dts timezone aware
     time_from = time_from.astimezone()
     time_to = time_to.astimezone()
 
-    events_overlapping_in_span = events.list(
-        calendarId=calendar_id,
-        timeMin=time_from.isoformat(), timeMax=time_to.isoformat(),
-        # startTime order requires singleEvents to be True
-        singleEvents=True, orderBy="startTime"
-    ).execute()["items"]
-    events_chosen = []  # "Sink" for events passing filter
-    for event in events_overlapping_in_span:
-        event_start = event["start"]["dateTime"]
-        event_end = event["end"]["dateTime"]
-
-        # Operators can be used with datetime objects
-        event_start = datetime.fromisoformat(event_start)
-        event_end = datetime.fromisoformat(event_end)
-
-        event_starts_before = event_start < time_from
-        event_ends_after = event_end > time_to
-
-        if not event_starts_before and not event_ends_after:
-            event["overlapType"] = "Inside"
-        elif allow_incomplete_overlaps:
-            # Allow further divisions
-            if event_starts_before and not event_ends_after:
-                # Cross only start time
-                event["overlapType"] = "OverStart"
-            elif not event_starts_before and event_ends_after:
-                # Cross only end time
-                event["overlapType"] = "OverEnd"
-            elif event_starts_before and event_ends_after:
-                # Cross both start and end times
-                event["overlapType"] = "Across"
-        # else:
-            # No overlapType assigned as only Inside is allowed and event wasn't inside
-
-        if "overlapType" in event:  # Event passed appropriate filter
-            events_chosen.append(event)
-
-    type_filters = {}
-    for filter in filters:
-        if filter in type_filters:
-            # Filter already applied
-            continue
-        if filter[0] == "-":
-            filter = filter[1:]
-            type_filters[filter] = False
-        elif filter[0] == "+":
-            filter = filter[1:]
-            type_filters[filter] = True
+    # startTime order requires singleEvents, which time_span_query sets
+    query = {**time_span_query(time_from, time_to), "orderBy": "startTime"}
+    if search_terms:
+        events_overlapping_in_span = merge_events(
+            iter_events(calendar_id, q=term, **query) for term in search_terms)
+    else:
+        events_overlapping_in_span = iter_events(calendar_id, **query)
+    # Pages are classified as they're fetched, only the chosen events are kept
+    return list(classify_overlaps(events_overlapping_in_span, time_from, time_to,
+                                  allow_incomplete_overlaps, filters))
 
-    events_passed = []
-    for event in events_chosen:
-        if type_filters.get(event["overlapType"]):
-            events_passed.append(event)
 
-    return events_passed
+def classify_overlaps(events: Iterable[Dict], time_from: datetime, time_to: datetime,
+                      allow_incomplete_overlaps: bool, filters: List[str]) -> Iterator[Dict]:
+    '''Lazily classify and filter events by how they overlap a time span, as they arrive.
+    See get_events_in_time_span for the arguments and the classification.
+    '''
+    return overlap.iter_classify(events, time_from, time_to, allow_incomplete_overlaps, filters)
 
 
 def get_events_starting_from_now(calendar_id: Union[str, List[str]], range_offset: timedelta = timedelta(minutes=1),) -> List[Dict]:
@@ -214,7 +1239,14 @@ def get_events_starting_from_now(calendar_id: Union[str, List[str]], range_offse
     return events
 
 
+# The oauth2 service of each account is kept for the credentials it was built with
+_user_info_services = weakref.WeakKeyDictionary()
+
+
 def get_user_info(credentials):
-    user_info_service = build('oauth2', 'v2', credentials=credentials)
+    user_info_service = _user_info_services.get(credentials)
+    if user_info_service is None:
+        user_info_service = _user_info_services[credentials] = build_from_document(
+            get_discovery_document("oauth2", "v2"), http=authorized_http(credentials))
     user_info = user_info_service.userinfo().get().execute()
     return user_info
@@ -0,0 +1,127 @@
+"""
+Decide when to sync next.
+"""
+import collections
+from datetime import datetime, time, timedelta
+from typing import NamedTuple, Optional, Tuple
+
+HOUR = timedelta(hours=1)
+# Joins are scheduled this far past the next sync, so that events starting while it runs aren't missed
+HORIZON_MARGIN = timedelta(minutes=1)
+
+
+class Decision(NamedTuple):
+    time: datetime  # When to sync next
+    delay: timedelta
+    reason: str
+
+
+class Cadence:
+    '''Syncs every period, within a budget of API requests per hour.
+    Args:
+        period: The time between syncs.
+        requests_per_hour: The most API requests syncs may make in an hour, unlimited if None.
+    '''
+
+    def __init__(self, period: timedelta, requests_per_hour: Optional[int] = None):
+        self.period = period
+        self.requests_per_hour = requests_per_hour
+        # (time, requests) of the syncs in the last hour
+        self.history = collections.deque()
+        self.last_decision: Optional[Decision] = None
+
+    def inherit(self, other: "Cadence"):
+        '''Carry over the history of the policy this one replaces.'''
+        self.history = other.history
+
+    def record_sync(self, now: datetime, requests: int = 1, changed: bool = False):
+        '''Record a completed sync.
+        Args:
+            now: When the sync completed.
+            requests: The API requests the sync made.
+            changed: Whether the sync found changes to the scheduled joins.
+        '''
+        self.history.append((now, requests))
+        while self.history and self.history[0][0] <= now - HOUR:
+            self.history.popleft()
+
+    def next_sync(self, now: datetime, next_join: Optional[datetime] = None) -> Decision:
+        '''Decide when to sync next.
+        Args:
+            now: The current time.
+            next_join: When the next scheduled join fires, None if there isn't any.
+        '''
+        return self._decide(now, self.period, "regular period")
+
+    def _decide(self, now, delay, reason):
+        if self.requests_per_hour and self.history:
+            requests = [requests for _, requests in self.history]
+            # Space syncs out so that a full hour of them fits in the budget
+            spacing = HOUR * (sum(requests) / len(requests) / self.requests_per_hour)
+            if sum(requests) >= self.requests_per_hour:
+                # Spent, wait for the oldest sync to leave the hour
+                spacing = max(spacing, self.history[0][0] + HOUR - now)
+            if spacing > delay:
+                delay, reason = spacing, "request budget"
+        self.last_decision = Decision(now + delay, delay, reason)
+        return self.last_decision
+
+
+class AdaptiveCadence(Cadence):
+    '''Syncs every min_period shortly before a join, to catch last minute changes, and backs off
+    exponentially from period up to max_period while syncs find nothing new, or during quiet hours.
+    Args:
+        period: The time between syncs after changes.
+        min_period: The shortest time between syncs.
+        max_period: The longest time between syncs.
+        requests_per_hour: The most API requests syncs may make in an hour, unlimited if None.
+        approach: How long before a join syncs are made every min_period.
+        quiet_hours: (from, to) local times of day when nothing is expected to change, may span midnight.
+    '''
+
+    def __init__(self, period: timedelta, min_period: timedelta, max_period: timedelta,
+                 requests_per_hour: Optional[int] = None, approach: timedelta = timedelta(minutes=10),
+                 quiet_hours: Optional[Tuple[time, time]] = None):
+        super().__init__(period, requests_per_hour)
+        self.min_period = min_period
+        self.max_period = max_period
+        self.approach = approach
+        self.quiet_hours = quiet_hours
+        # Syncs in a row that found nothing new
+        self.idle_syncs = 0
+
+    def inherit(self, other: Cadence):
+        super().inherit(other)
+        if isinstance(other, AdaptiveCadence):
+            self.idle_syncs = other.idle_syncs
+
+    def record_sync(self, now: datetime, requests: int = 1, changed: bool = False):
+        super().record_sync(now, requests, changed)
+        self.idle_syncs = 0 if changed else self.idle_syncs + 1
+
+    def is_quiet(self, now: datetime) -> bool:
+        if not self.quiet_hours:
+            return False
+        quiet_from, quiet_to = self.quiet_hours
+        now = now.time()
+        if quiet_from <= quiet_to:
+            return quiet_from <= now < quiet_to
+        return now >= quiet_from or now < quiet_to
+
+    def next_sync(self, now: datetime, next_join: Optional[datetime] = None) -> Decision:
+        if next_join and next_join - now <= self.approach:
+            delay, reason = self.min_period, "joining soon"
+        else:
+            if self.is_quiet(now):
+                delay, reason = self.max_period, "quiet hours"
+            elif self.idle_syncs:
+                # Capped so that the multiplier stays small
+                delay = self.period * 2 ** min(self.idle_syncs, 16)
+                reason = f"no changes in {self.idle_syncs} syncs"
+            else:
+                delay, reason = self.period, "regular period"
+            if next_join and next_join - self.approach - now < delay:
+                # Wake up in time to start syncing quickly
+                delay, reason = next_join - self.approach - now, "join approaching"
+        delay = min(max(delay, self.min_period), self.max_period)
+        return self._decide(now, delay, reason)
@@ -0,0 +1,129 @@
+"""
+Answer queries for the events in overlapping time windows from as few fetches as possible.
+"""
+import threading
+import time
+from datetime import datetime
+from typing import Callable, Dict, Hashable, Iterable, List, Optional
+
+from util import metrics, overlap
+
+query_count = metrics.registry.counter(
+    "stroll_window_queries_total", "Queries for the events in a time window, by how they were answered", ["result"])
+
+
+class _Fetch:
+    '''A fetch of the events in a window, in flight until done is set.'''
+    __slots__ = ("time_from", "time_to", "key", "done", "events", "error", "finished_at")
+
+    def __init__(self, time_from, time_to, key):
+        self.time_from = time_from
+        self.time_to = time_to
+        self.key = key
+        self.done = threading.Event()
+        self.events = None
+        self.error = None
+        self.finished_at = None
+
+    def covers(self, time_from, time_to):
+        return self.time_from <= time_from and time_to <= self.time_to
+
+    def overlaps(self, time_from, time_to):
+        return self.time_from < time_to and time_from < self.time_to
+
+
+class WindowCache:
+    '''Coalesces queries for events in time windows into shared fetches, and reuses their results.
+    A query for a window inside one being fetched waits for that fetch instead of making its own, and
+    a query inside a window fetched less than ttl ago is answered from its result. Either way the events
+    are classified again for the query's window and filters. A query overlapping a fetch in flight
+    waits for it before deciding, since it may have been made for an identical or larger window.
+    Failed fetches aren't reused, but their error is raised to every query that waited on them.
+    Args:
+        fetch: Gets every event overlapping a window, fetch(time_from, time_to), ordered as results should be.
+        ttl: Seconds results are reused for after their fetch finished, only fetches in flight are shared if 0.
+        max_entries: The number of results kept, the oldest are dropped first.
+    '''
+
+    def __init__(self, fetch: Callable[[datetime, datetime], List[Dict]], ttl: float = 10,
+                 max_entries: int = 8):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        # Fetches in flight and recent results, oldest first
+        self.fetches: List[_Fetch] = []
+
+    def query(self, time_from: datetime, time_to: datetime, filters: Iterable[str],
+              key: Optional[Hashable] = None) -> List[Dict]:
+        '''Get the events in a time window, see api.get_events_in_time_span for the filters.
+        Args:
+            key: What results depend on besides the window, such as the settings. Results of fetches
+                made with another key aren't reused.
+
+        Returns:
+            Copies of the events passing the filters, each with an added field "overlapType".
+        '''
+        time_from, time_to = time_from.astimezone(), time_to.astimezone()
+        while True:
+            with self.lock:
+                self._drop_stale(key)
+                found = self._find(time_from, time_to)
+                if found is None:
+                    found = _Fetch(time_from, time_to, key)
+                    self.fetches.append(found)
+                    break
+            if found.covers(time_from, time_to):
+                query_count.labels("hit" if found.done.is_set() else "coalesced").inc()
+                found.done.wait()
+                if found.error is not None:
+                    raise found.error
+                return self._classify(found.events, time_from, time_to, filters)
+            # Overlapping a fetch in flight, look again once it's done
+            found.done.wait()
+        query_count.labels("fetched").inc()
+        self._run(found)
+        if found.error is not None:
+            raise found.error
+        return self._classify(found.events, time_from, time_to, filters)
+
+    def invalidate(self):
+        '''Forget every result, fetches in flight are still shared with the queries already waiting.'''
+        with self.lock:
+            self.fetches = []
+
+    def _find(self, time_from, time_to):
+        # A fetch covering the window, preferring finished ones, else one overlapping it in flight
+        covering = [fetch for fetch in self.fetches if fetch.covers(time_from, time_to)]
+        for fetch in covering:
+            if fetch.done.is_set():
+                return fetch
+        if covering:
+            return covering[0]
+        for fetch in self.fetches:
+            if not fetch.done.is_set() and fetch.overlaps(time_from, time_to):
+                return fetch
+        return None
+
+    def _drop_stale(self, key):
+        now = time.monotonic()
+        self.fetches = [fetch for fetch in self.fetches if fetch.key == key and (
+            not fetch.done.is_set() or (fetch.error is None and now - fetch.finished_at < self.ttl))]
+        finished = [fetch for fetch in self.fetches if fetch.done.is_set()]
+        for fetch in finished[:max(len(finished) - self.max_entries, 0)]:
+            self.fetches.remove(fetch)
+
+    def _run(self, fetch):
+        try:
+            fetch.events = self.fetch(fetch.time_from, fetch.time_to)
+        except BaseException as error:
+            fetch.error = error
+        finally:
+            fetch.finished_at = time.monotonic()
+            fetch.done.set()
+
+    @staticmethod
+    def _classify(events, time_from, time_to, filters):
+        # Shared results are left untouched, each query gets its own copies
+        return overlap.classify([dict(event) for event in events], time_from, time_to,
+                                allow_incomplete_overlaps=True, filters=filters)
@@ -1,5 +1,9 @@
+import copy
 import json
 import os
+import tempfile
+import threading
+import time
 from shutil import copyfile
 
 import toml
@@ -8,16 +12,97 @@ settings = None
 session_data = None
 
 
-def merge_dicts(session_dict, file_dict):
-    copy = session_dict.copy()
-    copy.update(file_dict)  # File dict keys overwrite session dict keys
-    return copy
+def merge_dicts(base_dict, session_dict, file_dict):
+    '''Three-way merge of the session's and the file's changes to a common base.
+    Nested dictionaries are merged key by key, keys changed on both sides keep the session's value.
+    '''
+    merged = {}
+    for key in {**file_dict, **session_dict}:
+        in_base, in_session, in_file = key in base_dict, key in session_dict, key in file_dict
+        base, session, file = base_dict.get(key), session_dict.get(key), file_dict.get(key)
+        if in_session and in_file and isinstance(session, dict) and isinstance(file, dict):
+            merged[key] = merge_dicts(base if isinstance(base, dict) else {}, session, file)
+        elif in_session and (not in_base or session != base):
+            merged[key] = session  # Changed in the session
+        elif in_file and (not in_base or file != base):
+            merged[key] = file  # Changed in the file
+        elif in_session and in_file:
+            merged[key] = session  # Unchanged
+        # else: Deleted on one side and unchanged on the other
+    return merged
+
+
+def write_atomically(path, write):
+    '''Write a temporary file next to a file and swap it in, so that the file is never half written.
+    Args:
+        path: The file to write.
+        write: Called with the temporary file opened for writing text.
+    '''
+    directory, name = os.path.split(path)
+    descriptor, temp_path = tempfile.mkstemp(prefix=f".{name}.", dir=directory or None)
+    try:
+        with os.fdopen(descriptor, "w") as file:
+            write(file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+
+class _Flusher:
+    '''A single background thread writing files once they've stopped changing.'''
+
+    def __init__(self):
+        self.condition = threading.Condition()
+        self.due = {}  # file -> time.monotonic() after which it's written
+        self.thread = None
+
+    def request(self, file, delay):
+        with self.condition:
+            # Every request pushes the write back, coalescing bursts into one write
+            self.due[file] = time.monotonic() + delay
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name="stroll-flusher", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+    def cancel(self, file):
+        with self.condition:
+            self.due.pop(file, None)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.due:
+                    self.condition.wait()
+                file, due = min(self.due.items(), key=lambda item: item[1])
+                delay = due - time.monotonic()
+                if delay > 0:
+                    self.condition.wait(delay)
+                    continue
+                del self.due[file]
+            try:
+                file.dump()
+            except (OSError, ValueError):
+                # Unwritable or unparsable for now, retried on the next change or dump
+                pass
+
+
+_flusher = _Flusher()
 
 
 class DataFileInterface:
+    # Seconds a file must go unchanged before a requested dump is written
+    FLUSH_DELAY = 1
+
     def __init__(self):
         self.cache = None
-        pass
+        # The contents of the file when it was last loaded or dumped, the base of merges
+        self.base = None
+        self.dirty = set()  # Paths set since the last dump
+        self.lock = threading.RLock()
 
     def get(self, path, load=False):
         if self.cache is None or load:
@@ -33,25 +118,60 @@ class DataFileInterface:
         return cursor
 
     def set(self, path, value, dump=False):
-        if not self.cache:
-            self.load()
+        '''Set a value in the session.
+        Args:
+            path (str): Dot separated keys leading to the value.
+            value: The new value.
+            dump (bool): Whether to write the change to the file, soon after changes stop coming in.
+        '''
+        with self.lock:
+            if not self.cache:
+                self.load()
 
-        keys = path.split(".")
-        # All keys except the last key leads to a dictionary
-        dict_keys = keys[:len(keys)-1]
-        cursor = self.cache
-        for key in dict_keys:
-            cursor = cursor[key]
-        last_key = keys[-1]
-        cursor[last_key] = value
+            keys = path.split(".")
+            # All keys except the last key leads to a dictionary
+            dict_keys = keys[:len(keys)-1]
+            cursor = self.cache
+            for key in dict_keys:
+                cursor = cursor[key]
+            last_key = keys[-1]
+            cursor[last_key] = value
+            self.dirty.add(path)
 
         if dump:
-            self.dump()
+            self.request_dump()
+
+    def request_dump(self):
+        '''Dump the file on a background thread once it has gone unchanged for FLUSH_DELAY seconds.'''
+        _flusher.request(self, self.FLUSH_DELAY)
 
     def load(self):
-        pass
+        with self.lock:
+            self.cache = self._read()
+            self.base = copy.deepcopy(self.cache)
+            self.dirty.clear()
 
     def dump(self):
+        '''Merge the session into the file and write it atomically.'''
+        _flusher.cancel(self)
+        with self.lock:
+            if self.cache is None:
+                return
+            file_dict = self._read() or {}
+            merged = merge_dicts(self.base or {}, self.cache, file_dict)
+            if merged != file_dict:
+                self._write_atomically(merged)
+            self.cache = merged
+            self.base = copy.deepcopy(merged)
+            self.dirty.clear()
+
+    def _write_atomically(self, contents):
+        write_atomically(self.active_path, lambda file: self._write(contents, file))
+
+    def _read(self):
+        pass
+
+    def _write(self, contents, file):
         pass
 
 
@@ -67,35 +187,97 @@ class DefaultingFile(DataFileInterface):
         if result is None and self.default_file:
             # NOTE: It's assumed that None is not acceptable for any value
             alt_result = self.default_file.get(*args, **kwargs)
-            if alt_result:
+            if alt_result is not None:
                 result = alt_result
         return result
 
+    def load(self):
+        if not os.path.exists(self.active_path):
+            # Copy the default file
+            copyfile(self.default_file_path, self.active_path)
+        super().load()
+
 
 class TomlFile(DefaultingFile):
-    def __init__(self, active_file_path, default_file_path=None):
+    def __init__(self, active_file_path, default_file_path=None, snapshot_type=None):
         self.active_path = active_file_path
         self.default_file_path = default_file_path
         default_file = None
         if default_file_path:
             default_file = TomlFile(default_file_path)
         super().__init__(default_file)
+        # snapshot_type.from_file(file) builds an immutable snapshot of the file
+        self.snapshot_type = snapshot_type
+        self._snapshot = None
+        self.snapshot_error = None
+        self.mtime = None
+
+    @property
+    def snapshot(self):
+        '''An immutable snapshot of the file, replaced whenever the file is loaded or set.'''
+        if self._snapshot is None:
+            self.load()
+        return self._snapshot
+
+    def _rebuild_snapshot(self):
+        if self.snapshot_type is None:
+            return
+        try:
+            self._snapshot = self.snapshot_type.from_file(self)
+            self.snapshot_error = None
+        except ValueError as error:
+            # Keep the last valid snapshot, or fall back to the defaults
+            self.snapshot_error = error
+            if self._snapshot is None:
+                self._snapshot = self.snapshot_type.from_file(self.default_file)
 
     def load(self):
-        if os.path.exists(self.active_path):
-            self.cache = toml.load(self.active_path)
-        else:
-            # Copy the default file
-            copyfile(self.default_file_path, self.active_path)
-            self.load()  # Load in the new file
+        super().load()
+        self._rebuild_snapshot()
 
     def dump(self):
-        session_dict = self.cache
-        self.load()
-        file_dict = self.cache
-        merged = merge_dicts(session_dict, file_dict)
-        with open(self.active_path, "w") as file:
-            toml.dump(merged, file)
+        super().dump()
+        # Written by this session, not a change to reload
+        self.mtime = os.path.getmtime(self.active_path)
+        # The merge may have brought in changes from the file
+        self._rebuild_snapshot()
+
+    def set(self, *args, **kwargs):
+        super().set(*args, **kwargs)
+        self._rebuild_snapshot()
+
+    def reload_if_changed(self):
+        '''Load the file again if it has been modified since it was last loaded.
+
+        Returns:
+            Whether the file was loaded again.
+        '''
+        try:
+            mtime = os.path.getmtime(self.active_path)
+        except OSError:
+            return False
+        if mtime == self.mtime:
+            return False
+        try:
+            if self.dirty:
+                # Loading would drop changes that haven't been written yet, merge them instead
+                self.dump()
+            else:
+                self.load()
+        except ValueError as error:
+            # Most likely caught halfway through being saved, it's retried on the next call
+            self.snapshot_error = error
+            return False
+        return True
+
+    def _read(self):
+        mtime = os.path.getmtime(self.active_path)
+        contents = toml.load(self.active_path)
+        self.mtime = mtime
+        return contents
+
+    def _write(self, contents, file):
+        toml.dump(contents, file)
 
 
 class JsonFile(DefaultingFile):
@@ -107,24 +289,10 @@ class JsonFile(DefaultingFile):
             default_file = JsonFile(default_file_path)
         super().__init__(default_file)
 
-    def load(self):
-        if os.path.exists(self.active_path):
-            with open(self.active_path, "r") as file:
-                if len(file.read()) > 0:
-                    # Move the cursor back from the read in the condition
-                    file.seek(0, 0)
-                    self.cache = json.load(file)
-                else:
-                    self.cache = None
-        else:
-            # Copy the default file
-            copyfile(self.default_file_path, self.active_path)
-            self.load()  # Load in the new file
+    def _read(self):
+        with open(self.active_path, "r") as file:
+            contents = file.read()
+        return json.loads(contents) if contents else None
 
-    def dump(self):
-        session_dict = self.cache
-        self.load()
-        file_dict = self.cache
-        merged = merge_dicts(session_dict, file_dict)
-        with open(self.active_path, "w") as file:
-            json.dump(merged, file)
+    def _write(self, contents, file):
+        json.dump(contents, file)
@@ -0,0 +1,63 @@
+"""
+Keep the joins scheduled for events up to date as the events change.
+"""
+import functools
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Hashable, Iterable, List, Tuple
+
+from util import overlap
+from util.scheduler import Task
+
+
+def get_start_time(event: Dict) -> datetime:
+    return datetime.fromtimestamp(overlap.get_epoch_bounds(event)[0]).astimezone()
+
+
+def get_event_version(event: Dict) -> Hashable:
+    return event.get("etag") or event.get("updated")
+
+
+def reconcile_joins(scheduled_joins: Dict[str, Task], events: Dict[str, Dict], scheduler,
+                    join: Callable[[str], None], offset: timedelta, until: datetime,
+                    failed_accounts: Iterable[str] = ()) -> Tuple[List[Task], List[Task]]:
+    '''Bring the scheduled joins up to date with the events, only the joins of added, moved or cancelled
+    events are touched.
+    Args:
+        scheduled_joins: The join Task of each event by its id, whose data is the event. Updated in place,
+            joins that have already fired are kept so that they aren't scheduled again.
+        events: The events to join by their id, those starting before until.
+        scheduler: The Scheduler joins are added to.
+        join: Called with the id of an event when its join is due.
+        offset: How long before its start an event is joined.
+        until: The end of the time span events were looked for in, joins of later events are kept.
+        failed_accounts: The names of the accounts whose events couldn't be looked for, their joins are kept.
+
+    Returns:
+        The added and the removed joins.
+    '''
+    removed = []
+    for event_id, task in list(scheduled_joins.items()):
+        event = events.get(event_id)
+        if event is None and (task.data.get("account") in failed_accounts or get_start_time(task.data) >= until):
+            # Its account couldn't be reached or it wasn't looked for, kept until it can be checked again
+            continue
+        if event is None:
+            # The event was cancelled or has started and left the horizon
+            scheduler.cancel_task(task)
+            removed.append(scheduled_joins.pop(event_id))
+        elif get_event_version(event) != get_event_version(task.data):
+            if get_start_time(event) - offset == task.time:
+                # Not moved, only its details (such as the link) changed
+                task.data = event
+            else:
+                scheduler.cancel_task(task)
+                removed.append(scheduled_joins.pop(event_id))
+
+    added = []
+    for event_id, event in events.items():
+        if event_id in scheduled_joins:
+            continue
+        scheduled_joins[event_id] = scheduler.add_task(
+            get_start_time(event) - offset, functools.partial(join, event_id), data=event)
+        added.append(scheduled_joins[event_id])
+    return added, removed
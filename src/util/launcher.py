@@ -0,0 +1,170 @@
+"""
+Start the meeting client without a shell, keep it warm and time how long it takes to be ready.
+"""
+import collections
+import os
+import subprocess
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+import psutil
+
+from util import metrics
+
+try:
+    import win32api
+    import win32con
+    import win32event
+except ImportError:
+    # Readiness is judged from the process' CPU usage instead
+    win32event = None
+
+
+launch_latency = metrics.registry.histogram(
+    "stroll_launch_seconds", "Time until the meeting client was ready after a launch", ["start"])
+launch_failures = metrics.registry.counter("stroll_launch_failures_total", "Launches that never became ready")
+
+
+class Launch(NamedTuple):
+    started_at: float  # time.time() of the launch
+    latency: Optional[float]  # Seconds until the client was ready, None if it never was
+    cold: bool  # Whether the client wasn't running before the launch
+    error: Optional[OSError] = None  # Why the client couldn't be started, if it couldn't
+
+
+class Launcher:
+    '''Starts the meeting client and tracks how long it takes to be ready.
+    Args:
+        path: The client's executable, environment variables are expanded.
+        ready_timeout: Seconds to wait for the client to be ready.
+    '''
+    # Polling interval and the CPU usage under which a process is considered idle, when waiting for it
+    POLL_INTERVAL = 0.05
+    IDLE_CPU_PERCENT = 2.0
+
+    def __init__(self, path: str, ready_timeout: float = 30):
+        self.path = path
+        self.ready_timeout = ready_timeout
+        self.lock = threading.Lock()
+        # The most recent launches
+        self.launches = collections.deque(maxlen=100)
+        # Why the client last couldn't be started, None if the last start succeeded
+        self.start_error: Optional[OSError] = None
+
+    @property
+    def executable(self) -> str:
+        return os.path.normcase(os.path.abspath(os.path.expandvars(os.path.expanduser(self.path))))
+
+    def find_processes(self) -> List[psutil.Process]:
+        '''The running processes of the client.'''
+        executable = self.executable
+        name = os.path.basename(executable)
+        processes = []
+        for process in psutil.process_iter(["exe", "name"]):
+            exe = process.info["exe"]
+            # The path of processes of other users can't be read, their name can
+            if (os.path.normcase(exe) == executable if exe
+                    else os.path.normcase(process.info["name"] or "") == name):
+                processes.append(process)
+        return processes
+
+    def is_alive(self) -> bool:
+        '''Whether the client is running.'''
+        return any(process.is_running() and process.status() != psutil.STATUS_ZOMBIE
+                   for process in self.find_processes())
+
+    def prewarm(self) -> bool:
+        '''Start the client if it isn't running, so that a join doesn't wait for it to start.
+
+        Returns:
+            Whether the client was started, see start_error if it couldn't be.
+        '''
+        with self.lock:
+            if self.is_alive():
+                return False
+            try:
+                self._start([])
+            except OSError:
+                return False
+            return True
+
+    def launch(self, url: str) -> Launch:
+        '''Open a URL with the client and wait for it to be ready.
+        Args:
+            url: The URL to open, such as a zoommtg:// link.
+
+        Returns:
+            The launch, also added to launches. Its error is set if the client couldn't be started.
+        '''
+        with self.lock:
+            cold = not self.is_alive()
+            started_at, start = time.time(), time.perf_counter()
+            try:
+                process = self._start([f"--url={url}"])
+            except OSError as error:
+                process, launch = None, Launch(started_at, None, cold, error)
+        if process is not None:
+            ready = self._wait_until_ready(process, start + self.ready_timeout)
+            launch = Launch(started_at, time.perf_counter() - start if ready else None, cold)
+        self.launches.append(launch)
+        if launch.latency is None:
+            launch_failures.inc()
+        else:
+            launch_latency.labels("cold" if cold else "warm").observe(launch.latency)
+        return launch
+
+    def _start(self, arguments) -> subprocess.Popen:
+        # Run directly, arguments are passed as they are instead of being parsed by a shell.
+        # The working directory is the client's, so that Stroll's directory isn't kept in use
+        executable = self.executable
+        try:
+            process = subprocess.Popen([executable, *arguments], cwd=os.path.dirname(executable),
+                                       stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                       stderr=subprocess.DEVNULL, close_fds=True)
+        except OSError as error:
+            # Not installed where the path points, or not executable
+            self.start_error = error
+            raise
+        self.start_error = None
+        return process
+
+    def _wait_until_ready(self, process: subprocess.Popen, deadline: float) -> bool:
+        if win32event is not None and self._wait_for_input_idle(process, deadline):
+            return True
+        try:
+            watched = psutil.Process(process.pid)
+            watched.cpu_percent()
+        except psutil.NoSuchProcess:
+            return process.poll() == 0
+        idle_polls = 0
+        while time.perf_counter() < deadline:
+            if process.poll() is not None:
+                # Handed the URL to a running client and exited
+                return process.returncode == 0
+            try:
+                cpu_percent = watched.cpu_percent()
+            except psutil.NoSuchProcess:
+                return process.poll() == 0
+            # Done starting up once it stops working for a couple of polls
+            idle_polls = idle_polls + 1 if cpu_percent < self.IDLE_CPU_PERCENT else 0
+            if idle_polls >= 2:
+                return True
+            time.sleep(self.POLL_INTERVAL)
+        return False
+
+    def _wait_for_input_idle(self, process, deadline) -> bool:
+        # Windows knows when a process' UI is waiting for input, which is when it's ready
+        try:
+            handle = win32api.OpenProcess(win32con.PROCESS_QUERY_INFORMATION | win32con.SYNCHRONIZE,
+                                          False, process.pid)
+        except win32api.error:
+            return False
+        try:
+            timeout = max(int((deadline - time.perf_counter()) * 1000), 0)
+            return win32event.WaitForInputIdle(handle, timeout) == 0
+        except win32api.error:
+            # Not a GUI process, or it has already exited
+            return False
+        finally:
+            win32api.CloseHandle(handle)
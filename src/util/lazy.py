@@ -0,0 +1,53 @@
+"""
+Import modules on first use, so that starting up only pays for the modules it needs.
+"""
+import importlib
+import threading
+
+
+class LazyModule:
+    '''Stands in for a module, importing it the first time one of its attributes is read or set.
+    Args:
+        name: The absolute name of the module.
+        on_load: Called with the module once it's imported, before it's used.
+    '''
+
+    def __init__(self, name, on_load=None):
+        # Set on the instance itself, attributes of the proxy would otherwise be forwarded
+        object.__setattr__(self, "_name", name)
+        object.__setattr__(self, "_on_load", on_load)
+        object.__setattr__(self, "_module", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _load(self):
+        '''Import the module if it isn't yet, from any thread.'''
+        module = self._module
+        if module is None:
+            with self._lock:
+                module = self._module
+                if module is None:
+                    module = importlib.import_module(self._name)
+                    if self._on_load:
+                        self._on_load(module)
+                    object.__setattr__(self, "_module", module)
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+    def __setattr__(self, attribute, value):
+        setattr(self._load(), attribute, value)
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module {self._name!r} ({state})>"
+
+
+def is_loaded(module) -> bool:
+    '''Whether a module has been imported, without importing it.
+    Args:
+        module: A LazyModule or a module.
+    '''
+    if isinstance(module, LazyModule):
+        return object.__getattribute__(module, "_module") is not None
+    return True
@@ -0,0 +1,98 @@
+"""
+Find the meeting an event links to, scanning each version of an event only once.
+"""
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+
+
+class Meeting(NamedTuple):
+    provider: str
+    host: str  # The domain the meeting is hosted on, vanity domains included
+    number: str  # The conference number
+    password: Optional[str]
+    url: str  # The link the meeting was found from
+
+
+# All link formats are alternatives of a single pattern, so that a text is scanned once
+PATTERN = re.compile(
+    # Web links: zoom.us/j/<number>, <company>.zoom.us/w/<number>, zoomgov.com/j/<number>,
+    # optionally followed by a query with the (encoded) password
+    r"(?P<web>https?://(?P<web_host>(?:[\w-]+\.)*(?:zoom\.us|zoomgov\.com))/(?:j|w|s)/(?P<web_number>\d{9,11})"
+    r"(?:\?(?:[^\s\"'<>#?]*?(?:&amp;|[&;]))?pwd=(?P<web_password>[\w.-]+))?)"
+    # App links: zoommtg://zoom.us/join?action=join&confno=<number>&pwd=<password>
+    r"|(?P<app>zoommtg://(?P<app_host>[\w.-]+)/join\?[^\s\"'<>#]*?confno=(?P<app_number>\d{9,11})"
+    r"(?:(?:&amp;|&)pwd=(?P<app_password>[\w.-]+))?)"
+    # Bare numbers with a password, the format of older invitations
+    r"|(?P<bare>(?P<bare_number>\d{9,11})\?pwd=(?P<bare_password>\w+))",
+    re.IGNORECASE
+)
+
+
+# Free text search terms that find events linking to each provider's meetings, they may match
+# more than meetings (and miss bare numbers), results are to be scanned
+SEARCH_TERMS = {
+    "zoom": ("zoom.us", "zoomgov.com", "zoommtg"),
+}
+
+
+def scan(text: str) -> Optional[Meeting]:
+    '''Find the first meeting link in a text, plain or HTML.'''
+    match = PATTERN.search(text)
+    if not match:
+        return None
+    # The outer group of an alternative closes last
+    kind = match.lastgroup
+    host = match.group(f"{kind}_host") if kind != "bare" else "zoom.us"
+    return Meeting("zoom", host.lower(), match.group(f"{kind}_number"),
+                   match.group(f"{kind}_password"), match.group(kind))
+
+
+def _scan_event(event: Dict) -> Optional[Meeting]:
+    # Structured conference data is the most reliable, free text the least
+    conference = event.get("conferenceData") or {}
+    for entry_point in conference.get("entryPoints", ()):
+        if entry_point.get("entryPointType") == "video":
+            meeting = scan(entry_point.get("uri", ""))
+            if meeting:
+                if not meeting.password and entry_point.get("password"):
+                    meeting = meeting._replace(password=entry_point["password"])
+                return meeting
+    for field in ("location", "description"):
+        if event.get(field):
+            meeting = scan(event[field])
+            if meeting:
+                return meeting
+    return None
+
+
+# (event id, etag) -> Meeting or None, least recently used first
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+CACHE_SIZE = 4096
+
+
+def find_meeting(event: Dict) -> Optional[Meeting]:
+    '''Find the meeting an event links to.
+    Results are cached by event id and etag, so an event is only scanned again once it changes.
+    Args:
+        event: The Event to search.
+
+    Returns:
+        The meeting, None if the event doesn't link to one.
+    '''
+    version = event.get("etag") or event.get("updated")
+    if not version:
+        return _scan_event(event)
+    key = (event.get("id"), version)
+    with _cache_lock:
+        if key in _cache:
+            _cache.move_to_end(key)
+            return _cache[key]
+    meeting = _scan_event(event)
+    with _cache_lock:
+        _cache[key] = meeting
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return meeting
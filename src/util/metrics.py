@@ -0,0 +1,248 @@
+"""
+Count, measure and time what Stroll does, and export it as Prometheus text or a rolling JSON file.
+"""
+import bisect
+import collections
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from util.data import write_atomically
+
+# Upper bounds in seconds, from a cached lookup to a slow sync over a bad connection
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+class Metric:
+    '''A named value, or a value per combination of labels.
+    Args:
+        name: The name of the metric, in Prometheus' snake case.
+        help: A description of the metric.
+        labels: The names of the labels, values are told apart by them.
+    '''
+    type = None
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.lock = threading.Lock()
+        self.children = {}  # label values -> metric
+
+    def labels(self, *values: str) -> "Metric":
+        '''The metric for the given label values, in the order of the label names.'''
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.label_names):
+                raise ValueError(f"{self.name} takes labels {self.label_names}, got {values}")
+            with self.lock:
+                child = self.children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        return type(self)(self.name, self.help)
+
+    def samples(self) -> List[Tuple[Tuple[str, ...], "Metric"]]:
+        '''(label values, metric) of every value, the metric itself if it has no labels.'''
+        if not self.label_names:
+            return [((), self)]
+        with self.lock:
+            return sorted(self.children.items())
+
+
+class Counter(Metric):
+    '''A total that only goes up, such as the number of requests made.'''
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.value = 0
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def to_json(self):
+        return self.value
+
+
+class Gauge(Metric):
+    '''A value that goes up and down, such as the number of scheduled joins.'''
+    type = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        super().__init__(name, help, labels)
+        self.value = 0
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1):
+        with self.lock:
+            self.value += amount
+
+    def to_json(self):
+        return self.value
+
+
+class Histogram(Metric):
+    '''The distribution of observed values over fixed buckets, such as request latencies.
+    Recording an observation is a bisect and three additions, nothing is kept per observation.
+    Args:
+        buckets: The increasing upper bounds of the buckets, values above the last go to +Inf.
+    '''
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def _new_child(self):
+        return Histogram(self.name, self.help, buckets=self.buckets)
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        '''Observe the seconds spent in the block.'''
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+    def quantile(self, q: float) -> Optional[float]:
+        '''Estimate a quantile by interpolating inside its bucket, None without observations.'''
+        with self.lock:
+            counts, count = list(self.counts), self.count
+        if not count:
+            return None
+        rank = q * count
+        cumulative = 0
+        for index, bucket_count in enumerate(counts):
+            if cumulative + bucket_count >= rank and bucket_count:
+                if index == len(self.buckets):
+                    # Beyond the last bound, the best known is that bound
+                    return self.buckets[-1]
+                lower = self.buckets[index - 1] if index else 0
+                return lower + (self.buckets[index] - lower) * (rank - cumulative) / bucket_count
+            cumulative += bucket_count
+        return self.buckets[-1]
+
+    def to_json(self):
+        return {"count": self.count, "sum": self.sum, "p50": self.quantile(0.5), "p99": self.quantile(0.99)}
+
+
+class Registry:
+    '''The metrics of a program, created once and updated from anywhere.'''
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, Metric] = {}
+
+    def _register(self, metric_type, name, help, labels, **kwargs):
+        with self.lock:
+            metric = self.metrics.get(name)
+            if metric is None:
+                metric = self.metrics[name] = metric_type(name, help, labels, **kwargs)
+            elif not isinstance(metric, metric_type) or metric.label_names != tuple(labels):
+                raise ValueError(f"{name} is already registered as a different metric")
+            return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        '''Get or create a counter, see Metric for the arguments.'''
+        return self._register(Counter, name, help, labels)
+
+    def gauge(self, name: str, help: str, labels: Sequence[str] = ()) -> Gauge:
+        '''Get or create a gauge, see Metric for the arguments.'''
+        return self._register(Gauge, name, help, labels)
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        '''Get or create a histogram, see Metric and Histogram for the arguments.'''
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def to_prometheus(self) -> str:
+        '''Render every metric in Prometheus' text exposition format.'''
+        lines = []
+        with self.lock:
+            metrics = list(self.metrics.values())
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for values, sample in metric.samples():
+                labels = list(zip(metric.label_names, values))
+                if isinstance(sample, Histogram):
+                    cumulative = 0
+                    for bound, count in zip((*sample.buckets, math.inf), sample.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == math.inf else repr(float(bound))
+                        lines.append(f"{metric.name}_bucket{_format_labels(labels + [('le', le)])} {cumulative}")
+                    lines.append(f"{metric.name}_sum{_format_labels(labels)} {sample.sum}")
+                    lines.append(f"{metric.name}_count{_format_labels(labels)} {sample.count}")
+                else:
+                    lines.append(f"{metric.name}{_format_labels(labels)} {sample.value}")
+        return "\n".join(lines) + "\n"
+
+    def to_json(self) -> Dict:
+        '''A snapshot of every metric, values of labeled metrics are keyed by their joined labels.'''
+        with self.lock:
+            metrics = list(self.metrics.values())
+        snapshot = {}
+        for metric in metrics:
+            if metric.label_names:
+                snapshot[metric.name] = {",".join(values): sample.to_json() for values, sample in metric.samples()}
+            else:
+                snapshot[metric.name] = metric.to_json()
+        return snapshot
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, value in labels)
+    return "{" + ",".join(f"{name}=\"{value}\"" for (name, _), value in zip(labels, escaped)) + "}"
+
+
+class RollingExport:
+    '''Writes snapshots of a registry to a JSON file of the most recent ones, and the current
+    values to a Prometheus text file next to it, for node_exporter's textfile collector or a look.
+    Args:
+        registry: The metrics to export.
+        path: The JSON file, the Prometheus file has the same name with a .prom extension.
+        keep: The number of snapshots kept in the JSON file.
+    '''
+
+    def __init__(self, registry: Registry, path: str, keep: int = 60):
+        self.registry = registry
+        self.path = path
+        self.keep = keep
+        self.snapshots = collections.deque(maxlen=keep)
+        self.lock = threading.Lock()
+
+    def export(self):
+        with self.lock:
+            if self.snapshots.maxlen != self.keep:
+                self.snapshots = collections.deque(self.snapshots, maxlen=self.keep)
+            self.snapshots.append({"time": time.time(), "metrics": self.registry.to_json()})
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            snapshots = json.dumps(list(self.snapshots), indent=1)
+            write_atomically(self.path, lambda file: file.write(snapshots))
+            prometheus = self.registry.to_prometheus()
+            write_atomically(os.path.splitext(self.path)[0] + ".prom", lambda file: file.write(prometheus))
+
+
+# Shared by every module, metrics are registered where they're recorded
+registry = Registry()
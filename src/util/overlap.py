@@ -0,0 +1,126 @@
+"""
+Classify events by how they overlap a time span, a whole batch of events at a time.
+"""
+from datetime import date, datetime
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# Indexed by (starts before the span) + 2 * (ends after the span)
+OVERLAP_TYPES = ("Inside", "OverStart", "OverEnd", "Across")
+# Batches smaller than this are classified in pure Python, converting them to arrays costs more
+NUMPY_THRESHOLD = 256
+
+
+@lru_cache(maxsize=None)
+def _import_numpy():
+    # numpy takes longer to import than the rest of Stroll, it's only imported once a batch needs it
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+@lru_cache(maxsize=65536)
+def _parse_date_time(value: str) -> int:
+    return int(datetime.fromisoformat(value).timestamp())
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(value: str) -> int:
+    # All-day events are bounded by local midnights
+    return int(datetime.combine(date.fromisoformat(value), datetime.min.time()).timestamp())
+
+
+def _parse(time: Dict) -> int:
+    if "dateTime" in time:
+        return _parse_date_time(time["dateTime"])
+    return _parse_date(time["date"])
+
+
+def get_epoch_bounds(event: Dict) -> Tuple[int, int]:
+    '''Get the start and end of an event, timed or all-day, in seconds since the epoch.
+    Parsed times are cached, so that an event is only parsed once however often it's classified.
+    '''
+    return _parse(event["start"]), _parse(event["end"])
+
+
+@lru_cache(maxsize=64)
+def _compile(filters: Tuple[str, ...], allow_incomplete_overlaps: bool) -> Tuple[bool, ...]:
+    type_filters = {}
+    for filter in filters:
+        # The first filter of a type determines whether it's filtered in or out
+        if filter[0] in "+-" and filter[1:] not in type_filters:
+            type_filters[filter[1:]] = filter[0] == "+"
+    return tuple(type_filters.get(overlap_type, False) and (allow_incomplete_overlaps or overlap_type == "Inside")
+                 for overlap_type in OVERLAP_TYPES)
+
+
+def compile_filters(filters: Iterable[str], allow_incomplete_overlaps: bool) -> Tuple[bool, ...]:
+    '''Compile filters into whether each of OVERLAP_TYPES passes, compiled filters are cached.
+    See api.get_events_in_time_span for the filters.
+    '''
+    return _compile(tuple(filters), allow_incomplete_overlaps)
+
+
+def classify(events: Sequence[Dict], time_from: datetime, time_to: datetime,
+             allow_incomplete_overlaps: bool, filters: Iterable[str]) -> List[Dict]:
+    '''Classify and filter a batch of events in one pass, keeping their order.
+    Events not overlapping the time span at all are dropped.
+
+    Returns:
+        The events passing the filters, each with an added field "overlapType".
+    '''
+    passes = compile_filters(filters, allow_incomplete_overlaps)
+    span_from, span_to = time_from.timestamp(), time_to.timestamp()
+    starts = [_parse(event["start"]) for event in events]
+    ends = [_parse(event["end"]) for event in events]
+    if len(starts) >= NUMPY_THRESHOLD and _import_numpy() is not None:
+        chosen = _classify_arrays(starts, ends, span_from, span_to, passes)
+    else:
+        chosen = _classify_lists(starts, ends, span_from, span_to, passes)
+    events_chosen = []
+    for position, index in chosen:
+        event = events[position]
+        event["overlapType"] = OVERLAP_TYPES[index]
+        events_chosen.append(event)
+    return events_chosen
+
+
+def iter_classify(events: Iterable[Dict], time_from: datetime, time_to: datetime,
+                  allow_incomplete_overlaps: bool, filters: Iterable[str]) -> Iterator[Dict]:
+    '''Classify and filter events one at a time as they arrive, see classify.'''
+    passes = compile_filters(filters, allow_incomplete_overlaps)
+    span_from, span_to = time_from.timestamp(), time_to.timestamp()
+    for event in events:
+        overlap_type = _classify_one(*get_epoch_bounds(event), span_from, span_to, passes)
+        if overlap_type is not None:
+            event["overlapType"] = overlap_type
+            yield event
+
+
+def _classify_one(start, end, span_from, span_to, passes):
+    if start >= span_to or end <= span_from:
+        return None
+    index = (start < span_from) + 2 * (end > span_to)
+    return OVERLAP_TYPES[index] if passes[index] else None
+
+
+def _classify_lists(starts, ends, span_from, span_to, passes):
+    # The positions of the chosen events with the index of their overlap type
+    chosen = []
+    for position, (start, end) in enumerate(zip(starts, ends)):
+        if start < span_to and end > span_from:
+            index = (start < span_from) + 2 * (end > span_to)
+            if passes[index]:
+                chosen.append((position, index))
+    return chosen
+
+
+def _classify_arrays(starts, ends, span_from, span_to, passes):
+    numpy = _import_numpy()
+    starts = numpy.array(starts, dtype=numpy.int64)
+    ends = numpy.array(ends, dtype=numpy.int64)
+    indices = (starts < span_from).astype(numpy.int8) + 2 * (ends > span_to)
+    positions = numpy.flatnonzero(numpy.array(passes)[indices] & (starts < span_to) & (ends > span_from))
+    return zip(positions.tolist(), indices[positions].tolist())
@@ -0,0 +1,152 @@
+"""
+Receive push notifications for changes to watched calendars.
+"""
+import secrets
+import threading
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterable, Optional, Set
+
+from util import api
+
+
+class ChannelManager:
+    '''Keeps notification channels open for the calendars of every account and routes notifications to them.
+    Args:
+        address: The HTTPS address Google posts notifications to, forwarded to the receiver.
+        on_change: Called with the calendarId of a calendar whose events have changed, using the
+            calendar's account for API calls.
+        ttl: How long channels are requested to live for.
+    '''
+
+    def __init__(self, address: str, on_change: Callable[[str], None], ttl: timedelta = timedelta(days=7)):
+        self.address = address
+        self.on_change = on_change
+        self.ttl = ttl
+        # Notifications are only accepted if they carry this token
+        self.token = secrets.token_urlsafe(32)
+        self.lock = threading.Lock()
+        # channel id -> {"account": str, "calendarId": str, "resourceId": str, "expiration": datetime}
+        self.channels = {}
+        # (account, calendarId) of calendars that don't support notifications, such as holiday calendars
+        self.unsupported = set()
+
+    def watch(self, calendar_ids: Iterable[str], renew_before: datetime) -> Set[str]:
+        '''Open channels for unwatched calendars and renew channels expiring before a time.
+        Only the current account's channels are touched, those of calendars not in calendar_ids are stopped.
+
+        Returns:
+            The calendarIds of the calendars left without a channel, their changes have to be polled for.
+        '''
+        account = api.get_account().name
+        calendar_ids = set(calendar_ids)
+        with self.lock:
+            channels = {channel_id: channel for channel_id, channel in self.channels.items()
+                        if channel["account"] == account}
+        watched = set()
+        for channel_id, channel in channels.items():
+            if channel["calendarId"] in calendar_ids and channel["expiration"] > renew_before:
+                watched.add(channel["calendarId"])
+            else:
+                # The replacement channel overlaps with this one until it's stopped, duplicate
+                # notifications only cause a redundant sync
+                self._stop(channel_id)
+        unwatched = set()
+        for calendar_id in calendar_ids - watched:
+            if (account, calendar_id) in self.unsupported:
+                unwatched.add(calendar_id)
+                continue
+            channel_id = str(uuid.uuid4())
+            try:
+                channel = api.watch_events(calendar_id, channel_id, self.address, self.token, self.ttl)
+            except api.HttpError as error:
+                # 400 for calendars that can't be watched, anything else is tried again next time
+                if error.resp.status == 400:
+                    self.unsupported.add((account, calendar_id))
+                unwatched.add(calendar_id)
+                continue
+            if not channel:  # In case of an error
+                unwatched.add(calendar_id)
+                continue
+            with self.lock:
+                self.channels[channel_id] = {
+                    "account": account,
+                    "calendarId": calendar_id,
+                    "resourceId": channel["resourceId"],
+                    "expiration": datetime.fromtimestamp(int(channel["expiration"]) / 1000).astimezone()
+                }
+        return unwatched
+
+    def _stop(self, channel_id):
+        with self.lock:
+            channel = self.channels.pop(channel_id, None)
+        if channel:
+            try:
+                with api.use_account(channel["account"]):
+                    api.stop_channel(channel_id, channel["resourceId"])
+            except (api.OfflineError, KeyError):
+                # Offline or the account has been removed, left to expire, its notifications are ignored once it's no longer known
+                pass
+
+    def unwatch_all(self):
+        for channel_id in list(self.channels):
+            self._stop(channel_id)
+
+    def route(self, headers) -> Optional[Dict]:
+        '''Find the channel a notification came through from its headers.
+
+        Returns:
+            The channel of the watched calendar, None if the notification didn't come from an open channel.
+        '''
+        if headers.get("X-Goog-Channel-Token") != self.token:
+            return None
+        with self.lock:
+            return self.channels.get(headers.get("X-Goog-Channel-ID"))
+
+    def notify(self, channel: Dict):
+        '''Call on_change for the calendar of a channel, with the channel's account in use.'''
+        try:
+            account = api.accounts[channel["account"]]
+        except KeyError:
+            # The account has been removed since the channel was opened
+            return
+        with api.use_account(account):
+            self.on_change(channel["calendarId"])
+
+
+class NotificationReceiver(ThreadingHTTPServer):
+    '''Listens for notifications on a local port and hands them to a ChannelManager.'''
+    daemon_threads = True
+
+    def __init__(self, manager: ChannelManager, port: int, host: str = "127.0.0.1"):
+        super().__init__((host, port), _NotificationHandler)
+        self.manager = manager
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _NotificationHandler(BaseHTTPRequestHandler):
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        # Notifications have no meaningful body, the headers describe the change
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        channel = self.server.manager.route(self.headers)
+        # Google retries notifications that weren't acknowledged with a 2xx status, so
+        # the notification is acknowledged before the (slow) resync
+        self.send_response(200 if channel else 404)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+        self.wfile.flush()
+        # The "sync" notification only confirms that the channel has been opened
+        if channel and self.headers.get("X-Goog-Resource-State") != "sync":
+            self.server.manager.notify(channel)
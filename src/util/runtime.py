@@ -0,0 +1,92 @@
+"""
+Run timers and blocking work from a single asyncio event loop thread.
+"""
+import asyncio
+import concurrent.futures
+import threading
+import traceback
+
+
+class Runtime:
+    '''An asyncio event loop running on its own thread, with a bounded executor for blocking calls.
+    Args:
+        max_workers: The maximum number of blocking calls running at once.
+    '''
+
+    def __init__(self, max_workers=4):
+        self.loop = asyncio.new_event_loop()
+        self.executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="stroll-worker")
+        self.loop.set_default_executor(self.executor)
+        self.thread = threading.Thread(target=self._run, name="stroll-runtime")
+        self.lock = threading.Lock()
+        self.stopped = False
+
+    @property
+    def running(self):
+        return self.thread.is_alive() and not self.stopped
+
+    def start(self, keep_alive=True):
+        '''Start the event loop thread, does nothing if it's already running.
+        Args:
+            keep_alive(bool): Whether the event loop thread keeps the program alive until stopped.
+        '''
+        with self.lock:
+            if self.thread.is_alive() or self.stopped:
+                return
+            self.thread.daemon = not keep_alive
+            self.thread.start()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+        # Cancel what's left once stopped
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def in_loop(self):
+        '''Whether the calling thread is the event loop thread.'''
+        return threading.current_thread() is self.thread
+
+    def call_soon(self, callback, *args):
+        '''Run a callback on the event loop thread, from any thread.'''
+        self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        '''Run a callback on the event loop thread after a delay in seconds, from any thread.'''
+        self.loop.call_soon_threadsafe(self.loop.call_later, delay, callback, *args)
+
+    def run_blocking(self, function, *args, **kwargs) -> concurrent.futures.Future:
+        '''Run a blocking function on the executor, from any thread.
+        Exceptions are printed since nothing may be waiting on the returned future.
+        '''
+        return self.executor.submit(_report_exceptions, function, *args, **kwargs)
+
+    def run_coroutine(self, coroutine) -> concurrent.futures.Future:
+        '''Run a coroutine on the event loop, from any thread.'''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    def stop(self):
+        '''Stop the event loop and cancel queued blocking calls.
+        Blocking calls that are already running are left to finish.
+        '''
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+        if self.thread.is_alive():
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            if not self.in_loop():
+                self.thread.join()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _report_exceptions(function, *args, **kwargs):
+    try:
+        return function(*args, **kwargs)
+    except Exception:
+        traceback.print_exc()
+        raise
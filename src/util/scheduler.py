@@ -1,122 +1,236 @@
 """
 Schedule tasks to run at a given time.
 """
+import collections
 import datetime as dt
+import heapq
+import itertools
 import threading
 
+from util import metrics
+from util.runtime import Runtime
 
-class TaskNode:
-    def __init__(self, value):
-        self.next = None
-        self.value = value
-        pass
+# From firing on time to firing after waking from sleep
+LATENESS_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, 60, 300)
+task_lateness = metrics.registry.histogram(
+    "stroll_scheduler_lateness_seconds", "Time between when tasks should and did fire", buckets=LATENESS_BUCKETS)
+clock_jump_count = metrics.registry.counter(
+    "stroll_scheduler_clock_jumps_total", "Times the wall clock jumped away from the monotonic clock")
+
+
+class Task:
+    '''A handle to a scheduled task, used to cancel it.'''
+    __slots__ = ("time", "action", "data", "cancelled", "lateness")
+
+    def __init__(self, time, action, data=None):
+        self.time = time
+        self.action = action
+        self.data = data
+        self.cancelled = False
+        # Seconds between `time` and when the task's action actually started, None until then
+        self.lateness = None
 
 
 class Scheduler:
-    def __init__(self):
-        self.head = None
+    # Task times are wall clock times, but timers run on the monotonic clock, which drifts from the
+    # wall clock across sleep, clock adjustments and timezone changes. Timers are therefore re-armed
+    # from the wall clock at least every COARSE_STEP seconds, and a single precise timer is only
+    # armed within FINE_WINDOW seconds of the task.
+    COARSE_STEP = 10
+    FINE_WINDOW = 1
+    # Tasks are fired at most this many seconds early
+    TOLERANCE = 0.05
+    # Disagreements between the clocks above this many seconds are counted as clock jumps
+    JUMP_THRESHOLD = 1
+
+    def __init__(self, runtime=None):
+        # Timers run on the runtime's event loop and actions on its executor
+        self.runtime = runtime or Runtime()
+        # Heap of [time, sequence, task], the sequence keeps tasks at equal times in insertion order
+        self.queue = []
+        self.sequence = itertools.count()
+        # Cancelled tasks are left in the queue until they reach the top
+        self.cancelled_count = 0
+        self.lock = threading.RLock()
         self.active = False
         self.terminated = False
+        # Only accessed from the event loop thread
         self.timer = None
-        pass
+        self.last_readings = None  # (wall clock, loop clock) at the last wake up
+        self.clock_jumps = 0
+        # The lateness of recently fired tasks, in seconds
+        self.lateness = collections.deque(maxlen=100)
+
+    @property
+    def head(self):
+        '''The next task to run, None if no tasks are scheduled.'''
+        with self.lock:
+            self._drop_cancelled()
+            return self.queue[0][2] if self.queue else None
+
+    def __len__(self):
+        with self.lock:
+            return len(self.queue) - self.cancelled_count
 
     def add_task(self, time, action, data=None):
-        '''Add a task to the task-chain.
+        '''Add a task to the queue.
         Args:
             time (datetime): When the task occurs.
             action (function): Function to run when `time` is reached.
             data (Dict): The data associated with the task. Never used internally.
+
+        Returns:
+            Task: A handle to cancel the task with.
         '''
         self._handle_terminated()
-        task = TaskNode({"time": time, "action": action, "data": data})
-        head = self.head
-        if head is None:  # First task is being added
-            self.head = task
-        else:
-            node = self.head
-            while node:
-                isHead = node == self.head
-                notTail = node.next != None
-
-                afterNode = time > node.value["time"]
-                if notTail:
-                    beforeNextNode = time < node.next.value["time"]
-                else:
-                    beforeNextNode = True  # allow all times at the tail
-
-                if afterNode and beforeNextNode:  # Add task after current node
-                    task.next = node.next
-                    node.next = task
-                    break
-                # Add task before current node (head)
-                elif isHead and not afterNode:
-                    task.next = node
-                    self.head = task
-                node = node.next
-
-        if task == self.head:
-            # Timer needs to be changed
-            if self.active:
-                if self.timer:
-                    self.timer.cancel()
-                self._wait_for_head()
-
-    def remove_task(self, time):
-        if self.head.value["time"] == time:
-            self.head = self.head.next
-        else:
-            next_node = self.head.next
-            while next_node.value["time"] != time:
-                node = node.next
-                next_node = node.next
-            if next_node:
-                node.next = next_node.next
+        task = Task(time, action, data)
+        with self.lock:
+            heapq.heappush(self.queue, [time, next(self.sequence), task])
+            if self.queue[0][2] is task:
+                # Timer needs to be changed
+                self._rewait()
+        return task
+
+    def add_tasks(self, tasks):
+        '''Add many tasks to the queue at once.
+        Args:
+            tasks: Iterable of (time, action) or (time, action, data) tuples.
+
+        Returns:
+            List[Task]: The handles of the tasks, in the given order.
+        '''
+        self._handle_terminated()
+        handles = []
+        with self.lock:
+            head = self.head
+            for time, action, *data in tasks:
+                task = Task(time, action, *data)
+                self.queue.append([time, next(self.sequence), task])
+                handles.append(task)
+            heapq.heapify(self.queue)
+            if self.queue and self.queue[0][2] is not head:
+                self._rewait()
+        return handles
+
+    def cancel_task(self, task):
+        '''Cancel a scheduled task. Cancelling a completed or cancelled task does nothing.
+        Args:
+            task (Task): The handle returned when the task was added.
+        '''
+        with self.lock:
+            if task.cancelled:
+                return
+            was_head = self.head is task
+            task.cancelled = True
+            self.cancelled_count += 1
+            if self.cancelled_count > len(self.queue) // 2:
+                # Mostly cancelled tasks, compact the queue to bound its size
+                self.queue = [entry for entry in self.queue if not entry[2].cancelled]
+                heapq.heapify(self.queue)
+                self.cancelled_count = 0
+            if was_head:
+                self._rewait()
+
+    remove_task = cancel_task
 
     def clear(self):
-        node = self.head
-        while node:
-            next_node = node.next
-            del node
-            node = next_node
-
-    def _wrap_action(self, action):
-        def wrapped():
-            action()
-            # Forget completed task
-            self.head = self.head.next
-            if self.active:
-                self._wait_for_head()
-        return wrapped
+        '''Remove all tasks.'''
+        with self.lock:
+            for _, _, task in self.queue:
+                task.cancelled = True
+            self.queue = []
+            self.cancelled_count = 0
+        self._rewait()
+
+    def _drop_cancelled(self):
+        while self.queue and self.queue[0][2].cancelled:
+            heapq.heappop(self.queue)
+            self.cancelled_count -= 1
+
+    def _pop_head(self, task):
+        with self.lock:
+            if self.head is not task:
+                # Cancelled or replaced after the timer fired
+                return False
+            heapq.heappop(self.queue)
+            # Completed tasks can't be cancelled
+            task.cancelled = True
+            return True
+
+    def _fire(self, task):
+        # Runs on the event loop thread
+        self.timer = None
+        now = dt.datetime.now().astimezone()
+        if (task.time - now).total_seconds() > self.TOLERANCE:
+            # The wall clock was set back after the timer was armed
+            self._wait_for_head()
+            return
+        if not self._pop_head(task):
+            return
+        # Actions block (network, processes), they're kept off the event loop
+        self.runtime.run_blocking(self._run, task)
+        self._wait_for_head()
+
+    def _run(self, task):
+        # Runs on the runtime's executor, the time spent waiting for a worker counts as lateness too
+        task.lateness = (dt.datetime.now().astimezone() - task.time).total_seconds()
+        self.lateness.append(task.lateness)
+        task_lateness.observe(task.lateness)
+        task.action()
+
+    def _rewait(self):
+        if self.active:
+            self.runtime.call_soon(self._wait_for_head)
+
+    def _check_clocks(self, now, loop_time):
+        if self.last_readings:
+            wall_elapsed = (now - self.last_readings[0]).total_seconds()
+            loop_elapsed = loop_time - self.last_readings[1]
+            if abs(wall_elapsed - loop_elapsed) > self.JUMP_THRESHOLD:
+                # Woke up from sleep or the clock was changed, timers are re-armed from the wall clock below
+                self.clock_jumps += 1
+                clock_jump_count.inc()
+        self.last_readings = (now, loop_time)
 
     def _wait_for_head(self):
-        task = self.head
-        if task:
-            interval = (task.value["time"] -
-                        dt.datetime.now().astimezone()).total_seconds()
-            # NOTE: Negative intervals execute instantly and are allowed in threading.Timer()
-            self.timer = threading.Timer(
-                interval, self._wrap_action(task.value["action"]))
-            self.timer.start()
+        # Runs on the event loop thread
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        if not self.active:
+            return
+        with self.lock:
+            task = self.head
+        if not task:
+            return
+        loop = self.runtime.loop
+        now = dt.datetime.now().astimezone()
+        loop_time = loop.time()
+        self._check_clocks(now, loop_time)
+        remaining = (task.time - now).total_seconds()
+        if remaining <= self.FINE_WINDOW:
+            self.timer = loop.call_at(loop_time + max(remaining, 0), self._fire, task)
+        else:
+            step = min(remaining - self.FINE_WINDOW, self.COARSE_STEP)
+            self.timer = loop.call_at(loop_time + step, self._wait_for_head)
 
     def start(self, auto_stop=False):
         '''Start the scheduler.
         Args:
-            auto_stop(bool): Whether the scheduler should stop when no tasks are scheduled.
+            auto_stop(bool): Whether the program may exit while the scheduler is running.
         '''
         self._handle_terminated()
+        self.runtime.start(keep_alive=not auto_stop)
         self.resume()
-        if auto_stop is False:
-            # Add daemon to keep scheduler alive
-            self.daemon = threading.Timer(
-                1 * 24 * 60 * 60, lambda: print("Exiting"))
 
     def terminate(self):
         '''Stop the scheduler.
-        Detaches the head and marks scheduler as terminated.
+        Clears the queue, stops the runtime and marks scheduler as terminated.
         '''
         self._handle_terminated()
         self.pause()
-        self.daemon.cancel()
+        self.clear()
+        self.runtime.stop()
         self.active = False
         self.terminated = True
 
@@ -131,12 +245,11 @@ class Scheduler:
             Note that the scheduler's activity is reverted, not toggled.
         '''
         self._handle_terminated()
-        self.active = False  # Does not cancel current timer
+        self.active = False
         # Remove the timer waiting for the head
-        if self.timer:
-            self.timer.cancel()
+        self.runtime.call_soon(self._wait_for_head)
         if timeToLast >= 0:
-            threading.Timer(timeToLast, lambda: self.resume())
+            self.runtime.call_later(timeToLast, self.resume)
 
     def resume(self, timeToLast=-1):
         '''Resume the scheduler.
@@ -146,6 +259,6 @@ class Scheduler:
         '''
         self._handle_terminated()
         self.active = True
-        self._wait_for_head()
+        self.runtime.call_soon(self._wait_for_head)
         if timeToLast >= 0:
-            threading.Timer(timeToLast, lambda: self.pause())
+            self.runtime.call_later(timeToLast, self.pause)
@@ -0,0 +1,132 @@
+"""
+Typed, validated snapshot of the settings file.
+"""
+import dataclasses
+from datetime import datetime, time, timedelta
+from typing import Tuple, Union, get_args, get_origin
+
+
+def convert_time_to_timedelta(time):
+    if time is None:
+        return None
+    # associate time with a date to allow operations
+    start = datetime.min
+    end = datetime.combine(datetime.min, time)
+    td = end - start
+    return td
+
+
+@dataclasses.dataclass(frozen=True)
+class GeneralSettings:
+    auto_startup: Union[bool, time]
+    join_on_startup: Union[bool, str]
+    update_on_startup: bool
+    zoom_path: str
+
+
+@dataclasses.dataclass(frozen=True)
+class JoiningSettings:
+    auto_join: bool
+    offset: timedelta
+    prewarm: Union[bool, timedelta]
+
+    def __post_init__(self):
+        if self.prewarm is True:
+            raise ValueError("Joining.prewarm must be a time before joining or false, not true")
+
+
+@dataclasses.dataclass(frozen=True)
+class SyncingSettings:
+    calendars: Tuple[str, ...]
+    period: timedelta
+    range_to_sync: timedelta
+    incremental: bool
+    fetch: str
+    server_filter: Union[bool, Tuple[str, ...]]
+    cadence: str
+    min_period: timedelta
+    max_period: timedelta
+    requests_per_hour: int
+    quiet_hours: Union[bool, Tuple[time, ...]]
+    query_ttl: Union[bool, timedelta]
+
+    def __post_init__(self):
+        if self.fetch not in ("batch", "parallel", "sequential"):
+            raise ValueError(f"Syncing.fetch must be batch, parallel or sequential, not {self.fetch!r}")
+        if self.cadence not in ("fixed", "adaptive"):
+            raise ValueError(f"Syncing.cadence must be fixed or adaptive, not {self.cadence!r}")
+        if self.min_period > self.max_period:
+            raise ValueError("Syncing.min-period can't be longer than Syncing.max-period")
+        if self.quiet_hours is not False and (
+                self.quiet_hours is True or len(self.quiet_hours) != 2 or not all(isinstance(hour, time) for hour in self.quiet_hours)):
+            raise ValueError(f"Syncing.quiet-hours must be false or [from, to] times, not {self.quiet_hours!r}")
+        if self.query_ttl is True:
+            raise ValueError("Syncing.query-ttl must be a time or false, not true")
+
+
+@dataclasses.dataclass(frozen=True)
+class PushSettings:
+    enabled: bool
+    address: str
+    port: int
+    fallback_period: timedelta
+
+
+@dataclasses.dataclass(frozen=True)
+class MetricsSettings:
+    enabled: bool
+    export_period: timedelta
+    keep: int
+
+
+@dataclasses.dataclass(frozen=True)
+class SettingsSettings:
+    open_in_notepad: bool
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    '''The settings file, with a field for each table and each key in snake case.'''
+    general: GeneralSettings
+    joining: JoiningSettings
+    syncing: SyncingSettings
+    push: PushSettings
+    metrics: MetricsSettings
+    settings: SettingsSettings
+
+    @classmethod
+    def from_file(cls, file):
+        '''Build a snapshot of a settings file.
+        Args:
+            file (DataFileInterface): The file to read values from, with its defaults.
+
+        Raises:
+            ValueError: A value is missing or has the wrong type.
+        '''
+        tables = {}
+        for table in dataclasses.fields(cls):
+            table_name = table.name.capitalize()
+            values = {}
+            for field in dataclasses.fields(table.type):
+                path = f"{table_name}.{field.name.replace('_', '-')}"
+                values[field.name] = _convert(path, file.get(path), field.type)
+            tables[table.name] = table.type(**values)
+        return cls(**tables)
+
+
+def _convert(path, value, field_type):
+    # Union members are tried in order, the first one that fits is used
+    options = get_args(field_type) if get_origin(field_type) is Union else (field_type,)
+    for option in options:
+        if option is timedelta and isinstance(value, time):
+            return convert_time_to_timedelta(value)
+        if get_origin(option) is tuple:
+            # Generic types can't be used with isinstance, lists are checked item by item instead
+            if isinstance(value, (list, tuple)):
+                item_type = get_args(option)[0]
+                return tuple(_convert(f"{path}[{index}]", item, item_type) for index, item in enumerate(value))
+            continue
+        # bool is an int, but an int setting shouldn't accept true/false
+        if isinstance(value, option) and not (option is int and isinstance(value, bool)):
+            return value
+    raise ValueError(f"{path} has an invalid value: {value!r}")
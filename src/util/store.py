@@ -0,0 +1,201 @@
+"""
+Persist synced calendars locally to answer event queries without the API.
+"""
+import copy
+import heapq
+import json
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
+
+from util.overlap import get_epoch_bounds
+
+
+# Bumped when the tables change, older tables are dropped and synced again
+SCHEMA_VERSION = 2
+
+
+class EventStore:
+    '''An SQLite backed copy of synced calendars, kept up to date with sync tokens.
+    Events are indexed by start time, queries are answered with index range scans.
+    Every account's calendars are kept in the same file, a store only sees those of its account.
+    Args:
+        path: The SQLite database file.
+        account: The name of the account whose calendars are kept, see api.Account.
+    '''
+
+    def __init__(self, path, account: str = "default"):
+        self.path = path
+        self.account = account
+        self.lock = threading.Lock()
+        # Shared between the tray, scheduler and sync threads, access is serialized by the lock
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.connection:
+            if self.connection.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS calendars")
+                self.connection.execute("DROP TABLE IF EXISTS events")
+                self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS calendars ("
+                "account TEXT, id TEXT, sync_token TEXT, synced_from REAL, synced_at REAL, "
+                # The longest event bounds how far before a time span overlapping events can start
+                "max_duration REAL NOT NULL DEFAULT 0, PRIMARY KEY (account, id))")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS events ("
+                "account TEXT, calendar_id TEXT, id TEXT, start_time REAL, end_time REAL, event TEXT, "
+                "PRIMARY KEY (account, calendar_id, id))")
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS events_by_start ON events (account, calendar_id, start_time)")
+
+    def for_account(self, account: str) -> "EventStore":
+        '''Get a store for another account's calendars, sharing this store's connection.'''
+        store = copy.copy(self)
+        store.account = account
+        return store
+
+    def _get_calendar_field(self, calendar_id, field):
+        with self.lock:
+            row = self.connection.execute(
+                f"SELECT {field} FROM calendars WHERE account = ? AND id = ?", (self.account, calendar_id)).fetchone()
+        return row and row[0]
+
+    def get_sync_token(self, calendar_id: str) -> Optional[str]:
+        return self._get_calendar_field(calendar_id, "sync_token")
+
+    def get_synced_from(self, calendar_id: str) -> Optional[datetime]:
+        synced_from = self._get_calendar_field(calendar_id, "synced_from")
+        return synced_from and datetime.fromtimestamp(synced_from).astimezone()
+
+    def get_calendar_ids(self) -> List[str]:
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT id FROM calendars WHERE account = ?", (self.account,)).fetchall()
+        return [row[0] for row in rows]
+
+    def get_last_synced(self) -> Optional[datetime]:
+        '''Get when the least recently synced calendar was synced.'''
+        with self.lock:
+            synced_at = self.connection.execute(
+                "SELECT MIN(synced_at) FROM calendars WHERE account = ?", (self.account,)).fetchone()[0]
+        return synced_at and datetime.fromtimestamp(synced_at).astimezone()
+
+    def apply(self, calendar_id: str, events: List[Dict], sync_token: str,
+              synced_from: Optional[datetime] = None):
+        '''Apply the result of a sync to the copy of a calendar.
+        Args:
+            calendar_id: calendarId of the synced calendar.
+            events: The changed events, cancelled events are removed from the copy.
+            sync_token: The nextSyncToken returned by the sync.
+            synced_from: The start of a full sync, replaces the copy instead of updating it.
+        '''
+        removed = []
+        changed = []
+        max_duration = 0
+        for event in events:
+            if event.get("status") == "cancelled":
+                removed.append((self.account, calendar_id, event["id"]))
+                continue
+            start, end = get_epoch_bounds(event)
+            max_duration = max(max_duration, end - start)
+            changed.append((self.account, calendar_id, event["id"], start, end, json.dumps(event)))
+
+        now = datetime.now().timestamp()
+        with self.lock, self.connection:
+            if synced_from is not None:
+                self.connection.execute(
+                    "DELETE FROM events WHERE account = ? AND calendar_id = ?", (self.account, calendar_id))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO calendars VALUES (?, ?, ?, ?, ?, ?)",
+                    (self.account, calendar_id, sync_token, synced_from.timestamp(), now, max_duration))
+            else:
+                self.connection.execute(
+                    "UPDATE calendars SET sync_token = ?, synced_at = ?, "
+                    "max_duration = MAX(max_duration, ?) WHERE account = ? AND id = ?",
+                    (sync_token, now, max_duration, self.account, calendar_id))
+            self.connection.executemany(
+                "DELETE FROM events WHERE account = ? AND calendar_id = ? AND id = ?", removed)
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO events VALUES (?, ?, ?, ?, ?, ?)", changed)
+
+    def forget(self, calendar_id: str):
+        '''Remove a calendar and its events from the store.'''
+        with self.lock, self.connection:
+            self.connection.execute(
+                "DELETE FROM events WHERE account = ? AND calendar_id = ?", (self.account, calendar_id))
+            self.connection.execute(
+                "DELETE FROM calendars WHERE account = ? AND id = ?", (self.account, calendar_id))
+
+    def forget_account(self):
+        '''Remove every calendar of the account and their events from the store.'''
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM events WHERE account = ?", (self.account,))
+            self.connection.execute("DELETE FROM calendars WHERE account = ?", (self.account,))
+
+    def get_events_in_time_span(self, calendar_ids: Iterable[str], time_from: datetime,
+                                time_to: datetime) -> List[Dict]:
+        '''Get the events overlapping a time span, ordered by start time.
+        Args:
+            calendar_ids: The calendarId(s) of the calendars to search.
+            time_from: The start of the time span (inclusive).
+            time_to: The end of the time span (exclusive).
+
+        Returns:
+            The events starting before the end and ending after the start of the time span.
+        '''
+        if isinstance(calendar_ids, str):
+            calendar_ids = [calendar_ids]
+        time_from = time_from.timestamp()
+        time_to = time_to.timestamp()
+        with self.lock:
+            cursors = []
+            for calendar_id in calendar_ids:
+                row = self.connection.execute(
+                    "SELECT max_duration FROM calendars WHERE account = ? AND id = ?",
+                    (self.account, calendar_id)).fetchone()
+                if not row:
+                    continue
+                cursors.append(self.connection.execute(
+                    "SELECT start_time, event FROM events WHERE account = ? AND calendar_id = ? "
+                    "AND start_time >= ? AND start_time < ? AND end_time > ? ORDER BY start_time",
+                    (self.account, calendar_id, time_from - row[0], time_to, time_from)))
+            rows = list(heapq.merge(*cursors, key=lambda row: row[0]))
+        return [json.loads(event) for _, event in rows]
+
+    def iter_events_before(self, calendar_ids: Iterable[str], time: datetime,
+                           since: Optional[datetime] = None) -> Iterator[Dict]:
+        '''Iterate over the events that started before a time, latest first.
+        The store is locked until the iterator is exhausted or closed.
+        Args:
+            calendar_ids: The calendarId(s) of the calendars to search.
+            time: The time before which the events start (exclusive).
+            since: The time after which the events start (inclusive).
+        '''
+        if isinstance(calendar_ids, str):
+            calendar_ids = [calendar_ids]
+        since = since.timestamp() if since else float("-inf")
+        with self.lock:
+            cursors = [self.connection.execute(
+                "SELECT start_time, event FROM events WHERE account = ? AND calendar_id = ? "
+                "AND start_time < ? AND start_time >= ? ORDER BY start_time DESC",
+                (self.account, calendar_id, time.timestamp(), since)) for calendar_id in calendar_ids]
+            for _, event in heapq.merge(*cursors, key=lambda row: row[0], reverse=True):
+                yield json.loads(event)
+
+    def get_latest_event_before(self, calendar_ids: Iterable[str], time: datetime,
+                                since: Optional[datetime] = None,
+                                predicate: Optional[Callable[[Dict], bool]] = None) -> Optional[Dict]:
+        '''Get the latest event that started before a time.
+        Args:
+            calendar_ids: The calendarId(s) of the calendars to search.
+            time: The time before which the event starts (exclusive).
+            since: The time after which the event starts (inclusive).
+            predicate: A condition the event must satisfy.
+        '''
+        events = self.iter_events_before(calendar_ids, time, since)
+        try:
+            for event in events:
+                if predicate is None or predicate(event):
+                    return event
+        finally:
+            events.close()
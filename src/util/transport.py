@@ -0,0 +1,102 @@
+"""
+A thread-safe HTTP transport over a bounded pool of keep-alive connections.
+"""
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+import httplib2
+from google.auth.credentials import Credentials
+from google_auth_httplib2 import AuthorizedHttp
+
+
+class HttpPool:
+    '''A bounded pool of httplib2.Http objects, each used by a single request at a time.
+    httplib2.Http isn't thread-safe, but it keeps its connections alive between requests, so
+    connections are lent out instead of being shared or opened per request.
+    Args:
+        size: The maximum number of Http objects, requests beyond it wait for one to be returned.
+        timeout: Socket timeout in seconds, the default socket timeout if None.
+    '''
+
+    def __init__(self, size: int = 8, timeout: Optional[float] = None):
+        self.size = size
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(size)
+        self.lock = threading.Lock()
+        # Most recently returned last, so that requests reuse the warmest connections
+        self.idle: List[httplib2.Http] = []
+        self.created = 0
+        self.reused = 0
+        # Response bodies received, in bytes
+        self.bytes_received = 0
+
+    @property
+    def requests(self) -> int:
+        '''The number of requests made through the pool.'''
+        return self.created + self.reused
+
+    @contextmanager
+    def connection(self):
+        '''Borrow an Http object for a request.'''
+        with self.slots:
+            with self.lock:
+                if self.idle:
+                    http = self.idle.pop()
+                    self.reused += 1
+                else:
+                    http = httplib2.Http(timeout=self.timeout)
+                    self.created += 1
+            try:
+                yield http
+            except BaseException:
+                # The connection may be left half way through a response
+                http.close()
+                raise
+            with self.lock:
+                self.idle.append(http)
+
+    def close(self):
+        '''Close all idle connections, borrowed ones are closed when returned to the pool.'''
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for http in idle:
+            http.close()
+
+
+class PooledHttp:
+    '''A stand-in for httplib2.Http that can be used from many threads at once, by running each
+    request on an Http object borrowed from a pool.
+    '''
+
+    def __init__(self, pool: HttpPool):
+        self.pool = pool
+        self.timeout = pool.timeout
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        with self.pool.connection() as http:
+            response, content = http.request(uri, method, body, headers, *args, **kwargs)
+        with self.pool.lock:
+            self.pool.bytes_received += len(content)
+        return response, content
+
+    def close(self):
+        self.pool.close()
+
+
+# Seconds a request may wait on the socket, a hung request would otherwise hold its connection forever
+REQUEST_TIMEOUT = 30
+# Shared by every service, so that all API calls draw from the same connections
+pool = HttpPool(timeout=REQUEST_TIMEOUT)
+
+
+def authorized_http(credentials: Optional[Credentials], http=None):
+    '''Build a thread-safe http object for googleapiclient, authorized with the given credentials.
+    Args:
+        credentials: The credentials to authorize requests with, none if None.
+        http: The http object to authorize, a PooledHttp on the shared pool if None.
+    '''
+    http = http or PooledHttp(pool)
+    if credentials is None:
+        return http
+    return AuthorizedHttp(credentials, http=http)
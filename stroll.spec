@@ -1,5 +1,9 @@
 # -*- mode: python ; coding: utf-8 -*-
 # NOTE: `pyinstaller stroll.spec ...` should be run after activating the venv to package modules appropriately 
+import os
+
+import googleapiclient.discovery_cache
+
 block_cipher = None
 
 datas = [
@@ -9,12 +13,19 @@ datas = [
     ('settings.default.toml', '.'),
     ('launch.vbs', '.')
 ]
+# The discovery documents the API is built from, read through googleapiclient's get_static_doc
+discovery_documents = os.path.join(os.path.dirname(googleapiclient.discovery_cache.__file__), 'documents')
+datas += [(os.path.join(discovery_documents, document), 'googleapiclient\\discovery_cache\\documents')
+          for document in ('calendar.v3.json', 'oauth2.v2.json')]
+
+# Imported by name on first use through lazy.LazyModule, which the analysis can't follow
+hiddenimports = ["pystray._win32", "util.api", "util.transport", "util.push"]
 
 a = Analysis(['src\\stroll.py'],
              pathex=[], 
              binaries=[],
              datas=datas,
-             hiddenimports=["pystray._win32"],
+             hiddenimports=hiddenimports,
              hookspath=[],
              runtime_hooks=[],
              excludes=['altgraph', 'future', 'pefile', 'pyinstaller', 'pyinstaller-hooks-contrib', 'pywin32-ctypes'],
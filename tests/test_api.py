@@ -0,0 +1,179 @@
+import threading
+from datetime import datetime, timedelta
+
+import httplib2
+import pytest
+from google.oauth2.credentials import Credentials
+
+from util import api
+
+
+class FakeHttp:
+    '''Answers every request with the same status, or raises the same error.'''
+
+    def __init__(self, status=200, error=None):
+        self.status = status
+        self.error = error
+        self.calls = 0
+
+    def request(self, uri, method="GET", body=None, headers=None, *args, **kwargs):
+        self.calls += 1
+        if self.error is not None:
+            raise self.error
+        return httplib2.Response({"status": self.status}), b"{}"
+
+
+@pytest.fixture(autouse=True)
+def breaker(monkeypatch):
+    breaker = api.CircuitBreaker(threshold=2)
+    monkeypatch.setattr(api, "breaker", breaker)
+    monkeypatch.setattr(api.time, "sleep", lambda seconds: None)
+    return breaker
+
+
+URI = "https://www.googleapis.com/calendar/v3/users/me/calendarList"
+
+
+def test_server_errors_are_returned_without_opening_the_breaker(breaker):
+    http = FakeHttp(status=503)
+    with api.priority(api.CRITICAL):
+        response, _ = api.ResilientHttp(http).request(URI)
+    assert response.status == 503
+    assert http.calls == api.RETRY_POLICIES[api.CRITICAL].retries + 1
+    assert not breaker.is_open
+
+
+def test_transport_failures_open_the_breaker(breaker):
+    http = FakeHttp(error=OSError("Network is unreachable"))
+    with api.priority(api.CRITICAL):
+        with pytest.raises(api.OfflineError):
+            api.ResilientHttp(http).request(URI)
+    assert breaker.is_open
+
+
+def test_a_response_closes_the_breaker(breaker):
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+    with api.priority(api.CRITICAL):
+        api.ResilientHttp(FakeHttp(status=500)).request(URI)
+    assert not breaker.is_open
+
+
+def make_manager(tmp_path, refresh_token, expires_in):
+    manager = api.CredentialManager(api.scopes, data_folder=str(tmp_path))
+    manager.loaded = True
+    manager.credentials = Credentials("token", refresh_token=refresh_token,
+                                      expiry=datetime.utcnow() + timedelta(seconds=expires_in))
+    return manager
+
+
+def test_credentials_without_refresh_token_back_off(tmp_path):
+    manager = make_manager(tmp_path, refresh_token=None, expires_in=-60)
+    assert not manager.refresh()
+    assert manager.seconds_until_refresh() == manager.REFRESH_MARGIN.total_seconds()
+    assert manager.needs_relink()
+
+
+def test_credentials_are_refreshed_ahead_of_expiry(tmp_path):
+    manager = make_manager(tmp_path, refresh_token="refresh", expires_in=60)
+    assert manager.seconds_until_refresh() == 0
+    assert not manager.needs_relink()
+
+
+class StubAccount:
+    '''Just what for_each_account needs of an account.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.last_success = self.last_error = self.overdue = None
+
+
+def test_hung_accounts_are_skipped_until_they_finish():
+    hung, healthy = StubAccount("hung"), StubAccount("healthy")
+    release = threading.Event()
+    calls = []
+
+    def work(account):
+        calls.append(account.name)
+        if account is hung:
+            release.wait(5)
+        return account.name
+
+    results = api.for_each_account(work, [hung, healthy], timeout=0.2)
+    assert isinstance(results["hung"], TimeoutError)
+    assert results["healthy"] == "healthy"
+
+    # The hung call is still running, it isn't called again
+    results = api.for_each_account(work, [hung, healthy], timeout=0.2)
+    assert isinstance(results["hung"], TimeoutError)
+    assert calls.count("hung") == 1
+
+    release.set()
+    hung.overdue.result(5)
+    assert api.for_each_account(work, [hung, healthy], timeout=1) == {"hung": "hung", "healthy": "healthy"}
+    assert calls.count("hung") == 2
+
+
+def gone():
+    return api.HttpError(httplib2.Response({"status": 410}), b'{"error": {"code": 410, "message": "Gone"}}')
+
+
+class SyncAccount(StubAccount):
+    '''An account with an in-memory copy of its calendars, already synced once.'''
+
+    def __init__(self, name, calendar_ids):
+        super().__init__(name)
+        self.mirror = api.EventMirror()
+        for calendar_id in calendar_ids:
+            self.mirror.apply(calendar_id, [{"id": "stale", "start": {"date": "2026-01-01"},
+                                             "end": {"date": "2026-01-02"}}], "expired", datetime(2026, 1, 1))
+
+
+FRESH = {"id": "fresh", "start": {"date": "2026-01-02"}, "end": {"date": "2026-01-03"}}
+
+
+def test_sync_falls_back_to_a_full_sync_when_the_token_expires(monkeypatch):
+    account = SyncAccount("default", ["work"])
+    queries = []
+
+    def list_all_events(calendar_id, **kwargs):
+        queries.append(kwargs)
+        if "syncToken" in kwargs:
+            raise gone()
+        return [FRESH], "new"
+    monkeypatch.setattr(api, "_list_all_events", list_all_events)
+
+    with api.use_account(account):
+        assert api.sync_events("work")
+    assert [sorted(query) for query in queries] == [["syncToken"], ["timeMin"]]
+    assert account.mirror.get_sync_token("work") == "new"
+    # The full sync replaced the copy
+    assert list(account.mirror.calendars["work"]["events"]) == ["fresh"]
+
+
+def test_batched_sync_falls_back_to_full_syncs_for_expired_tokens(monkeypatch):
+    account = SyncAccount("default", ["expired", "current"])
+    batches = []
+
+    def list_events_for_calendars(queries, parallel=False):
+        batches.append(queries)
+        results = {}
+        for calendar_id, query in queries.items():
+            if "syncToken" not in query:
+                results[calendar_id] = ([FRESH], "full")
+            elif calendar_id == "expired":
+                results[calendar_id] = gone()
+            else:
+                results[calendar_id] = ([], "incremental")
+        return results
+    monkeypatch.setattr(api, "list_events_for_calendars", list_events_for_calendars)
+
+    with api.use_account(account):
+        assert api.sync_many_events(["expired", "current", "new"]) == {}
+    # Incremental syncs first, then one batch of full syncs for the expired and the unsynced calendars
+    assert [sorted(batch) for batch in batches] == [["current", "expired"], ["expired", "new"]]
+    assert all("timeMin" in query for query in batches[1].values())
+    assert account.mirror.get_sync_token("expired") == "full"
+    assert list(account.mirror.calendars["expired"]["events"]) == ["fresh"]
+    assert account.mirror.get_sync_token("current") == "incremental"
+    assert account.mirror.get_sync_token("new") == "full"
@@ -0,0 +1,60 @@
+from datetime import datetime, time, timedelta
+
+from util.cadence import AdaptiveCadence, Cadence
+
+
+def adaptive(**kwargs):
+    return AdaptiveCadence(timedelta(minutes=10), timedelta(minutes=1), timedelta(hours=2),
+                           requests_per_hour=300, **kwargs)
+
+
+def test_idle_syncs_back_off_exponentially_up_to_max_period():
+    policy = adaptive()
+    now = datetime(2024, 1, 1, 12).astimezone()
+    delays = []
+    for _ in range(6):
+        policy.record_sync(now, changed=False)
+        decision = policy.next_sync(now)
+        delays.append(decision.delay)
+        now = decision.time
+    assert delays == [timedelta(minutes=20), timedelta(minutes=40), timedelta(minutes=80),
+                      timedelta(hours=2), timedelta(hours=2), timedelta(hours=2)]
+    assert policy.last_decision.reason == "no changes in 6 syncs"
+
+
+def test_changes_reset_the_backoff():
+    policy = adaptive()
+    now = datetime(2024, 1, 1, 12).astimezone()
+    for _ in range(3):
+        policy.record_sync(now, changed=False)
+    policy.record_sync(now, changed=True)
+    assert policy.next_sync(now).delay == timedelta(minutes=10)
+
+
+def test_quiet_hours_sync_every_max_period():
+    policy = adaptive(quiet_hours=(time(23), time(7)))
+    now = datetime(2024, 1, 1, 23, 30).astimezone()
+    assert policy.is_quiet(now)
+    decision = policy.next_sync(now)
+    assert decision.delay == timedelta(hours=2)
+    assert decision.reason == "quiet hours"
+
+
+def test_approaching_join_cuts_the_backoff_short():
+    policy = adaptive()
+    now = datetime(2024, 1, 1, 12).astimezone()
+    for _ in range(5):
+        policy.record_sync(now, changed=False)
+    decision = policy.next_sync(now, next_join=now + timedelta(minutes=30))
+    assert decision.delay == timedelta(minutes=20)
+    assert decision.reason == "join approaching"
+    assert policy.next_sync(now, next_join=now + timedelta(minutes=5)).delay == timedelta(minutes=1)
+
+
+def test_request_budget_spaces_syncs_out():
+    policy = Cadence(timedelta(minutes=10), requests_per_hour=10)
+    now = datetime(2024, 1, 1, 12).astimezone()
+    policy.record_sync(now, requests=10)
+    decision = policy.next_sync(now)
+    assert decision.delay == timedelta(hours=1)
+    assert decision.reason == "request budget"
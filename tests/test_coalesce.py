@@ -0,0 +1,91 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from util.coalesce import WindowCache
+
+START = datetime(2026, 1, 1, 9).astimezone()
+FILTERS = ["+Inside", "+OverStart", "+OverEnd", "+Across"]
+
+
+def make_event(name, start_minutes, end_minutes):
+    return {
+        "summary": name,
+        "start": {"dateTime": (START + timedelta(minutes=start_minutes)).isoformat()},
+        "end": {"dateTime": (START + timedelta(minutes=end_minutes)).isoformat()},
+    }
+
+
+EVENTS = [make_event("standup", 10, 20), make_event("review", 30, 50)]
+
+
+class BlockingFetch:
+    '''A fetch counting its calls, held in flight until released.'''
+
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self, time_from, time_to):
+        with self.lock:
+            self.calls.append((time_from, time_to))
+        self.started.set()
+        self.release.wait(5)
+        return EVENTS
+
+
+def window(start_minutes, end_minutes):
+    return START + timedelta(minutes=start_minutes), START + timedelta(minutes=end_minutes)
+
+
+def test_concurrent_queries_inside_a_fetch_share_it():
+    fetch = BlockingFetch()
+    cache = WindowCache(fetch)
+    results = {}
+
+    def query(name, start_minutes, end_minutes):
+        results[name] = cache.query(*window(start_minutes, end_minutes), FILTERS)
+
+    outer = threading.Thread(target=query, args=("outer", 0, 60))
+    outer.start()
+    assert fetch.started.wait(5)
+
+    inner = [threading.Thread(target=query, args=(f"inner{index}", 5 * index, 60 - 5 * index))
+             for index in range(1, 6)]
+    for thread in inner:
+        thread.start()
+    fetch.release.set()
+    for thread in [outer, *inner]:
+        thread.join(5)
+
+    assert fetch.calls == [window(0, 60)]
+    assert [event["summary"] for event in results["outer"]] == ["standup", "review"]
+    # Each query classifies the shared events against its own window
+    assert [event["overlapType"] for event in results["inner2"]] == ["Inside", "Inside"]
+    assert [event["overlapType"] for event in results["inner3"]] == ["OverStart", "OverEnd"]
+
+
+def test_results_are_reused_within_the_ttl():
+    fetch = BlockingFetch()
+    fetch.release.set()
+    cache = WindowCache(fetch, ttl=60)
+    cache.query(*window(0, 60), FILTERS)
+    cache.query(*window(15, 45), FILTERS)
+    assert len(fetch.calls) == 1
+
+
+def test_failed_fetches_are_raised_and_not_reused():
+    calls = []
+
+    def failing_fetch(time_from, time_to):
+        calls.append((time_from, time_to))
+        raise ConnectionError("offline")
+
+    cache = WindowCache(failing_fetch, ttl=60)
+    for _ in range(2):
+        with pytest.raises(ConnectionError):
+            cache.query(*window(0, 60), FILTERS)
+    assert len(calls) == 2
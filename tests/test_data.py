@@ -0,0 +1,63 @@
+import json
+
+from util.data import JsonFile, merge_dicts
+
+
+def test_session_changes_are_kept():
+    base = {"a": 1, "b": 2}
+    assert merge_dicts(base, {"a": 10, "b": 2}, base) == {"a": 10, "b": 2}
+
+
+def test_file_changes_are_taken():
+    base = {"a": 1, "b": 2}
+    assert merge_dicts(base, base, {"a": 1, "b": 20}) == {"a": 1, "b": 20}
+
+
+def test_changes_to_different_keys_are_combined():
+    base = {"a": 1, "b": 2}
+    assert merge_dicts(base, {"a": 10, "b": 2}, {"a": 1, "b": 20}) == {"a": 10, "b": 20}
+
+
+def test_conflicting_changes_keep_the_session_value():
+    base = {"a": 1}
+    assert merge_dicts(base, {"a": "session"}, {"a": "file"}) == {"a": "session"}
+
+
+def test_keys_added_on_either_side_are_kept():
+    base = {"a": 1}
+    merged = merge_dicts(base, {"a": 1, "session": True}, {"a": 1, "file": True})
+    assert merged == {"a": 1, "session": True, "file": True}
+
+
+def test_keys_deleted_on_one_side_are_dropped():
+    base = {"a": 1, "b": 2}
+    assert merge_dicts(base, {"b": 2}, base) == {"b": 2}
+    assert merge_dicts(base, base, {"a": 1}) == {"a": 1}
+
+
+def test_deleted_key_changed_on_the_other_side_is_kept():
+    base = {"a": 1}
+    assert merge_dicts(base, {}, {"a": 2}) == {"a": 2}
+    assert merge_dicts(base, {"a": 2}, {}) == {"a": 2}
+
+
+def test_nested_dictionaries_are_merged_key_by_key():
+    base = {"section": {"a": 1, "b": 2, "c": 3}}
+    session = {"section": {"a": 10, "b": 2, "c": "session"}}
+    file = {"section": {"a": 1, "b": 20, "c": "file"}}
+    assert merge_dicts(base, session, file) == {"section": {"a": 10, "b": 20, "c": "session"}}
+
+
+def test_dump_merges_concurrent_file_edits(tmp_path):
+    path = tmp_path / "session.json"
+    path.write_text(json.dumps({"a": 1, "b": 2}))
+    session = JsonFile(str(path))
+    session.load()
+
+    # Another process edits the file while the session changes a different key
+    path.write_text(json.dumps({"a": 1, "b": 20}))
+    session.set("a", 10)
+    session.dump()
+
+    assert json.loads(path.read_text()) == {"a": 10, "b": 20}
+    assert session.get("b") == 20
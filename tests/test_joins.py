@@ -0,0 +1,118 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from util.joins import reconcile_joins
+from util.scheduler import Task
+
+START = datetime(2026, 1, 1, 9).astimezone()
+OFFSET = timedelta(minutes=1)
+UNTIL = START + timedelta(hours=1)
+
+
+def make_event(event_id, start_minutes, etag="1", account="default"):
+    start = START + timedelta(minutes=start_minutes)
+    return {
+        "id": event_id,
+        "etag": etag,
+        "account": account,
+        "start": {"dateTime": start.isoformat()},
+        "end": {"dateTime": (start + timedelta(minutes=30)).isoformat()},
+    }
+
+
+class StubScheduler:
+    '''Records the tasks added and cancelled, without running them.'''
+
+    def __init__(self):
+        self.added = []
+        self.cancelled = []
+
+    def add_task(self, time, action, data=None):
+        task = Task(time, action, data)
+        self.added.append(task)
+        return task
+
+    def cancel_task(self, task):
+        task.cancelled = True
+        self.cancelled.append(task)
+
+
+class Joins:
+    '''The scheduled joins of a session, reconciled the way schedule_events does.'''
+
+    def __init__(self):
+        self.scheduler = StubScheduler()
+        self.scheduled = {}
+        self.joined = []
+
+    def reconcile(self, *events, until=UNTIL, failed_accounts=()):
+        return reconcile_joins(self.scheduled, {event["id"]: event for event in events}, self.scheduler,
+                               self.joined.append, OFFSET, until, failed_accounts)
+
+
+@pytest.fixture
+def joins():
+    return Joins()
+
+
+def test_new_events_are_scheduled_offset_before_they_start(joins):
+    added, removed = joins.reconcile(make_event("standup", 10))
+    assert [task.time for task in added] == [START + timedelta(minutes=10) - OFFSET]
+    assert removed == []
+    added[0].action()
+    assert joins.joined == ["standup"]
+
+
+def test_unchanged_events_are_left_alone(joins):
+    joins.reconcile(make_event("standup", 10))
+    assert joins.reconcile(make_event("standup", 10)) == ([], [])
+    assert len(joins.scheduler.added) == 1
+
+
+def test_edited_events_keep_their_join(joins):
+    [task] = joins.reconcile(make_event("standup", 10))[0]
+    edited = make_event("standup", 10, etag="2")
+    edited["description"] = "https://zoom.us/j/123"
+    assert joins.reconcile(edited) == ([], [])
+    # The join fires with the latest version of the event
+    assert joins.scheduled["standup"] is task
+    assert task.data is edited
+    assert joins.scheduler.cancelled == []
+
+
+def test_moved_events_are_rescheduled(joins):
+    [task] = joins.reconcile(make_event("standup", 10))[0]
+    added, removed = joins.reconcile(make_event("standup", 20, etag="2"))
+    assert removed == [task] and task.cancelled
+    assert [task.time for task in added] == [START + timedelta(minutes=20) - OFFSET]
+
+
+def test_cancelled_events_are_unscheduled(joins):
+    task, _ = joins.reconcile(make_event("standup", 10), make_event("review", 30))[0]
+    added, removed = joins.reconcile(make_event("review", 30))
+    assert added == [] and removed == [task]
+    assert "standup" not in joins.scheduled
+
+
+def test_fired_joins_are_not_repeated(joins):
+    [task] = joins.reconcile(make_event("standup", 10))[0]
+    # The scheduler marks tasks done once they fire
+    task.cancelled = True
+    assert joins.reconcile(make_event("standup", 10)) == ([], [])
+    assert len(joins.scheduler.added) == 1
+
+
+def test_joins_of_failed_accounts_are_kept(joins):
+    [task] = joins.reconcile(make_event("standup", 10, account="work"))[0]
+    assert joins.reconcile(failed_accounts={"work"}) == ([], [])
+    assert joins.scheduled["standup"] is task and not task.cancelled
+    # Once the account answers again without the event, it's removed
+    assert joins.reconcile() == ([], [task])
+
+
+def test_joins_past_the_time_span_are_kept(joins):
+    [task] = joins.reconcile(make_event("planning", 90), until=START + timedelta(hours=2))[0]
+    # A shorter query didn't look as far as the event
+    assert joins.reconcile(until=UNTIL) == ([], [])
+    assert joins.scheduled["planning"] is task
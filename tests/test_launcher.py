@@ -0,0 +1,93 @@
+import json
+import os
+import stat
+import sys
+
+import psutil
+import pytest
+
+from util.launcher import Launcher
+
+pytestmark = pytest.mark.skipif(os.name == "nt", reason="the stub client is started through its shebang")
+
+STUB = """#!{python}
+import json, os, sys, time
+# Records how it was started, in its working directory
+with open("argv.jsonl", "a") as log:
+    log.write(json.dumps({{"argv": sys.argv[1:], "cwd": os.getcwd()}}) + "\\n")
+if not any(argument.startswith("--url=") for argument in sys.argv[1:]):
+    # Started without a URL, keeps running like the client would
+    time.sleep(30)
+sys.exit({exit_code})
+"""
+
+
+class StubLauncher(Launcher):
+    # The stub runs under the interpreter, so its processes are found by their command line
+    def find_processes(self):
+        processes = []
+        for process in psutil.process_iter(["cmdline"]):
+            if self.executable in (process.info["cmdline"] or [])[1:2]:
+                processes.append(process)
+        return processes
+
+
+@pytest.fixture
+def make_stub(tmp_path):
+    launchers = []
+
+    def make_stub(exit_code=0):
+        path = tmp_path / "client"
+        path.write_text(STUB.format(python=sys.executable, exit_code=exit_code))
+        path.chmod(path.stat().st_mode | stat.S_IXUSR)
+        launcher = StubLauncher(str(path), ready_timeout=5)
+        launchers.append(launcher)
+        return launcher
+    yield make_stub
+    for launcher in launchers:
+        for process in launcher.find_processes():
+            process.kill()
+
+
+def read_starts(launcher):
+    with open(os.path.join(os.path.dirname(launcher.executable), "argv.jsonl")) as log:
+        return [json.loads(line) for line in log]
+
+
+def test_url_is_passed_as_one_argument_without_a_shell(make_stub):
+    launcher = make_stub()
+    url = "zoommtg://zoom.us/join?action=join&confno=123&pwd=a b;echo $HOME"
+    launch = launcher.launch(url)
+    assert launch.latency is not None
+    assert launch.cold
+    [start] = read_starts(launcher)
+    assert start["argv"] == [f"--url={url}"]
+    # Run from the client's directory instead of Stroll's
+    assert start["cwd"] == os.path.dirname(launcher.executable)
+
+
+def test_prewarm_starts_the_client_once(make_stub):
+    launcher = make_stub()
+    assert launcher.prewarm()
+    assert launcher.is_alive()
+    assert not launcher.prewarm()
+    launch = launcher.launch("zoommtg://zoom.us/join?confno=123")
+    assert not launch.cold
+    assert [start["argv"] for start in read_starts(launcher)] == [[], ["--url=zoommtg://zoom.us/join?confno=123"]]
+
+
+def test_failed_launch_is_not_ready(make_stub):
+    launcher = make_stub(exit_code=1)
+    launch = launcher.launch("zoommtg://zoom.us/join?confno=123")
+    assert launch.latency is None
+    assert launcher.launches[-1] is launch
+
+
+def test_missing_client_fails_without_raising(tmp_path):
+    launcher = StubLauncher(str(tmp_path / "missing" / "client"), ready_timeout=5)
+    assert not launcher.prewarm()
+    assert isinstance(launcher.start_error, FileNotFoundError)
+    launch = launcher.launch("zoommtg://zoom.us/join?confno=123")
+    assert launch.latency is None
+    assert isinstance(launch.error, FileNotFoundError)
+    assert launcher.launches[-1] is launch
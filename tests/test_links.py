@@ -0,0 +1,59 @@
+import pytest
+
+from util import links
+from util.links import find_meeting, scan
+
+
+@pytest.mark.parametrize("text, host, number, password", [
+    ("Join: https://zoom.us/j/123456789", "zoom.us", "123456789", None),
+    ("https://us02web.zoom.us/j/12345678901?pwd=abc.DEF-1", "us02web.zoom.us", "12345678901", "abc.DEF-1"),
+    # Vanity hosts of companies
+    ("https://acme.zoom.us/w/123456789?pwd=secret", "acme.zoom.us", "123456789", "secret"),
+    ("https://agency.zoomgov.com/j/123456789", "agency.zoomgov.com", "123456789", None),
+    ("zoommtg://acme.zoom.us/join?action=join&confno=123456789&pwd=secret",
+     "acme.zoom.us", "123456789", "secret"),
+    # HTML encoded queries in descriptions
+    ('<a href="https://zoom.us/j/123456789?uname=x&amp;pwd=secret">Join</a>', "zoom.us", "123456789", "secret"),
+    ("zoommtg://zoom.us/join?action=join&amp;confno=123456789&amp;pwd=secret", "zoom.us", "123456789", "secret"),
+    ("Meeting 123456789?pwd=secret", "zoom.us", "123456789", "secret"),
+])
+def test_links_are_found(text, host, number, password):
+    meeting = scan(text)
+    assert (meeting.host, meeting.number, meeting.password) == (host, number, password)
+
+
+@pytest.mark.parametrize("text", [
+    "https://zoom.us.example.com/j/123456789",
+    "https://evilzoom.us/j/123456789",
+    "https://zoom.usa.com/j/123456789",
+    "https://example.com/zoom.us/j/123456789",
+    "https://zoom.us/j/1234",
+    "zoom.us/j/123456789",
+])
+def test_look_alikes_are_rejected(text):
+    assert scan(text) is None
+
+
+def test_conference_data_is_preferred_over_free_text():
+    event = {
+        "id": "event", "etag": "1",
+        "description": "Old link https://zoom.us/j/111111111",
+        "conferenceData": {"entryPoints": [
+            {"entryPointType": "phone", "uri": "tel:+1555"},
+            {"entryPointType": "video", "uri": "https://acme.zoom.us/j/222222222", "password": "fromdata"},
+        ]},
+    }
+    meeting = find_meeting(event)
+    assert (meeting.host, meeting.number, meeting.password) == ("acme.zoom.us", "222222222", "fromdata")
+
+
+def test_events_are_scanned_again_once_changed():
+    event = {"id": "changing", "etag": "1", "location": "https://zoom.us/j/111111111"}
+    assert find_meeting(event).number == "111111111"
+    event["location"] = "https://zoom.us/j/222222222"
+    # The same version is answered from the cache
+    assert find_meeting(event).number == "111111111"
+    event["etag"] = "2"
+    assert find_meeting(event).number == "222222222"
+    assert find_meeting({"id": "none", "etag": "1", "description": "No link"}) is None
+    assert ("none", "1") in links._cache
@@ -0,0 +1,88 @@
+import http.client
+import threading
+from datetime import datetime, timedelta
+
+import httplib2
+import pytest
+
+from util import api, push
+
+
+class Recorder:
+    '''Records the calendars on_change is called with, and the account in use at the time.'''
+
+    def __init__(self):
+        self.calls = []
+        self.called = threading.Event()
+
+    def __call__(self, calendar_id):
+        self.calls.append((api.get_account().name, calendar_id))
+        self.called.set()
+
+
+@pytest.fixture
+def receiver():
+    recorder = Recorder()
+    manager = push.ChannelManager("https://example.com/notify", recorder)
+    expiration = datetime.now().astimezone() + timedelta(days=1)
+    manager.channels["channel"] = {"account": api.DEFAULT_ACCOUNT, "calendarId": "work@example.com",
+                                   "resourceId": "resource", "expiration": expiration}
+    receiver = push.NotificationReceiver(manager, 0)
+    receiver.start()
+    yield receiver, recorder
+    receiver.stop()
+
+
+def send(receiver, **headers):
+    # Posts a notification as Google would, the change is described by the headers alone
+    headers = {"X-Goog-Channel-ID": "channel", "X-Goog-Resource-State": "exists", **headers}
+    connection = http.client.HTTPConnection(*receiver.server_address, timeout=5)
+    try:
+        connection.request("POST", "/", body=b"", headers=headers)
+        return connection.getresponse().status
+    finally:
+        connection.close()
+
+
+def test_notification_syncs_calendar_with_its_account(receiver):
+    receiver, recorder = receiver
+    assert send(receiver, **{"X-Goog-Channel-Token": receiver.manager.token}) == 200
+    assert recorder.called.wait(5)
+    assert recorder.calls == [(api.DEFAULT_ACCOUNT, "work@example.com")]
+
+
+def test_sync_notification_is_only_acknowledged(receiver):
+    receiver, recorder = receiver
+    assert send(receiver, **{"X-Goog-Channel-Token": receiver.manager.token,
+                             "X-Goog-Resource-State": "sync"}) == 200
+    assert not recorder.called.wait(0.2)
+
+
+@pytest.mark.parametrize("headers", [
+    {"X-Goog-Channel-Token": "forged"},
+    {"X-Goog-Channel-ID": "unknown"},
+])
+def test_unknown_notifications_are_rejected(receiver, headers):
+    receiver, recorder = receiver
+    headers.setdefault("X-Goog-Channel-Token", receiver.manager.token)
+    assert send(receiver, **headers) == 404
+    assert not recorder.called.wait(0.2)
+
+
+def test_unwatchable_calendars_are_left_to_polling(monkeypatch):
+    opened = []
+
+    def watch_events(calendar_id, channel_id, address, token, ttl):
+        if calendar_id == "holidays@example.com":
+            raise api.HttpError(httplib2.Response({"status": 400}), b"push not supported")
+        opened.append(calendar_id)
+        expiration = (datetime.now() + ttl).timestamp() * 1000
+        return {"resourceId": calendar_id, "expiration": str(int(expiration))}
+    monkeypatch.setattr(api, "watch_events", watch_events)
+    manager = push.ChannelManager("https://example.com/notify", lambda calendar_id: None)
+    renew_before = datetime.now().astimezone() + timedelta(hours=1)
+
+    assert manager.watch(["work@example.com", "holidays@example.com"], renew_before) == {"holidays@example.com"}
+    # Rejected calendars aren't asked for again, open channels are kept
+    assert manager.watch(["work@example.com", "holidays@example.com"], renew_before) == {"holidays@example.com"}
+    assert opened == ["work@example.com"]
@@ -0,0 +1,105 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+
+from util.scheduler import Scheduler
+
+
+class Recorder:
+    '''Actions recording the order they fire in.'''
+
+    def __init__(self, expected):
+        self.fired = []
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.expected = expected
+
+    def action(self, name):
+        def fire():
+            with self.lock:
+                self.fired.append(name)
+                if len(self.fired) >= self.expected:
+                    self.done.set()
+        return fire
+
+
+@pytest.fixture
+def scheduler():
+    scheduler = Scheduler()
+    scheduler.start(auto_stop=True)
+    yield scheduler
+    if not scheduler.terminated:
+        scheduler.terminate()
+
+
+def soon(seconds):
+    return datetime.now().astimezone() + timedelta(seconds=seconds)
+
+
+def test_tasks_fire_in_time_order(scheduler):
+    recorder = Recorder(4)
+    scheduler.add_task(soon(0.3), recorder.action("third"))
+    scheduler.add_task(soon(0.1), recorder.action("first"))
+    scheduler.add_tasks([(soon(0.2), recorder.action("second")), (soon(0.3), recorder.action("fourth"))])
+    assert recorder.done.wait(5)
+    # Tasks at the same time fire in the order they were added
+    assert recorder.fired == ["first", "second", "third", "fourth"]
+    assert len(scheduler) == 0
+
+
+def test_cancelled_tasks_dont_fire(scheduler):
+    recorder = Recorder(2)
+    first = scheduler.add_task(soon(0.1), recorder.action("first"))
+    scheduler.add_task(soon(0.2), recorder.action("second"))
+    scheduler.add_task(soon(0.3), recorder.action("third"))
+    scheduler.cancel_task(first)
+    scheduler.cancel_task(first)
+    assert len(scheduler) == 2
+    assert recorder.done.wait(5)
+    assert recorder.fired == ["second", "third"]
+
+
+def test_paused_tasks_fire_once_resumed(scheduler):
+    recorder = Recorder(1)
+    scheduler.pause()
+    scheduler.add_task(soon(0.1), recorder.action("late"))
+    assert not recorder.done.wait(0.4)
+    scheduler.resume()
+    assert recorder.done.wait(5)
+    assert recorder.fired == ["late"]
+    assert scheduler.lateness[-1] >= 0.2
+
+
+def test_lateness_includes_waiting_for_a_worker(scheduler):
+    recorder = Recorder(1)
+    release = threading.Event()
+    # Every worker is busy when the task fires
+    for _ in range(scheduler.runtime.executor._max_workers):
+        scheduler.runtime.run_blocking(release.wait, 5)
+    task = scheduler.add_task(soon(0.05), recorder.action("queued"))
+    threading.Timer(0.4, release.set).start()
+    assert recorder.done.wait(5)
+    assert task.lateness >= 0.3
+
+
+def test_terminated_scheduler_drops_tasks_and_refuses_new_ones(scheduler):
+    recorder = Recorder(1)
+    task = scheduler.add_task(soon(0.2), recorder.action("dropped"))
+    scheduler.terminate()
+    assert task.cancelled
+    assert not recorder.done.wait(0.4)
+    with pytest.raises(Exception):
+        scheduler.add_task(soon(0.1), recorder.action("refused"))
+
+
+def test_head_skips_cancelled_tasks():
+    # Not started, nothing fires
+    scheduler = Scheduler()
+    later = scheduler.add_task(soon(60), None)
+    sooner = scheduler.add_task(soon(30), None)
+    assert scheduler.head is sooner
+    scheduler.cancel_task(sooner)
+    assert scheduler.head is later
+    scheduler.clear()
+    assert scheduler.head is None and later.cancelled
@@ -0,0 +1,61 @@
+import os
+import shutil
+from datetime import time
+from typing import Tuple, Union
+
+import pytest
+
+from util.data import TomlFile
+from util.settings import Settings, _convert
+
+DEFAULTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "settings.default.toml")
+
+
+@pytest.fixture
+def settings(tmp_path):
+    default_path = tmp_path / "settings.default.toml"
+    shutil.copy(DEFAULTS, default_path)
+    settings = TomlFile(str(tmp_path / "settings.user.toml"), str(default_path), snapshot_type=Settings)
+    settings.load()
+    return settings
+
+
+def write(settings, old, new):
+    with open(settings.active_path) as file:
+        contents = file.read()
+    assert old in contents
+    with open(settings.active_path, "w") as file:
+        file.write(contents.replace(old, new))
+    # Forces a reload even if the modification time didn't visibly change
+    settings.mtime = None
+
+
+@pytest.mark.parametrize("value", ["*", 5, ["*", 5]])
+def test_tuple_rejects_other_shapes(value):
+    with pytest.raises(ValueError):
+        _convert("Syncing.calendars", value, Tuple[str, ...])
+
+
+def test_tuple_accepts_lists():
+    assert _convert("Syncing.calendars", ["a", "b"], Tuple[str, ...]) == ("a", "b")
+    assert _convert("Syncing.quiet-hours", False, Union[bool, Tuple[time, ...]]) is False
+
+
+@pytest.mark.parametrize("old, new", [
+    ('calendars = [ "*"]', 'calendars = "*"'),
+    ("quiet-hours = [23:00:00, 07:00:00]", 'quiet-hours = "none"'),
+    ("quiet-hours = [23:00:00, 07:00:00]", "quiet-hours = true"),
+])
+def test_malformed_settings_keep_last_good_snapshot(settings, old, new):
+    good = settings.snapshot
+    write(settings, old, new)
+    assert settings.reload_if_changed()
+    assert settings.snapshot is good
+    assert isinstance(settings.snapshot_error, ValueError)
+
+
+def test_malformed_settings_at_startup_fall_back_to_defaults(settings):
+    write(settings, 'calendars = [ "*"]', 'calendars = "*"')
+    fresh = TomlFile(settings.active_path, settings.default_file_path, snapshot_type=Settings)
+    assert fresh.snapshot.syncing.calendars == ("*",)
+    assert isinstance(fresh.snapshot_error, ValueError)
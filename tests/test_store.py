@@ -0,0 +1,114 @@
+import sqlite3
+from datetime import datetime, timedelta
+
+import pytest
+
+from util import store
+from util.store import EventStore
+
+START = datetime(2026, 1, 1, 9).astimezone()
+
+
+def make_event(event_id, start_minutes, end_minutes, **fields):
+    return {
+        "id": event_id,
+        "start": {"dateTime": (START + timedelta(minutes=start_minutes)).isoformat()},
+        "end": {"dateTime": (START + timedelta(minutes=end_minutes)).isoformat()},
+        **fields,
+    }
+
+
+def at(minutes):
+    return START + timedelta(minutes=minutes)
+
+
+def ids(events):
+    return [event["id"] for event in events]
+
+
+@pytest.fixture
+def events_store(tmp_path):
+    events_store = EventStore(str(tmp_path / "events.db"))
+    yield events_store
+    events_store.connection.close()
+
+
+def test_long_events_overlapping_the_span_are_found(events_store):
+    # Starts long before the span, found only because the longest event bounds how far back to look
+    events_store.apply("work", [make_event("offsite", -600, 600), make_event("standup", 10, 20)],
+                       "token", synced_from=at(-1440))
+    assert ids(events_store.get_events_in_time_span("work", at(0), at(30))) == ["offsite", "standup"]
+    # Ended before the span
+    assert ids(events_store.get_events_in_time_span("work", at(700), at(800))) == []
+
+
+def test_max_duration_grows_with_incremental_syncs(events_store):
+    events_store.apply("work", [make_event("standup", 10, 20)], "first", synced_from=at(-1440))
+    events_store.apply("work", [make_event("offsite", -600, 600)], "second")
+    assert ids(events_store.get_events_in_time_span("work", at(0), at(5))) == ["offsite"]
+    assert events_store.get_sync_token("work") == "second"
+
+
+def test_cancellations_remove_events(events_store):
+    events_store.apply("work", [make_event("standup", 10, 20), make_event("review", 30, 50)],
+                       "first", synced_from=at(-1440))
+    events_store.apply("work", [{"id": "standup", "status": "cancelled"}], "second")
+    assert ids(events_store.get_events_in_time_span("work", at(0), at(60))) == ["review"]
+
+
+def test_full_sync_replaces_the_calendar(events_store):
+    events_store.apply("work", [make_event("standup", 10, 20)], "first", synced_from=at(-1440))
+    events_store.apply("work", [make_event("review", 30, 50)], "second", synced_from=at(0))
+    assert ids(events_store.get_events_in_time_span("work", at(0), at(60))) == ["review"]
+    assert events_store.get_synced_from("work") == at(0)
+
+
+def test_accounts_only_see_their_own_calendars(events_store):
+    other = events_store.for_account("other")
+    events_store.apply("shared", [make_event("mine", 10, 20)], "token", synced_from=at(-1440))
+    other.apply("shared", [make_event("theirs", 30, 40)], "token", synced_from=at(-1440))
+    assert ids(events_store.get_events_in_time_span("shared", at(0), at(60))) == ["mine"]
+    assert ids(other.get_events_in_time_span("shared", at(0), at(60))) == ["theirs"]
+
+    other.forget_account()
+    assert other.get_calendar_ids() == []
+    assert other.get_last_synced() is None
+    assert events_store.get_calendar_ids() == ["shared"]
+
+
+def test_events_of_calendars_are_merged_by_start(events_store):
+    events_store.apply("work", [make_event("a", 10, 20), make_event("c", 40, 50)], "token", synced_from=at(-1440))
+    events_store.apply("home", [make_event("b", 25, 35)], "token", synced_from=at(-1440))
+    assert ids(events_store.get_events_in_time_span(["work", "home", "unknown"], at(0), at(60))) == ["a", "b", "c"]
+
+
+def test_latest_event_before(events_store):
+    events_store.apply("work", [make_event("a", 10, 20), make_event("b", 30, 40)], "token", synced_from=at(-1440))
+    events_store.apply("home", [make_event("c", 35, 45)], "token", synced_from=at(-1440))
+    assert events_store.get_latest_event_before(["work", "home"], at(60))["id"] == "c"
+    # Starting at the time itself isn't before it
+    assert events_store.get_latest_event_before(["work", "home"], at(35))["id"] == "b"
+    assert events_store.get_latest_event_before(
+        ["work", "home"], at(60), predicate=lambda event: event["id"] != "c")["id"] == "b"
+    assert events_store.get_latest_event_before(["work", "home"], at(60), since=at(40)) is None
+
+
+def test_older_schemas_are_dropped(tmp_path):
+    path = str(tmp_path / "events.db")
+    connection = sqlite3.connect(path)
+    with connection:
+        connection.execute("CREATE TABLE calendars (id TEXT PRIMARY KEY, sync_token TEXT)")
+        connection.execute("INSERT INTO calendars VALUES ('work', 'stale')")
+        connection.execute(f"PRAGMA user_version = {store.SCHEMA_VERSION - 1}")
+    connection.close()
+
+    events_store = EventStore(path)
+    assert events_store.get_calendar_ids() == []
+    assert events_store.connection.execute("PRAGMA user_version").fetchone()[0] == store.SCHEMA_VERSION
+    events_store.apply("work", [make_event("standup", 10, 20)], "token", synced_from=at(-1440))
+    events_store.connection.close()
+
+    # The current schema is kept
+    events_store = EventStore(path)
+    assert events_store.get_sync_token("work") == "token"
+    events_store.connection.close()